@@ -0,0 +1,149 @@
+### Packages
+import os
+import sys
+import csv
+import time
+import numpy as np
+import torch
+from argparse import ArgumentParser
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+
+### Code imports
+from data.dataset import load_or_generate_dataset
+from data.events import EventSet, EventBatches
+from models.build import build_model
+from models.constantvelocity.vectorized import VectorizedConstantVelocityModel
+from models.constantvelocity.stepwise import CHECKPOINT_SEGMENTS
+from utils.compute.compilation import enable_compiled_kernels
+from utils.compute.memory import reset_peak_memory, peak_memory_bytes
+from utils.compute.threads import configure_threads, print_thread_configuration
+
+
+## Models and variants of the benchmark and columns of the results table.
+## A variant is compared against the default eager execution of the same model.
+BENCHMARK_MODELS = ['stepwise', 'stepbeta', 'vectorized']
+BENCHMARK_VARIANTS = ['compiled', 'checkpointed']
+RESULT_COLUMNS = ['dataset', 'model', 'variant', 'num_nodes', 'batch_size', 'baseline_ms', 'variant_ms', 'speedup',
+                    'max_abs_diff', 'baseline_peak_mb', 'variant_peak_mb']
+
+
+def benchmark_model(name:str, num_nodes:int, model_beta:float, max_time:float, num_steps:int, device, checkpoint_segments=None) -> torch.nn.Module:
+    '''
+    Builds a model of the benchmark with a fixed initialization
+    '''
+    torch.manual_seed(0)
+    if name == 'stepwise':
+        return build_model(vectorized=2, num_nodes=num_nodes, model_beta=model_beta, device=device,
+                            max_time=max_time, num_steps=num_steps, checkpoint_segments=checkpoint_segments)
+    if name == 'stepbeta':
+        return build_model(vectorized=2, num_nodes=num_nodes, model_beta=np.asarray([model_beta]*num_steps),
+                            device=device, max_time=max_time, num_steps=num_steps)
+    if name == 'vectorized':
+        ## The real datasets have no true initial conditions, so the model is initialized randomly
+        model = VectorizedConstantVelocityModel(n_points=num_nodes, beta=model_beta, device=device, z0=None, v0=None, true_init=False)
+        return model.to(device, dtype=torch.float32)
+    raise Exception(f'Unknown benchmark model: {name}')
+
+
+def prepared_batches(events:EventSet, model:torch.nn.Module, batch_size:int, num_batches:int, device) -> list:
+    '''
+    The first batches of the training set, split and prepared for the model as the gym does
+    '''
+    batches = EventBatches(events, batch_size=batch_size)
+    batches.batches = batches.batches[:num_batches]
+    batches.prepare(device, dtype=model.z0.dtype, start_times=getattr(model, 'start_times', None), end_times=getattr(model, 'end_times', None))
+    return list(batches)
+
+
+def time_training_steps(model:torch.nn.Module, batches:list, t0:float, iterations:int, warmup:int, device):
+    '''
+    Times forward and backward passes over the batches, after warmup passes
+    which let the compilers specialize to the batch shapes
+
+    :returns:   Milliseconds per batch, the losses of the first pass over the batches and
+                the peak memory in MB on cuda devices, None on cpu where the peak can not be reset
+    '''
+    reset_peak_memory(device)
+    def run_batches():
+        losses = []
+        for batch in batches:
+            model.zero_grad()
+            loss = model(batch, t0=t0, tn=batch.t[-1])
+            loss.backward()
+            losses.append(loss.item())
+        return losses
+
+    losses = run_batches()
+    for _ in range(warmup):
+        run_batches()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        run_batches()
+    milliseconds = (time.perf_counter() - start)*1000 / (iterations*len(batches))
+    peak_mb = peak_memory_bytes(device) / 2**20 if torch.device(device).type == 'cuda' else None
+    return milliseconds, losses, peak_mb
+
+
+if __name__ == '__main__':
+
+    ### Parse Arguments for running in terminal
+    arg_parser = ArgumentParser()
+    arg_parser.add_argument('--datasets', '-DS', default=[1, 3], type=int, nargs='+')
+    arg_parser.add_argument('--real_data', '-RD', default=1, type=int)
+    arg_parser.add_argument('--models', '-M', default=BENCHMARK_MODELS, choices=BENCHMARK_MODELS, nargs='+')
+    arg_parser.add_argument('--variant', '-V', default='compiled', choices=BENCHMARK_VARIANTS)
+    ## Prepared batches need no positions, so by default the segments which apply to training are checkpointed
+    arg_parser.add_argument('--checkpoint_segments', '-CKPT', default=['event', 'integral'], choices=CHECKPOINT_SEGMENTS, nargs='+')
+    arg_parser.add_argument('--steps', '-steps', default=10, type=int)
+    arg_parser.add_argument('--batch_size', '-BS', default=1000, type=int)
+    arg_parser.add_argument('--num_batches', '-NB', default=5, type=int)
+    arg_parser.add_argument('--iterations', '-IT', default=10, type=int)
+    arg_parser.add_argument('--warmup', '-WU', default=3, type=int)
+    arg_parser.add_argument('--num_threads', '-NT', default=None, type=int)
+    arg_parser.add_argument('--device', '-device', default='cpu', type=str)
+    arg_parser.add_argument('--output', '-O', default=None, type=str)
+    args = arg_parser.parse_args()
+
+    print_thread_configuration(configure_threads(num_threads=args.num_threads))
+
+    rows = []
+    for dataset_number in args.datasets:
+        dataset, num_nodes, _, _, _, model_beta, max_time = load_or_generate_dataset(real_data=args.real_data, dataset_number=dataset_number,
+                                                                                    vectorized=2, seed=1, device=args.device)
+        events = EventSet.from_tensor(dataset, num_nodes=num_nodes)
+        t0 = events.t[0].item()
+
+        for name in args.models:
+            if args.variant == 'checkpointed' and name != 'stepwise':
+                print(f'Checkpointing is an option of the stepwise model, skipping {name}')
+                continue
+            row = {'dataset': dataset_number, 'model': name, 'variant': args.variant, 'num_nodes': num_nodes, 'batch_size': args.batch_size}
+            model = benchmark_model(name, num_nodes, float(model_beta), float(max_time), args.steps, args.device)
+            batches = prepared_batches(events, model, args.batch_size, args.num_batches, args.device)
+            row['baseline_ms'], baseline_losses, row['baseline_peak_mb'] = time_training_steps(model, batches, t0, args.iterations,
+                                                                                                args.warmup, args.device)
+
+            if args.variant == 'compiled':
+                enable_compiled_kernels(True)
+            else:
+                model = benchmark_model(name, num_nodes, float(model_beta), float(max_time), args.steps, args.device,
+                                        checkpoint_segments=args.checkpoint_segments)
+            row['variant_ms'], variant_losses, row['variant_peak_mb'] = time_training_steps(model, batches, t0, args.iterations,
+                                                                                            args.warmup, args.device)
+            enable_compiled_kernels(False)
+
+            row['speedup'] = row['baseline_ms'] / row['variant_ms']
+            row['max_abs_diff'] = float(np.max(np.abs(np.asarray(baseline_losses) - np.asarray(variant_losses))))
+            memory = f", peak memory {row['baseline_peak_mb']:.1f} MB vs {row['variant_peak_mb']:.1f} MB" if row['variant_peak_mb'] is not None else ''
+            print(f"Dataset {dataset_number}, {name}: eager {row['baseline_ms']:.2f} ms, {args.variant} {row['variant_ms']:.2f} ms "
+                    f"per batch, speedup {row['speedup']:.2f}x, max loss difference {row['max_abs_diff']:.3g}{memory}")
+            rows.append(row)
+
+    if args.output is not None:
+        with open(args.output, 'w', newline='') as results_file:
+            writer = csv.DictWriter(results_file, fieldnames=RESULT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f'Saved the benchmark results to {args.output}')
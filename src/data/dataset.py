@@ -0,0 +1,45 @@
+from data.synthetic.datasets.init_params import get_initial_parameters
+from data.synthetic.builder import DatasetBuilder
+from data.synthetic.stepwisebuilder import StepwiseDatasetBuilder
+from data.synthetic.sampling.constantvelocity import ConstantVelocitySimulator
+from data.synthetic.sampling.tensor_stepwiseconstantvelocity import StepwiseConstantVelocitySimulator
+from data.real.load_dataset import load_real_dataset
+from data.events import EventSet
+
+
+def load_or_generate_dataset(real_data:int, dataset_number:int, vectorized:int, seed:int, device, as_events:bool=False):
+    '''
+    Either simulates a synthetic dataset from its known parameters or loads a real world dataset
+
+    :param real_data:       1 for real data and 0 for synthesized data
+    :param dataset_number:  Id of the dataset to load or generate
+    :param vectorized:      The model type, 2 simulates from the stepwise constant velocity model
+    :param seed:            Seed of the simulation
+    :param device:          Device for torch i.e. cpu or cuda
+    :param as_events:       Returns the events as an EventSet instead of the (E,3) float64 tensor
+
+    :returns:   The dataset with columns [node_i, node_j, time_point], the number of nodes,
+                the true z0, v0 and beta (None for real data), the initial model beta and the max time
+    '''
+    if real_data == 0:
+        ## Defining parameters for synthetic data generation
+        z0, v0, true_beta, model_beta, max_time = get_initial_parameters(dataset_number=dataset_number, vectorized=vectorized)
+        num_nodes = z0.shape[0]
+
+        ## Initialize data builder for simulating node interactions from known Poisson Process
+        if vectorized != 2:
+            simulator = ConstantVelocitySimulator(starting_positions=z0, velocities=v0, T=max_time, beta=true_beta, seed=seed)
+            data_builder = DatasetBuilder(simulator, device=device)
+        else:
+            simulator = StepwiseConstantVelocitySimulator(starting_positions=z0, velocities=v0, max_time=max_time, beta=true_beta, seed=seed)
+            data_builder = StepwiseDatasetBuilder(simulator=simulator, device=device, normalization_max_time=None)
+        dataset = data_builder.build_dataset(num_nodes, time_column_idx=2)
+    else:
+        print(f"Loading real dataset number {dataset_number}")
+        dataset, num_nodes, model_beta = load_real_dataset(dataset_number=dataset_number)
+        z0, v0, true_beta = None, None, None
+        max_time = max(dataset[:,2])
+
+    if as_events:
+        dataset = EventSet.from_tensor(dataset, num_nodes=num_nodes)
+    return dataset, num_nodes, z0, v0, true_beta, model_beta, max_time
@@ -0,0 +1,245 @@
+import torch
+from utils.nodes.positions import find_steps_and_offsets
+
+
+class StepStatistics:
+    '''
+    Sufficient statistics of the events of a stepwise model per active (pair, step).
+    Within a step the squared distance of a pair is a quadratic polynomial in the time since
+    the start of the step, so the event term of all its events in the step only depends on
+    the number of events, the sum of their offsets and the sum of their squared offsets.
+    '''
+    def __init__(self, src:torch.Tensor, dst:torch.Tensor, step:torch.Tensor,
+                    count:torch.Tensor, sum_offset:torch.Tensor, sum_sq_offset:torch.Tensor) -> None:
+        self.src = src
+        self.dst = dst
+        self.step = step
+        self.count = count
+        self.sum_offset = sum_offset
+        self.sum_sq_offset = sum_sq_offset
+
+    @classmethod
+    def from_events(cls, pair_ids:torch.Tensor, step_index:torch.Tensor, step_offset:torch.Tensor,
+                        num_nodes:int, num_steps:int, dtype=torch.float32):
+        '''
+        :param pair_ids:    Flat pair id i*num_nodes + j of every event
+        :param step_index:  Step of every event
+        :param step_offset: Time of every event since the start of its step
+        :param num_nodes:   Number of nodes
+        :param num_steps:   Number of steps
+        :param dtype:       Dtype of the model parameters, the sums are accumulated in float64 and cast to it
+        '''
+        keys, key_inverse = torch.unique(pair_ids*num_steps + step_index, return_inverse=True)
+        step_offset = step_offset.to(torch.float64)
+        sums = torch.zeros(size=(3, len(keys)), dtype=torch.float64, device=pair_ids.device)
+        sums[0].index_add_(0, key_inverse, torch.ones_like(step_offset))
+        sums[1].index_add_(0, key_inverse, step_offset)
+        sums[2].index_add_(0, key_inverse, torch.square(step_offset))
+        pairs = torch.div(keys, num_steps, rounding_mode='floor')
+        return cls(src=torch.div(pairs, num_nodes, rounding_mode='floor'), dst=pairs % num_nodes, step=keys % num_steps,
+                    count=sums[0].to(dtype), sum_offset=sums[1].to(dtype), sum_sq_offset=sums[2].to(dtype))
+
+    def share_memory_(self):
+        '''
+        Moves the statistics to shared memory, so processes started afterwards read them without a copy
+        '''
+        for tensor in [self.src, self.dst, self.step, self.count, self.sum_offset, self.sum_sq_offset]:
+            tensor.share_memory_()
+        return self
+
+    def to(self, device):
+        return StepStatistics(self.src.to(device), self.dst.to(device), self.step.to(device),
+                                self.count.to(device), self.sum_offset.to(device), self.sum_sq_offset.to(device))
+
+    def __len__(self) -> int:
+        return len(self.count)
+
+    def squared_distance_sum(self, steps_z0:torch.Tensor, v0:torch.Tensor) -> torch.Tensor:
+        '''
+        Sum of the squared distances of all events of every active (pair, step).
+        Nodes are the third last dimension and steps the last one,
+        so leading dimensions, e.g. ensemble members, are kept.
+
+        :param steps_z0:    Positions at the start of every step of shape (..., N, 2, S)
+        :param v0:          Velocities of every step of shape (..., N, 2, S)
+
+        :returns:           Sums of shape (P, ...)
+        '''
+        a = steps_z0[...,self.src,:,self.step] - steps_z0[...,self.dst,:,self.step]
+        m = v0[...,self.src,:,self.step] - v0[...,self.dst,:,self.step]
+        shape = (-1,) + (1,)*(a.dim()-2)
+        return (self.count.view(shape)*torch.sum(torch.square(a), dim=-1)
+                + 2*self.sum_offset.view(shape)*torch.sum(a*m, dim=-1)
+                + self.sum_sq_offset.view(shape)*torch.sum(torch.square(m), dim=-1))
+
+
+class EventSet:
+    '''
+    Compact container of node pair interaction events.
+    Node ids are stored as int32 and event times as float64 in separate columns,
+    16 bytes per event instead of the 24 of one float64 (E,3) tensor with the node ids stored as floats.
+    The flat pair ids and the unique time indices used by the vectorized models
+    are computed on first use and cached, so repeated forward passes on the
+    same events do not recompute them. Events prepared for a stepwise model keep
+    sufficient statistics per (pair, step) instead, and no per event indices.
+    '''
+    def __init__(self, src:torch.Tensor, dst:torch.Tensor, t:torch.Tensor, num_nodes:int=None) -> None:
+        '''
+        :param src:         Index of node i of every event
+        :param dst:         Index of node j of every event
+        :param t:           Time of every event
+        :param num_nodes:   Number of nodes, inferred from the largest node id if not given
+        '''
+        self.src = src.to(torch.int32)
+        self.dst = dst.to(torch.int32)
+        self.t = t.to(torch.float64)
+        if num_nodes is None:
+            num_nodes = int(max(self.src.max().item(), self.dst.max().item())) + 1 if len(self.t) > 0 else 0
+        self.num_nodes = int(num_nodes)
+
+        self.__pair_ids = None
+        self.__unique_times = None
+        self.__time_inverse = None
+        ## Number of steps and sufficient statistics of a stepwise model, set by prepare
+        self.num_steps = None
+        self.step_statistics = None
+
+    @classmethod
+    def from_tensor(cls, data:torch.Tensor, num_nodes:int=None, time_column_idx:int=2):
+        '''
+        Creates the container from the (E,3) tensor layout with columns [node_i, node_j, time_point]
+        '''
+        return cls(src=data[:,0].long(), dst=data[:,1].long(), t=data[:,time_column_idx], num_nodes=num_nodes)
+
+    def to_tensor(self) -> torch.Tensor:
+        '''
+        :returns:   The events in the (E,3) float64 layout with columns [node_i, node_j, time_point]
+        '''
+        return torch.stack([self.src.double(), self.dst.double(), self.t], dim=1)
+
+    def tolist(self) -> list:
+        return self.to_tensor().tolist()
+
+    def to(self, device):
+        events = EventSet(self.src.to(device), self.dst.to(device), self.t.to(device), self.num_nodes)
+        if self.__pair_ids is not None:
+            events.__pair_ids = self.__pair_ids.to(device)
+        if self.__unique_times is not None:
+            events.__unique_times, events.__time_inverse = self.__unique_times.to(device), self.__time_inverse.to(device)
+        if self.step_statistics is not None:
+            events.num_steps, events.step_statistics = self.num_steps, self.step_statistics.to(device)
+        return events
+
+    def share_memory_(self):
+        '''
+        Moves the events, their cached indices and statistics to shared memory, so processes started afterwards read them without a copy
+        '''
+        for tensor in [self.src, self.dst, self.t, self.__pair_ids, self.__unique_times, self.__time_inverse]:
+            if tensor is not None:
+                tensor.share_memory_()
+        if self.step_statistics is not None:
+            self.step_statistics.share_memory_()
+        return self
+
+    def prepare(self, device, dtype=torch.float32, start_times:torch.Tensor=None, end_times:torch.Tensor=None):
+        '''
+        Computes every index of the events that does not depend on the model parameters,
+        so a forward pass on the prepared events only does parameter dependent work
+
+        :param device:      Device the model is on
+        :param dtype:       Dtype of the model parameters, the unique times are cast to it once
+        :param start_times: Start times of the steps of a stepwise model. If given the
+                            sufficient statistics of every (pair, step) are computed, which replace
+                            the per event pair ids and unique time indices
+        :param end_times:   End times of the steps of a stepwise model
+
+        :returns:           The prepared events on the device
+        '''
+        events = EventSet(self.src.to(device), self.dst.to(device), self.t.to(device), self.num_nodes)
+        if start_times is None:
+            events.__pair_ids = events.pair_ids
+            events.__unique_times = events.unique_times.to(dtype)
+            return events
+
+        start_times = start_times.to(device, dtype=torch.float64)
+        end_times = end_times.to(device, dtype=torch.float64)
+        step_index, step_offset = find_steps_and_offsets(events.t, start_times, end_times)
+        ## The indices are only needed to build the statistics, so they are not cached on the events
+        pair_ids = events.src.long()*events.num_nodes + events.dst.long()
+        events.num_steps = len(start_times)
+        events.step_statistics = StepStatistics.from_events(pair_ids, step_index, step_offset,
+                                                            num_nodes=events.num_nodes, num_steps=len(start_times), dtype=dtype)
+        return events
+
+    def __len__(self) -> int:
+        return len(self.t)
+
+    def __getitem__(self, index):
+        '''
+        Selects events by slice, index tensor or boolean mask
+        '''
+        return EventSet(self.src[index], self.dst[index], self.t[index], self.num_nodes)
+
+    @property
+    def pair_ids(self) -> torch.Tensor:
+        '''
+        Flat index i*num_nodes + j of the node pair of every event, usable to index
+        a (num_nodes*num_nodes, ...) view of a pairwise tensor
+        '''
+        if self.__pair_ids is None:
+            self.__pair_ids = self.src.long()*self.num_nodes + self.dst.long()
+        return self.__pair_ids
+
+    @property
+    def unique_times(self) -> torch.Tensor:
+        if self.__unique_times is None:
+            self.__unique_times, self.__time_inverse = torch.unique(self.t, return_inverse=True)
+        return self.__unique_times
+
+    @property
+    def num_unique_times(self) -> int:
+        '''
+        Number of unique event times, without caching the unique time indices when they are not cached yet
+        '''
+        if self.__unique_times is not None:
+            return len(self.__unique_times)
+        return len(torch.unique(self.t))
+
+    @property
+    def time_inverse(self) -> torch.Tensor:
+        '''
+        Index of the time of every event in unique_times
+        '''
+        if self.__time_inverse is None:
+            self.__unique_times, self.__time_inverse = torch.unique(self.t, return_inverse=True)
+        return self.__time_inverse
+
+
+class EventBatches:
+    '''
+    Splits an EventSet into time ordered batches.
+    The batches are created once and reused in every epoch, so their cached
+    indices are only computed in the first epoch.
+    '''
+    def __init__(self, events:EventSet, batch_size:int) -> None:
+        self.batches = [events[start:start+batch_size] for start in range(0, len(events), batch_size)]
+
+    def prepare(self, device, dtype=torch.float32, start_times:torch.Tensor=None, end_times:torch.Tensor=None) -> None:
+        '''
+        Prepares every batch once, see EventSet.prepare
+        '''
+        self.batches = [batch.prepare(device, dtype=dtype, start_times=start_times, end_times=end_times) for batch in self.batches]
+
+    def share_memory_(self):
+        '''
+        Moves every batch to shared memory, see EventSet.share_memory_
+        '''
+        for batch in self.batches:
+            batch.share_memory_()
+        return self
+
+    def __len__(self) -> int:
+        return len(self.batches)
+
+    def __iter__(self):
+        return iter(self.batches)
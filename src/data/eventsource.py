@@ -0,0 +1,237 @@
+import os
+import abc
+import queue
+import threading
+import numpy as np
+import torch
+
+
+class EventChunk:
+    '''
+    Time ordered events with columns [node_i, node_j, time_point]
+    together with the time window [t0, tn] the chunk covers.
+    The windows of consecutive chunks are contiguous, so the non-event
+    integrals of all chunks add up to the integral over the whole dataset.
+    '''
+    def __init__(self, events:torch.Tensor, t0:float, tn:float) -> None:
+        self.events = events
+        self.t0 = t0
+        self.tn = tn
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+
+class EventSource(abc.ABC):
+    '''
+    Base class of sources streaming time ordered event chunks.
+    Subclasses implement iter_arrays, yielding numpy arrays with columns [node_i, node_j, time_point].
+    '''
+    def __init__(self, chunk_size:int, t_start:float=0.) -> None:
+        '''
+        :param chunk_size:  Maximum number of events in a chunk
+        :param t_start:     Start of the window of the first chunk
+        '''
+        self.chunk_size = chunk_size
+        self.t_start = t_start
+
+    @abc.abstractmethod
+    def iter_arrays(self):
+        '''
+        Yields the events in time order as numpy arrays of at most chunk_size rows
+        '''
+
+    def __iter__(self):
+        t0 = self.t_start
+        for array in self.iter_arrays():
+            if len(array) == 0:
+                continue
+            events = torch.from_numpy(np.array(array, dtype=np.float64))
+            times = events[:,2]
+            tn = times[-1].item()
+            if times[0].item() < t0:
+                raise Exception(f'Events are not time ordered, event at time {times[0].item()} comes after time {t0}')
+            unordered = torch.nonzero(times[1:] < times[:-1])
+            if len(unordered):
+                position = unordered[0].item()
+                raise Exception(f'Events are not time ordered, event at time {times[position+1].item()} comes after time {times[position].item()}')
+            yield EventChunk(events, t0, tn)
+            t0 = tn
+
+
+class MemmapEventSource(EventSource):
+    '''
+    Streams chunks of a time ordered (E,3) .npy file through a memory map,
+    so only the current chunk is read into memory.
+    '''
+    def __init__(self, path:str, chunk_size:int, t_start:float=0.) -> None:
+        super().__init__(chunk_size, t_start)
+        self.path = path
+        events = np.load(path, mmap_mode='r')
+        self.num_events = events.shape[0]
+        self.last_time = float(events[-1,2])
+
+    def __len__(self) -> int:
+        return -(-self.num_events // self.chunk_size)
+
+    def iter_arrays(self):
+        events = np.load(self.path, mmap_mode='r')
+        for start in range(0, self.num_events, self.chunk_size):
+            yield events[start:start+self.chunk_size]
+
+
+class ShardedEventSource(EventSource):
+    '''
+    Streams chunks of a sequence of time ordered shards, where every shard holds
+    the events following the events of the previous shard.
+    Shards are .npy files, which are memory mapped, or csv files like the real datasets,
+    which are read chunk_size lines at a time.
+    '''
+    def __init__(self, paths:list, chunk_size:int, t_start:float=0.) -> None:
+        super().__init__(chunk_size, t_start)
+        self.paths = list(paths)
+        self.shard_sizes = [self.__shard_size(path) for path in self.paths]
+        self.num_events = sum(self.shard_sizes)
+        self.last_time = self.__last_time(self.paths[-1])
+
+    @staticmethod
+    def __is_npy(path:str) -> bool:
+        return os.path.splitext(path)[1] == '.npy'
+
+    def __last_time(self, path:str) -> float:
+        if self.__is_npy(path):
+            return float(np.load(path, mmap_mode='r')[-1,2])
+        return float(np.genfromtxt([last_line(path)], delimiter=',', ndmin=2)[0,2])
+
+    def __shard_size(self, path:str) -> int:
+        if self.__is_npy(path):
+            return np.load(path, mmap_mode='r').shape[0]
+        with open(path) as shard_file:
+            return sum(1 for line in shard_file if line.strip())
+
+    def __len__(self) -> int:
+        return sum(-(-size // self.chunk_size) for size in self.shard_sizes)
+
+    def iter_arrays(self):
+        for path in self.paths:
+            if not self.__is_npy(path):
+                yield from read_csv_blocks(path, self.chunk_size)
+                continue
+            shard = np.load(path, mmap_mode='r')
+            for start in range(0, shard.shape[0], self.chunk_size):
+                yield shard[start:start+self.chunk_size]
+
+
+class PrefetchLoader:
+    '''
+    Iterates an event source while a background thread reads the next chunks,
+    so reading from disk overlaps with training on the current chunk.
+    At most prefetch+1 chunks are held in memory at any time.
+    '''
+    def __init__(self, source:EventSource, prefetch:int=2) -> None:
+        self.source = source
+        self.prefetch = prefetch
+
+    def __len__(self) -> int:
+        return len(self.source)
+
+    def __iter__(self):
+        chunks = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        end_of_source = object()
+
+        def put(item) -> bool:
+            ## Waits for space in the queue, but gives up when the consumer has stopped
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def read_chunks():
+            try:
+                for chunk in self.source:
+                    if not put(chunk):
+                        return
+                put(end_of_source)
+            except Exception as e:
+                put(e)
+
+        reader = threading.Thread(target=read_chunks, daemon=True)
+        reader.start()
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is end_of_source:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            stop.set()
+            reader.join()
+
+
+def read_csv_blocks(csv_path:str, lines_per_read:int):
+    '''
+    Reads a csv event file in blocks, so at most lines_per_read lines are in memory at once
+
+    :param csv_path:        Path of the csv file with columns [node_i, node_j, time_point]
+    :param lines_per_read:  Number of non-empty lines of a block
+
+    :returns:               Generator of (B,3) numpy arrays
+    '''
+    with open(csv_path) as csv_file:
+        lines = []
+        for line in csv_file:
+            if line.strip():
+                lines.append(line)
+            if len(lines) == lines_per_read:
+                yield np.genfromtxt(lines, delimiter=',', ndmin=2)
+                lines = []
+        if lines:
+            yield np.genfromtxt(lines, delimiter=',', ndmin=2)
+
+
+def last_line(path:str, block_size:int=4096) -> str:
+    '''
+    Last non-empty line of a text file, read backwards from the end of the file in blocks
+    '''
+    with open(path, 'rb') as text_file:
+        position = text_file.seek(0, os.SEEK_END)
+        tail = b''
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            text_file.seek(position)
+            tail = text_file.read(read_size) + tail
+            lines = [line for line in tail.splitlines() if line.strip()]
+            ## The first line of the tail can be cut off unless the file was read from its start
+            if len(lines) > 1 or (lines and position == 0):
+                return lines[-1].decode()
+    raise Exception(f'{path} has no events')
+
+
+def csv_to_npy(csv_path:str, npy_path:str, lines_per_read:int=1000000) -> int:
+    '''
+    Converts a time ordered csv event file to a .npy file that can be memory mapped,
+    reading at most lines_per_read lines at a time
+
+    :param csv_path:        Path of the csv file with columns [node_i, node_j, time_point]
+    :param npy_path:        Path of the .npy file to write
+    :param lines_per_read:  Number of lines read into memory at once
+
+    :returns:               The number of events written
+    '''
+    with open(csv_path) as csv_file:
+        num_events = sum(1 for line in csv_file if line.strip())
+
+    events = np.lib.format.open_memmap(npy_path, mode='w+', dtype=np.float64, shape=(num_events, 3))
+    written = 0
+    for block in read_csv_blocks(csv_path, lines_per_read):
+        events[written:written+len(block)] = block
+        written += len(block)
+    events.flush()
+    return written
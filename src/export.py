@@ -0,0 +1,111 @@
+### Packages
+import os
+import sys
+import numpy as np
+import torch
+from argparse import ArgumentParser
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+
+### Code imports
+from models.scoring import StepwiseScorer
+from utils.compute.threads import configure_threads, print_thread_configuration
+
+
+def expected_counts(scorer:StepwiseScorer, bin_edges:np.ndarray, pairs:np.ndarray=None, threshold:float=0., max_elements:int=2**22):
+    '''
+    Expected number of events of node pairs in time bins, the closed form integral of the intensity over every bin.
+    The pairs are evaluated in chunks of at most max_elements (pair, bin, step) integrals, so the memory
+    does not grow with the number of pairs, and only counts above the threshold are kept.
+
+    :param scorer:          Scorer of the trained model
+    :param bin_edges:       Increasing edges of the B bins of shape (B+1,)
+    :param pairs:           Node pairs of shape (P,2), all pairs i < j if not given
+    :param threshold:       Expected counts at or below the threshold are left out
+    :param max_elements:    Maximum number of integrals evaluated at once
+
+    :returns:   Sparse COO arrays: node i, node j, bin index and expected count of the kept entries
+    '''
+    bin_edges = np.asarray(bin_edges, dtype=np.float64)
+    num_bins = len(bin_edges) - 1
+    if pairs is None:
+        pairs = np.stack(np.triu_indices(scorer.num_of_nodes, k=1), axis=1)
+    pairs_per_chunk = max(1, max_elements // (num_bins*scorer.num_of_steps))
+
+    bin_t0 = torch.from_numpy(bin_edges[:-1])
+    bin_tn = torch.from_numpy(bin_edges[1:])
+    kept = {'i': [], 'j': [], 'bin': [], 'expected_count': []}
+    for start in range(0, len(pairs), pairs_per_chunk):
+        chunk = torch.from_numpy(pairs[start:start+pairs_per_chunk]).long()
+        ## Every pair of the chunk with every bin, pair major
+        i = chunk[:,0].repeat_interleave(num_bins)
+        j = chunk[:,1].repeat_interleave(num_bins)
+        counts = scorer.expected_count(i, j, bin_t0.repeat(len(chunk)), bin_tn.repeat(len(chunk))).cpu()
+        mask = counts > threshold
+        kept['i'].append(i[mask].numpy())
+        kept['j'].append(j[mask].numpy())
+        kept['bin'].append(torch.arange(num_bins).repeat(len(chunk))[mask].numpy())
+        kept['expected_count'].append(counts[mask].numpy())
+        print(f'Evaluated {min(start+pairs_per_chunk, len(pairs))} of {len(pairs)} pairs')
+
+    ## Without kept counts the index columns are still integers, so they can index the bin edges
+    dtypes = {'i': np.int64, 'j': np.int64, 'bin': np.int64, 'expected_count': np.float64}
+    return {key: np.concatenate(values) if values else np.empty(0, dtype=dtypes[key]) for key, values in kept.items()}
+
+
+def save_expected_counts(path:str, counts:dict, bin_edges:np.ndarray, num_nodes:int) -> None:
+    '''
+    Writes the sparse expected counts as .npz, with the bin edges and number of nodes,
+    or as a csv file with the columns node_i, node_j, bin, bin_start, bin_end, expected_count
+    '''
+    bin_edges = np.asarray(bin_edges, dtype=np.float64)
+    if os.path.splitext(path)[1] == '.csv':
+        table = np.stack([counts['i'], counts['j'], counts['bin'], bin_edges[counts['bin']],
+                            bin_edges[counts['bin']+1], counts['expected_count']], axis=1)
+        np.savetxt(path, table, delimiter=',', fmt=['%d', '%d', '%d', '%.10g', '%.10g', '%.10g'],
+                    header='node_i,node_j,bin,bin_start,bin_end,expected_count', comments='')
+    else:
+        np.savez_compressed(path, node_i=counts['i'], node_j=counts['j'], bin=counts['bin'],
+                            expected_count=counts['expected_count'], bin_edges=bin_edges, num_nodes=num_nodes)
+
+
+if __name__ == '__main__':
+
+    ### Parse Arguments for running in terminal
+    arg_parser = ArgumentParser()
+    arg_parser.add_argument('--params_dir', '-PD', required=True, type=str)
+    arg_parser.add_argument('--max_time', '-MT', default=None, type=float)
+    arg_parser.add_argument('--device', '-device', default='cpu', type=str)
+    arg_parser.add_argument('--bin_edges', '-BE', default=None, type=float, nargs='+')
+    arg_parser.add_argument('--bin_width', '-BW', default=None, type=float)
+    arg_parser.add_argument('--t_start', '-TS', default=0., type=float)
+    arg_parser.add_argument('--t_end', '-TE', default=None, type=float)
+    arg_parser.add_argument('--pairs_file', '-PF', default=None, type=str)
+    arg_parser.add_argument('--threshold', '-TH', default=1e-3, type=float)
+    arg_parser.add_argument('--max_elements', '-ME', default=2**22, type=int)
+    arg_parser.add_argument('--num_threads', '-NT', default=None, type=int)
+    arg_parser.add_argument('--output', '-O', default='expected_counts.npz', type=str)
+    args = arg_parser.parse_args()
+
+    print_thread_configuration(configure_threads(num_threads=args.num_threads))
+    scorer = StepwiseScorer.from_params_dir(args.params_dir, max_time=args.max_time, device=args.device)
+
+    ## Bins: Either given edges or equally wide bins from t_start to t_end, which defaults to the max time of the model
+    if args.bin_edges is not None:
+        bin_edges = np.asarray(args.bin_edges, dtype=np.float64)
+    elif args.bin_width is not None:
+        t_end = args.t_end if args.t_end is not None else scorer.max_time
+        ## Bins of at most bin_width, the rounding keeps a whole number of bins from getting an extra bin
+        num_bins = max(1, int(np.ceil(round((t_end - args.t_start) / args.bin_width, 9))))
+        bin_edges = np.linspace(args.t_start, t_end, num_bins + 1)
+    else:
+        raise Exception('Give the bins with --bin_edges or --bin_width')
+    if len(bin_edges) < 2 or np.any(np.diff(bin_edges) <= 0):
+        raise Exception('The bin edges have to be increasing and give at least one bin')
+
+    pairs = np.genfromtxt(args.pairs_file, delimiter=',', dtype=np.int64, ndmin=2)[:,:2] if args.pairs_file else None
+
+    counts = expected_counts(scorer, bin_edges, pairs=pairs, threshold=args.threshold, max_elements=args.max_elements)
+    save_expected_counts(args.output, counts, bin_edges, scorer.num_of_nodes)
+    print(f"Saved {len(counts['expected_count'])} expected counts above {args.threshold} in {len(bin_edges)-1} bins to {args.output}")
@@ -1,7 +1,6 @@
 ### Packages
 import os
 import sys
-import wandb
 import numpy as np
 import torch
 from argparse import ArgumentParser
@@ -10,356 +9,718 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 
 ### Code imports
+## Only the packages every command needs are imported here.
+## wandb, ignite, sklearn, scipy, matplotlib, pandas and plotly, and the models, are imported
+## inside the commands and branches that use them to keep the startup lean.
 ## Data
-from data.synthetic.datasets.init_params import get_initial_parameters
-from data.synthetic.builder import DatasetBuilder
-from data.synthetic.stepwisebuilder import StepwiseDatasetBuilder
-from data.synthetic.sampling.constantvelocity import ConstantVelocitySimulator
-from data.synthetic.sampling.tensor_stepwiseconstantvelocity import StepwiseConstantVelocitySimulator
-from data.real.load_dataset import load_real_dataset
-from utils.results_evaluation.remove_nodepairs import remove_node_pairs
-from utils.results_evaluation.remove_interactions import acc_removed_interactions, remove_interactions
-
-## Models
-from models.nodynamics import NoDynamicsModel
-from models.constantvelocity.standard import ConstantVelocityModel
-from models.constantvelocity.baseline_mean_intensity import BaselineMeanIntensity
-from models.constantvelocity.vectorized import VectorizedConstantVelocityModel
-from models.constantvelocity.stepwise import StepwiseVectorizedConstantVelocityModel
-from models.constantvelocity.stepwise_stepbeta import StepwiseVectorizedConstantVelocityModel as MultiBetaStepwise
-from models.constantvelocity.standard_gt import GTConstantVelocityModel  
-from models.constantvelocity.stepwise_gt import GTStepwiseConstantVelocityModel
-from models.constantvelocity.stepwise_gt_stepbeta import GTStepwiseConstantVelocityModel as GTMultiBetaStepwise
-
-## Training Gym's
-from traintestgyms.ignitegym import TrainTestGym
-
-## Plots
-from utils.results_evaluation.compare_intensity_rates import compare_intensity_rates_plot
-from utils.results_evaluation.event_distribution import plot_event_dist
+from data.dataset import load_or_generate_dataset
 
 ## Utils
-from utils.visualize.animation import animate
+from utils.compute.threads import configure_threads, print_thread_configuration
+
+
+COMMANDS = ['generate', 'train', 'evaluate', 'animate', 'update']
+## Fraction of the events held out by --remove_interactions_b
+REMOVED_INTERACTIONS_FRACTION = 0.1
+
+
+def build_arg_parser() -> ArgumentParser:
+    ## Arguments shared by all commands
+    common = ArgumentParser(add_help=False)
+    common.add_argument('--seed', '-seed', default=1, type=int)
+    common.add_argument('--device', '-device', default='cpu', type=str)
+    common.add_argument('--real_data', '-RD', default=0, type=int)
+    common.add_argument('--dataset_number', '-DS', default=2, type=int)
+    common.add_argument('--dataset_path', '-DP', default=None, type=str)
+    common.add_argument('--vectorized', '-VEC', default=2, type=int)
+    common.add_argument('--steps', '-steps', default=10, type=int)
+    common.add_argument('--step_beta', '-SB', action='store_true')
+    common.add_argument('--num_threads', '-NT', default=None, type=int)
+    common.add_argument('--num_interop_threads', '-NIT', default=None, type=int)
+    common.add_argument('--pin_cores', '-PC', default=None, type=str)
+    common.add_argument('--no_wandb', '-NW', action='store_true')
+    common.add_argument('--output_dir', '-OUT', default='runs', type=str)
+    common.add_argument('--wandb_entity', '-WE', default='augustsemrau', type=str)
+    common.add_argument('--wandb_project', '-WP', default='TGMLRQ2', type=str)
+    common.add_argument('--wandb_run_name', '-WRN', default=None, type=str)
+    common.add_argument('--wandb_group', '-WG', default=None, type=str)
+
+    ## Arguments of the removal tests and result plots
+    evaluation = ArgumentParser(add_help=False)
+    evaluation.add_argument('--baseline_mean', '-BM', action='store_true')
+    evaluation.add_argument('--remove_node_pairs_b', '-T1', default=0, type=int)
+    evaluation.add_argument('--remove_interactions_b', '-T2', default=0, type=int)
+
+    ## Arguments of the animation
+    animation = ArgumentParser(add_help=False)
+    animation.add_argument('--animation_time_points', '-ATP', default=1500, type=int)
 
-
-
-if __name__ == '__main__':
-
-    ### Parse Arguments for running in terminal
     arg_parser = ArgumentParser()
-    arg_parser.add_argument('--seed', '-seed', default=1, type=int)
-    arg_parser.add_argument('--device', '-device', default='cpu', type=str)
-    arg_parser.add_argument('--learning_rate', '-LR', default=0.025, type=float)
-    arg_parser.add_argument('--num_epochs', '-NE', default=5000, type=int)
-    arg_parser.add_argument('--train_batch_size', '-TBS', default=-1, type=int)
-    arg_parser.add_argument('--real_data', '-RD', default=0, type=int)
-    arg_parser.add_argument('--dataset_number', '-DS', default=2, type=int)
-    arg_parser.add_argument('--training_type', '-TT', default=0, type=int)
-    arg_parser.add_argument('--vectorized', '-VEC', default=2, type=int)
-    arg_parser.add_argument('--baseline_mean', '-BM', action='store_true')
-    arg_parser.add_argument('--remove_node_pairs_b', '-T1', default=0, type=int)
-    arg_parser.add_argument('--remove_interactions_b', '-T2', default=0, type=int)
-    arg_parser.add_argument('--steps', '-steps', default=10, type=int)
-    arg_parser.add_argument('--step_beta', '-SB', action='store_true')
-    arg_parser.add_argument('--keep_rotation', '-KR', action='store_true')
-    arg_parser.add_argument('--animation', '-ani', action='store_true')
-    arg_parser.add_argument('--animation_time_points', '-ATP', default=1500, type=int)
-    arg_parser.add_argument('--velocity_gamma_regularization', '-VGR', default=None, type=float)
-    arg_parser.add_argument('--wandb_entity', '-WE', default='augustsemrau', type=str)
-    arg_parser.add_argument('--wandb_project', '-WP', default='TGMLRQ2', type=str)
-    arg_parser.add_argument('--wandb_run_name', '-WRN', default=None, type=str)
-    arg_parser.add_argument('--wandb_group', '-WG', default=None, type=str)
-    args = arg_parser.parse_args()
-
-    ## Set all input arguments
-    seed = args.seed
-    learning_rate = args.learning_rate
-    num_epochs = args.num_epochs
-    train_batch_size = args.train_batch_size
-    dataset_number = args.dataset_number
-    training_type = args.training_type
-    vectorized = args.vectorized
-    baseline_mean = args.baseline_mean
-    remove_node_pairs_b = args.remove_node_pairs_b
-    remove_interactions_b = args.remove_interactions_b
-    device = args.device
-    real_data = args.real_data
-    num_steps = args.steps
-    step_beta = args.step_beta
-    keep_rotation = args.keep_rotation
-    animation = args.animation
-    animation_time_points = args.animation_time_points
-    velocity_gamma_regularization = args.velocity_gamma_regularization
-    wandb_entity= args.wandb_entity
-    wandb_project = args.wandb_project
-    wandb_run_name = args.wandb_run_name
-    wandb_group = args.wandb_group
-
+    commands = arg_parser.add_subparsers(dest='command')
+
+    generate_parser = commands.add_parser('generate', parents=[common], help='Generate or load a dataset and save it')
+    generate_parser.add_argument('--output', '-O', default='dataset.pt', type=str)
+
+    train_parser = commands.add_parser('train', parents=[common, evaluation, animation], help='Train and evaluate a model')
+    train_parser.add_argument('--learning_rate', '-LR', default=0.025, type=float)
+    train_parser.add_argument('--num_epochs', '-NE', default=5000, type=int)
+    train_parser.add_argument('--train_batch_size', '-TBS', default=-1, type=int)
+    train_parser.add_argument('--training_type', '-TT', default=0, type=int)
+    train_parser.add_argument('--ensemble_size', '-ES', default=1, type=int)
+    train_parser.add_argument('--keep_rotation', '-KR', action='store_true')
+    train_parser.add_argument('--animation', '-ani', action='store_true')
+    train_parser.add_argument('--velocity_gamma_regularization', '-VGR', default=None, type=float)
+    train_parser.add_argument('--event_files', '-EF', default=None, type=str, nargs='+')
+    train_parser.add_argument('--chunk_size', '-CS', default=1000000, type=int)
+    train_parser.add_argument('--num_nodes', '-NN', default=None, type=int)
+    train_parser.add_argument('--model_beta', '-MB', default=1., type=float)
+    train_parser.add_argument('--profile_dir', '-PROF', default=None, type=str)
+    train_parser.add_argument('--profile_trace_epochs', '-PTE', default=1, type=int)
+    train_parser.add_argument('--memory_budget', '-MEM', default=None, type=float)
+    train_parser.add_argument('--auto_batch_size', '-ABS', action='store_true')
+    train_parser.add_argument('--prune_threshold', '-PT', default=None, type=float)
+    train_parser.add_argument('--block_size', '-BLS', default=None, type=int)
+    train_parser.add_argument('--compile', '-COMP', action='store_true')
+    train_parser.add_argument('--optimizer', '-OPT', default='adam', choices=['adam', 'lbfgs'])
+    train_parser.add_argument('--lbfgs_max_iter', '-LMI', default=20, type=int)
+    train_parser.add_argument('--lbfgs_history', '-LH', default=10, type=int)
+    train_parser.add_argument('--tolerance', '-TOL', default=None, type=float)
+    train_parser.add_argument('--grad_tolerance', '-GTOL', default=None, type=float)
+    train_parser.add_argument('--target_nll', '-TNLL', default=None, type=float)
+    train_parser.add_argument('--param_tolerance', '-PTOL', default=None, type=float)
+    train_parser.add_argument('--patience', '-PAT', default=None, type=int)
+    train_parser.add_argument('--min_delta', '-MD', default=0., type=float)
+    train_parser.add_argument('--validation_stopping', '-VS', action='store_true')
+    train_parser.add_argument('--refine_from_steps', '-RFS', default=None, type=int)
+    train_parser.add_argument('--beta_update', '-BU', default=None, choices=['step', 'epoch'])
+    train_parser.add_argument('--processes', '-NP', default=1, type=int)
+    train_parser.add_argument('--master_port', '-MPORT', default=29500, type=int)
+    train_parser.add_argument('--warm_start', '-WS', default=None, choices=['mds', 'spectral'])
+    train_parser.add_argument('--checkpoint_segments', '-CKPT', default=None, nargs='+', choices=['positions', 'event', 'integral'])
+
+    evaluate_parser = commands.add_parser('evaluate', parents=[common, evaluation], help='Evaluate saved model parameters')
+    evaluate_parser.add_argument('--params_dir', '-PD', required=True, type=str)
+
+    animate_parser = commands.add_parser('animate', parents=[common, animation], help='Animate saved model parameters')
+    animate_parser.add_argument('--params_dir', '-PD', required=True, type=str)
+
+    update_parser = commands.add_parser('update', parents=[common], help='Extend saved stepwise parameters to newly arrived events')
+    update_parser.add_argument('--params_dir', '-PD', required=True, type=str)
+    update_parser.add_argument('--previous_max_time', '-PMT', default=None, type=float)
+    update_parser.add_argument('--recent_steps', '-RS', default=2, type=int)
+    update_parser.add_argument('--learning_rate', '-LR', default=0.025, type=float)
+    update_parser.add_argument('--num_epochs', '-NE', default=1000, type=int)
+    update_parser.add_argument('--train_batch_size', '-TBS', default=-1, type=int)
+    update_parser.add_argument('--velocity_gamma_regularization', '-VGR', default=None, type=float)
+
+    return arg_parser
+
+
+def parse_args(argv:list):
+    ## Without a command the arguments are for training, as before the commands existed
+    if not argv or (argv[0] not in COMMANDS and argv[0] not in ['-h', '--help']):
+        argv = ['train'] + argv
+    return build_arg_parser().parse_args(argv)
+
+
+def setup_run(args) -> dict:
     ## Seeding of model run
-    np.random.seed(seed)
-    torch.manual_seed(seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
     np.seterr(all='raise')
 
     ## Device
-    print(f'Running with pytorch device: {device}')
-    torch.pi = torch.tensor(torch.acos(torch.zeros(1)).item()*2).to(device)
-    torch.eps = torch.tensor(np.finfo(float).eps).to(device) #Adding eps to avoid devision by 0 
+    print(f'Running with pytorch device: {args.device}')
+
+    ## Thread budget, set before any torch work so the inter-op pool can still be sized
+    thread_config = configure_threads(num_threads=args.num_threads, num_interop_threads=args.num_interop_threads, cores=args.pin_cores)
+    print_thread_configuration(thread_config)
+    return thread_config
+
 
+def load_data(args):
+    '''
+    Loads a dataset saved by the generate command or generates/loads it from the dataset number
 
+    :returns:   The dataset, number of nodes, true z0, v0 and beta, initial model beta, max time and number of steps
+    '''
+    if args.dataset_path is not None:
+        saved = torch.load(args.dataset_path)
+        dataset_full, num_nodes = saved['dataset'], saved['num_nodes']
+        z0, v0, true_beta = saved['z0'], saved['v0'], saved['true_beta']
+        model_beta, max_time = saved['model_beta'], saved['max_time']
+    else:
+        dataset_full, num_nodes, z0, v0, true_beta, model_beta, max_time = load_or_generate_dataset(real_data=args.real_data,
+                                                                            dataset_number=args.dataset_number, vectorized=args.vectorized,
+                                                                            seed=args.seed, device=args.device)
 
-    ### Data: Either synthetically generated data, or loaded real world data
-    if real_data == 0:
-        ## Defining parameters for synthetic data generation
-        z0, v0, true_beta, model_beta, max_time = get_initial_parameters(dataset_number=dataset_number, vectorized=vectorized)
-        if step_beta:
+    num_steps = args.steps
+    if args.real_data == 0:
+        if args.step_beta:
             ## Use a beta parameter for each step in the model
             model_beta = np.asarray([model_beta]*num_steps)
         if num_steps == 0:
             num_steps = v0.shape[2]
-        num_nodes = z0.shape[0]
         print(f"Number of nodes: {num_nodes} \nz0: \n{z0} \nv0: \n{v0} \nTrue Beta: {true_beta} \nModel initiated Beta: {model_beta} \nMax time: {max_time}\nNumber of steps to fit: {num_steps}")
 
-        ## Initialize data builder for simulating node interactions from known Poisson Process
-        if vectorized != 2:
-            simulator = ConstantVelocitySimulator(starting_positions=z0, velocities=v0, T=max_time, beta=true_beta, seed=seed)
-            data_builder = DatasetBuilder(simulator, device=device)
-            dataset_full = data_builder.build_dataset(num_nodes, time_column_idx=2)
-        elif vectorized == 2:
-            simulator = StepwiseConstantVelocitySimulator(starting_positions=z0, velocities=v0, max_time=max_time, beta=true_beta, seed=seed)
-            data_builder = StepwiseDatasetBuilder(simulator=simulator, device=device, normalization_max_time=None)
-            dataset_full = data_builder.build_dataset(num_nodes, time_column_idx=2)
+    return dataset_full, num_nodes, z0, v0, true_beta, model_beta, max_time, num_steps
+
+
+def load_event_source(args):
+    '''
+    Streams the events of a memory mapped .npy file or of a sequence of time ordered shards
+
+    :returns:   The event source, the number of nodes and the max time
+    '''
+    from data.eventsource import MemmapEventSource, ShardedEventSource
+
+    if args.num_nodes is None:
+        raise Exception('The number of nodes has to be given with --num_nodes when streaming events')
+    if len(args.event_files) == 1 and args.event_files[0].endswith('.npy'):
+        source = MemmapEventSource(args.event_files[0], chunk_size=args.chunk_size)
     else:
-        print(f"Loading real dataset number {dataset_number}")
+        source = ShardedEventSource(args.event_files, chunk_size=args.chunk_size)
+    print(f'Streaming {source.num_events} events in {len(source)} chunks of at most {args.chunk_size} events')
+    return source, args.num_nodes, source.last_time
 
-        dataset_full, num_nodes, model_beta = load_real_dataset(dataset_number=dataset_number)
-        z0, v0, true_beta, = None, None, None 
-        max_time = max(dataset_full[:,2])
 
-    dataset_size = len(dataset_full)
-    num_dyads = (num_nodes * (num_nodes - 1)) / 2
+def split_data(args, dataset_full, num_nodes):
+    '''
+    Testing sets: Either remove entire node pairs, 10% of events, or both
+    '''
+    if args.remove_node_pairs_b == 0 and args.remove_interactions_b == 0:
+        return dataset_full, None, None
+
+    ## Both modules seed python's random generator on import, which makes the split reproducible
+    from utils.results_evaluation.remove_nodepairs import remove_node_pairs
+    from utils.results_evaluation.remove_interactions import remove_interactions
 
-    ### Testing sets: Either remove entire noode pairs, 10% of events, or both
-    if remove_node_pairs_b == 1 and remove_interactions_b == 0:
-        dataset, removed_node_pairs = remove_node_pairs(dataset=dataset_full, num_nodes=num_nodes, percentage=0.10, device=device)
+    if args.remove_node_pairs_b == 1 and args.remove_interactions_b == 0:
+        dataset, removed_node_pairs = remove_node_pairs(dataset=dataset_full, num_nodes=num_nodes, percentage=0.10, device=args.device)
         removed_interactions = None
-    elif remove_node_pairs_b == 0 and remove_interactions_b == 1:
-        dataset, removed_interactions = remove_interactions(dataset=dataset_full, percentage=0.1, device=device)
+    elif args.remove_node_pairs_b == 0 and args.remove_interactions_b == 1:
+        dataset, removed_interactions = remove_interactions(dataset=dataset_full, percentage=REMOVED_INTERACTIONS_FRACTION, device=args.device)
         removed_node_pairs = None
-    elif remove_node_pairs_b == 1 and remove_interactions_b == 1:
-        dataset_removed_nodes, removed_node_pairs = remove_node_pairs(dataset=dataset_full, num_nodes=num_nodes, percentage=0.05, device=device)
-        dataset, removed_interactions = remove_interactions(dataset=dataset_removed_nodes, percentage=0.1, device=device)
     else:
-        dataset, removed_node_pairs, removed_interactions = dataset_full, None, None
+        dataset_removed_nodes, removed_node_pairs = remove_node_pairs(dataset=dataset_full, num_nodes=num_nodes, percentage=0.05, device=args.device)
+        dataset, removed_interactions = remove_interactions(dataset=dataset_removed_nodes, percentage=REMOVED_INTERACTIONS_FRACTION, device=args.device)
+
+    return dataset, removed_node_pairs, removed_interactions
+
+
+def init_logger(args, config:dict):
+    '''
+    Initializes Weights and Biases for logging config and metrics,
+    or a local logger writing to the output directory when wandb is disabled
+    '''
+    if getattr(args, 'rank', 0) > 0:
+        ## Only the first rank of distributed training logs the run, the other ranks keep their metrics locally
+        from traintestgyms.locallogger import LocalRunLogger
+        return LocalRunLogger(os.path.join(args.output_dir, f'{args.command}_seed{args.seed}_rank{args.rank}'))
+    if args.no_wandb:
+        from traintestgyms.locallogger import LocalRunLogger
+        run_name = args.wandb_run_name if args.wandb_run_name else f'{args.command}_seed{args.seed}'
+        return LocalRunLogger(os.path.join(args.output_dir, run_name))
+
+    import wandb
+    wandb.init(project=args.wandb_project, name=args.wandb_run_name,
+                entity=args.wandb_entity, group=args.wandb_group, config=config)
+    return wandb
+
+
+def load_params(params_dir:str, device):
+    result_z0 = torch.load(os.path.join(params_dir, 'final_z0.pt'), map_location=device)
+    result_v0 = torch.load(os.path.join(params_dir, 'final_v0.pt'), map_location=device)
+    result_beta = torch.load(os.path.join(params_dir, 'final_beta.pt'), map_location=device)
+    return result_z0, result_v0, result_beta
+
+
+def save_params(logger, result_z0, result_v0, result_beta, max_time):
+    for name, param in [('final_z0.pt', result_z0), ('final_v0.pt', result_v0), ('final_beta.pt', result_beta),
+                        ('final_max_time.pt', torch.tensor(float(max_time)))]:
+        torch.save(param, os.path.join(logger.run.dir, name))
+        logger.save(os.path.join(logger.run.dir, name))
+
+
+def build_result_models(args, num_nodes, result_z0, result_v0, result_beta, z0, v0, true_beta, model_beta, max_time, num_steps):
+    '''
+    Build non-vectorized final and ground truth models
+
+    :returns:   The result model, the ground truth model and the mean intensity baseline (None when not available)
+    '''
+    from models.constantvelocity.standard_gt import GTConstantVelocityModel
+    from models.constantvelocity.stepwise_gt import GTStepwiseConstantVelocityModel
+    from models.constantvelocity.stepwise_gt_stepbeta import GTStepwiseConstantVelocityModel as GTMultiBetaStepwise
+
+    device = args.device
+    gt_model, baseline_mean = None, None
+
+    ## Data generation is diffrerent for synthetic and RL datasets
+    if args.real_data == 0:
+        print('Generating GT and RES model')
+        if args.vectorized != 2:
+            result_model = GTConstantVelocityModel(n_points=num_nodes, z=result_z0 , v=result_v0 , beta=result_beta).to(device, dtype=torch.float32)
+            gt_model = GTConstantVelocityModel(n_points=num_nodes, z=z0, v=v0, beta=true_beta).to(device, torch.float32)
+        elif isinstance(model_beta, np.ndarray):
+            result_model = GTMultiBetaStepwise(n_points=num_nodes, z=result_z0, v=result_v0, beta=result_beta,
+                                                            steps=num_steps, max_time=max_time, device=device).to(device, dtype=torch.float32)
+            gt_model = GTMultiBetaStepwise(n_points=num_nodes, z=torch.from_numpy(z0), v=v0.clone().detach(), beta=torch.tensor([true_beta]*v0.shape[2]),
+                                                            steps=v0.shape[2], max_time=max_time, device=device).to(device, dtype=torch.float32)
+        else:
+            result_model = GTStepwiseConstantVelocityModel(n_points=num_nodes, z=result_z0, v=result_v0, beta=result_beta,
+                                                            steps=num_steps, max_time=max_time, device=device).to(device, dtype=torch.float32)
+            gt_model = GTStepwiseConstantVelocityModel(n_points=num_nodes, z=torch.from_numpy(z0), v=v0.clone().detach(), beta=true_beta,
+                                                            steps=v0.shape[2], max_time=max_time, device=device).to(device, dtype=torch.float32)
+
+        ## Mean intensity baseline for the ground truth
+        if getattr(args, 'baseline_mean', False):
+            from models.constantvelocity.baseline_mean_intensity import BaselineMeanIntensity
+            baseline_mean = BaselineMeanIntensity(n_points=num_nodes, z=z0, v=v0, beta=true_beta,
+                                        steps=v0.shape[2], max_time=max_time, device=device).to(device, dtype=torch.float32)
+    else:
+        print('Generating RES model')
+        if args.vectorized != 2:
+            result_model = GTConstantVelocityModel(n_points=num_nodes, z=result_z0 , v=result_v0 , beta=result_beta)
+        elif isinstance(model_beta, np.ndarray):
+            result_model = GTMultiBetaStepwise(n_points=num_nodes, z=result_z0, v=result_v0, beta=result_beta,
+                                                            steps=num_steps, max_time=max_time, device=device)
+        else:
+            result_model = GTStepwiseConstantVelocityModel(n_points=num_nodes, z=result_z0, v=result_v0, beta=result_beta,
+                                                            steps=num_steps, max_time=max_time, device=device)
+
+    return result_model, gt_model, baseline_mean
+
+
+def evaluate_results(args, logger, dataset_full, num_nodes, result_model, gt_model, baseline_mean,
+                        removed_node_pairs, removed_interactions):
+    '''
+    Removal tests, intensity plots and ground truth losses of a trained model
+    '''
+    device = args.device
+    num_dyads = (num_nodes * (num_nodes - 1)) / 2
+    train_t = np.linspace(0, dataset_full.cpu()[-1][2])
+
+    needs_plots = (args.real_data == 0 and args.dataset_number in [1, 2, 3]) or (baseline_mean is not None and args.remove_node_pairs_b == 1)
+    if needs_plots:
+        from utils.results_evaluation.compare_intensity_rates import compare_intensity_rates_plot
+
+    ## Compare intensity rates of removed node pairs
+    if baseline_mean is not None and args.remove_node_pairs_b == 1:
+        print('Plotting interation intensities for removed dyads')
+        num = 0
+        for removed_node_pair in removed_node_pairs:
+            num += 1
+            plot_num = '_removed_dyad' + str(num)
+            mean_plot_num = '_mean_removed_dyad' + str(num)
+            compare_intensity_rates_plot(train_t=train_t, result_model=result_model, gt_model=gt_model, nodes=[list(removed_node_pair)], wandb_handler=logger, num=plot_num)
+            compare_intensity_rates_plot(train_t=train_t, result_model=baseline_mean, gt_model=gt_model, nodes=[list(removed_node_pair)], wandb_handler=logger, num=mean_plot_num)
+
+    ## Compute ROC AUC for removed interactions
+    if args.remove_interactions_b == 1:
+        from utils.results_evaluation.remove_interactions import acc_removed_interactions
+        print('Computing Accuracy Scores for Removed Interactions')
+        if args.real_data == 0:
+            acc_removed_interactions(removed_interactions=removed_interactions, num_nodes=num_nodes, result_model=result_model, wandb_handler=logger, gt_model=gt_model)
+            if baseline_mean is not None:
+                acc_removed_interactions(removed_interactions=removed_interactions, num_nodes=num_nodes, result_model=baseline_mean, wandb_handler=logger, gt_model=gt_model, title_extension=' - Mean Ground truth')
+        else:
+            acc_removed_interactions(removed_interactions=removed_interactions, num_nodes=num_nodes, result_model=result_model, wandb_handler=logger, gt_model=None)
 
-    ## Compute size of dataset and find training batch size
-    training_set_size = len(dataset)
+    if args.real_data == 0:
+        ## Make intensity rate comparison plots for the synthetic datasets
+        if args.dataset_number == 1:
+            compare_intensity_rates_plot(train_t=train_t, result_model=result_model, gt_model=gt_model, nodes=[[0,1], [0,2], [0,3], [1,2], [1,3], [2,3]], wandb_handler=logger, num=1)
+            if baseline_mean is not None:
+                compare_intensity_rates_plot(train_t=train_t, result_model=baseline_mean, gt_model=gt_model, nodes=[[0,1], [0,2], [0,3], [1,2], [1,3], [2,3]], wandb_handler=logger, num=2)
+        elif args.dataset_number == 2:
+            compare_intensity_rates_plot(train_t=train_t, result_model=result_model, gt_model=gt_model, nodes=[[0,1], [0,2], [0,3], [0,4], [3,4]], wandb_handler=logger, num=1)
+            compare_intensity_rates_plot(train_t=train_t, result_model=result_model, gt_model=gt_model, nodes=[[1,2], [1,3], [1,4], [2,3], [2,4]], wandb_handler=logger, num=2)
+            if baseline_mean is not None:
+                compare_intensity_rates_plot(train_t=train_t, result_model=baseline_mean, gt_model=gt_model, nodes=[[0,1], [0,2], [0,3], [0,4], [3,4]], wandb_handler=logger, num=3)
+                compare_intensity_rates_plot(train_t=train_t, result_model=baseline_mean, gt_model=gt_model, nodes=[[1,2], [1,3], [1,4], [2,3], [2,4]], wandb_handler=logger, num=4)
+        elif args.dataset_number == 3:
+            compare_intensity_rates_plot(train_t=train_t, result_model=result_model, gt_model=gt_model, nodes=[[0,1], [0,21], [0,102], [0,143]], wandb_handler=logger, num=1)
+            compare_intensity_rates_plot(train_t=train_t, result_model=result_model, gt_model=gt_model, nodes=[[20,11], [95, 106], [45, 150], [77, 88]], wandb_handler=logger, num=2)
+            compare_intensity_rates_plot(train_t=train_t, result_model=result_model, gt_model=gt_model, nodes=[[13,120], [66, 133], [99, 144], [101, 102]], wandb_handler=logger, num=3)
+            if baseline_mean is not None:
+                compare_intensity_rates_plot(train_t=train_t, result_model=baseline_mean, gt_model=gt_model, nodes=[[0,1], [0,21], [0,102], [0,143]], wandb_handler=logger, num=4)
+                compare_intensity_rates_plot(train_t=train_t, result_model=baseline_mean, gt_model=gt_model, nodes=[[20,11], [95, 106], [45, 150], [77, 88]], wandb_handler=logger, num=5)
+                compare_intensity_rates_plot(train_t=train_t, result_model=baseline_mean, gt_model=gt_model, nodes=[[13,120], [66, 133], [99, 144], [101, 102]], wandb_handler=logger, num=6)
+
+        ## Compute ground truth training loss for gt model and log
+        logger.log({'gt_train_NLL': ((gt_model.forward(data=dataset_full.to(device), t0=dataset_full[0,2].item(), tn=dataset_full[-1,2].item()) / num_dyads))})
+
+        if baseline_mean is not None:
+            logger.log({'gt_train_NLL': ((baseline_mean.forward(data=dataset_full.to(device), t0=dataset_full[0,2].item(), tn=dataset_full[-1,2].item()) / num_dyads))})
+
+
+def animate_model(args, logger, model, max_time):
+    from utils.visualize.animation import animate
+    print(f'Creating animation of latent node positions on {args.animation_time_points} time points')
+    animate(model, t_start=0, t_end=max_time, num_of_time_points=args.animation_time_points, device=args.device, wandb_handler=logger)
+
+
+def generate(args):
+    setup_run(args)
+    dataset_full, num_nodes, z0, v0, true_beta, model_beta, max_time = load_or_generate_dataset(real_data=args.real_data,
+                                                                        dataset_number=args.dataset_number, vectorized=args.vectorized,
+                                                                        seed=args.seed, device=args.device)
+    torch.save({'dataset': dataset_full, 'num_nodes': num_nodes, 'z0': z0, 'v0': v0, 'true_beta': true_beta,
+                'model_beta': model_beta, 'max_time': max_time}, args.output)
+    print(f'Saved dataset with {len(dataset_full)} interactions to {args.output}')
+
+
+def build_optimizer(args, model):
+    '''
+    Adam, or L-BFGS with a strong Wolfe line search for full batch training, where the loss is deterministic.
+    L-BFGS takes max_iter iterations per epoch and starts its line search with steps of length 1.
+    '''
+    if args.optimizer == 'lbfgs':
+        return torch.optim.LBFGS(model.parameters(), lr=1, max_iter=args.lbfgs_max_iter,
+                                    history_size=args.lbfgs_history, line_search_fn='strong_wolfe')
+    return torch.optim.Adam(model.parameters(), lr=args.learning_rate)
+
+
+def warm_start(model, dataset, num_nodes:int, last_time_point:float, method:str) -> None:
+    '''
+    Initializes z0 and v0 of a stepwise model from the embeddings of the event counts of its steps,
+    and beta to its maximum likelihood value given them
+    '''
+    from utils.nodes.warmstart import warm_start_positions
+    from models.betaprofile import profile_beta
+    z0, v0 = warm_start_positions(dataset[:,0], dataset[:,1], dataset[:,2], num_nodes, model.start_times, model.end_times, method=method)
+    with torch.no_grad():
+        model.z0.copy_(z0)
+        model.v0.copy_(v0)
+    profile_beta(model, len(dataset), 0., last_time_point)
+    print(f'Warm started from {method} embeddings of {model.num_of_steps} step windows, beta: {model.beta.item():.4f}')
+
+
+def train_coarse_to_fine(args, gym, model, num_steps:int):
+    '''
+    Trains a stepwise model from --refine_from_steps steps up to num_steps steps.
+    Every stage ends with splitting each step into two halves with the same velocity, which keeps the
+    trajectories. With --patience a stage ends when its loss plateaus, otherwise after an equal share of the epochs.
+    '''
+    epochs_left = args.num_epochs
+    while True:
+        stages_left = 1
+        while model.num_of_steps * 2**(stages_left-1) < num_steps:
+            stages_left += 1
+        if stages_left == 1:
+            stage_epochs = epochs_left
+        elif args.patience is not None:
+            ## Every later stage gets at least one epoch
+            stage_epochs = max(1, epochs_left - (stages_left-1))
+        else:
+            stage_epochs = max(1, epochs_left // stages_left)
+        print(f'Training {model.num_of_steps} steps for at most {stage_epochs} epochs')
+        gym.train_test_model(epochs=stage_epochs)
+        epochs_left -= gym.trainer.state.epoch
+        if stages_left == 1:
+            return
+        gym.refine_steps()
+
+
+def train_rank(rank:int, args):
+    '''
+    Trains as one of --processes processes, which share the node pairs and sum their gradients with gloo
+    '''
+    import torch.distributed as dist
+    from utils.compute.distributed import init_process_group
+    args.rank = rank
+    if args.num_threads is None:
+        ## The processes share the cores of the machine
+        args.num_threads = max(1, (os.cpu_count() or 1) // args.processes)
+    init_process_group(rank, args.processes, port=args.master_port)
+    try:
+        train(args)
+    finally:
+        dist.destroy_process_group()
+
+
+def train(args):
+    from traintestgyms.ignitegym import TrainTestGym
+    from models.build import build_model
+
+    thread_config = setup_run(args)
+    device = args.device
+    rank, world_size = getattr(args, 'rank', 0), args.processes
+
+    ### Data: Either synthetically generated data, loaded real world data or streamed events
+    if args.event_files:
+        dataset, num_nodes, max_time = load_event_source(args)
+        dataset_full, z0, v0, true_beta, model_beta, num_steps = None, None, None, None, args.model_beta, args.steps
+        removed_node_pairs, removed_interactions = None, None
+        dataset_size = training_set_size = dataset.num_events
+        last_time_point = max_time
+        train_batch_size = args.chunk_size
+    else:
+        dataset_full, num_nodes, z0, v0, true_beta, model_beta, max_time, num_steps = load_data(args)
+        dataset_size = len(dataset_full)
+        dataset, removed_node_pairs, removed_interactions = split_data(args, dataset_full, num_nodes)
+        last_time_point = dataset[:,2][-1].item()
 
-    ## Batch
-    train_batch_size = train_batch_size if train_batch_size > 0 else training_set_size
+        ## Compute size of dataset and find training batch size
+        training_set_size = len(dataset)
+
+        ## Batch
+        train_batch_size = args.train_batch_size if args.train_batch_size > 0 else training_set_size
+    if args.validation_stopping and removed_interactions is None:
+        raise Exception('Stopping on the held-out NLL needs the removed interactions, use --remove_interactions_b 1')
+    if args.validation_stopping and args.patience is None:
+        raise Exception('The held-out NLL is only monitored for stopping with --patience')
+    if args.refine_from_steps:
+        if args.vectorized != 2 or args.ensemble_size > 1 or args.step_beta or args.training_type != 0:
+            raise Exception('Coarse-to-fine training needs the non-sequential training of a single SCVM with a common beta')
+        if num_steps < args.refine_from_steps or args.refine_from_steps * 2**round(np.log2(num_steps / args.refine_from_steps)) != num_steps:
+            raise Exception('The number of steps has to be --refine_from_steps times a power of two')
+    if args.block_size and args.prune_threshold:
+        raise Exception('The tiled integral of --block_size integrates all node pairs, it can not be combined with --prune_threshold')
+    if args.warm_start and (args.event_files or args.vectorized != 2 or args.ensemble_size > 1 or args.step_beta):
+        raise Exception('Warm starts need the events in memory and a single SCVM with a common beta')
+    if args.optimizer == 'lbfgs' and train_batch_size < training_set_size:
+        raise Exception('L-BFGS needs a deterministic loss, train with the full batch (--train_batch_size -1)')
+    if world_size > 1 and (args.event_files or args.vectorized != 2 or args.ensemble_size > 1 or args.step_beta
+                            or args.prune_threshold or args.block_size or train_batch_size < training_set_size):
+        raise Exception('Distributed training needs the full batch of events in memory and a single SCVM with a common beta, '
+                        'without pruning or blocks')
+    num_dyads = (num_nodes * (num_nodes - 1)) / 2
 
     print(f"\nLength of entire dataset: {dataset_size}\nLength of training set: {training_set_size}\nTrain batch size: {train_batch_size}\n")
 
 
     ### WandB initialization
     ## Set input parameters as config for Weights and Biases
-    wandb_config = {'seed': seed,
+    wandb_config = {'seed': args.seed,
                     'device': device,
-                    'learning_rate': learning_rate,
-                    'vectorized': vectorized,  # 0 = non-vectorized, 1 = vectorized, 2 = stepwise
-                    'training_type': training_type,  # 0 = non-sequential training, 1 = sequential training
-                    'num_epochs': num_epochs,
+                    'learning_rate': args.learning_rate,
+                    'vectorized': args.vectorized,  # 0 = non-vectorized, 1 = vectorized, 2 = stepwise
+                    'training_type': args.training_type,  # 0 = non-sequential training, 1 = sequential training
+                    'num_epochs': args.num_epochs,
                     'max_time': max_time,
                     'num_nodes': num_nodes,
                     'dataset_size': dataset_size,
-                    'remove_nodepairs': remove_node_pairs_b,
-                    'remove_interactions': remove_interactions_b,
+                    'remove_nodepairs': args.remove_node_pairs_b,
+                    'remove_interactions': args.remove_interactions_b,
                     'true_beta': true_beta,
                     'model_beta': model_beta,
                     'true_z0': z0,
                     'true_v0': v0,
                     'num_steps': num_steps,
+                    'ensemble_size': args.ensemble_size,
                     'train_batch_size': train_batch_size,
-                    'velocity_gamma_regularization': velocity_gamma_regularization
+                    'velocity_gamma_regularization': args.velocity_gamma_regularization,
+                    'processes': world_size,
+                    'threads': thread_config
                     }
 
-    ## Initialize WandB for logging config and metrics
-    wandb.init(project=wandb_project, name=wandb_run_name, 
-                entity=wandb_entity, group=wandb_group, config=wandb_config)
+    logger = init_logger(args, wandb_config)
 
     ## Plot and log event distribution
-    plot_event_dist(dataset=dataset_full, wandb_handler=wandb)
-
-    wandb.log({'training_set_size': training_set_size, 'removed_node_pairs': removed_node_pairs, 'train_batch_size': train_batch_size, 'beta': model_beta})
+    if not args.no_wandb and dataset_full is not None and rank == 0:
+        from utils.results_evaluation.event_distribution import plot_event_dist
+        plot_event_dist(dataset=dataset_full, wandb_handler=logger)
 
+    logger.log({'training_set_size': training_set_size, 'removed_node_pairs': removed_node_pairs, 'train_batch_size': train_batch_size, 'beta': model_beta})
 
 
     ### Setup Model: Either non-vectorized, vectorized or stepwise
-    if vectorized == -1:
-        model = NoDynamicsModel(n_points=num_nodes, beta=model_beta).to(device, dtype=torch.float32)
-    if vectorized == 0:
-        model = ConstantVelocityModel(n_points=num_nodes, beta=model_beta).to(device, dtype=torch.float32)
-    elif vectorized == 1:
-        model = VectorizedConstantVelocityModel(n_points=num_nodes, beta=model_beta, device=device, z0=z0, v0=v0, true_init=True).to(device, dtype=torch.float32)
-    elif vectorized == 2:
-        last_time_point = dataset[:,2][-1].item()
-        if isinstance(model_beta, np.ndarray):
-            model = MultiBetaStepwise(n_points=num_nodes, beta=model_beta, steps=num_steps, max_time=last_time_point, 
-                                        device=device, z0=z0, v0=v0, true_init=False).to(device, dtype=torch.float32)
-        else:
-            model = StepwiseVectorizedConstantVelocityModel(n_points=num_nodes, beta=model_beta, steps=num_steps, 
-                            max_time=last_time_point, device=device, z0=z0, v0=v0, v0_init=training_type, 
-                            gamma=velocity_gamma_regularization).to(device, dtype=torch.float32)
-              
-    ## Optimizer is initialized here, Adam is used
-    optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate)
+    model = build_model(vectorized=args.vectorized, num_nodes=num_nodes, model_beta=model_beta, device=device,
+                        max_time=last_time_point, num_steps=args.refine_from_steps or num_steps, z0=z0, v0=v0,
+                        training_type=args.training_type, velocity_gamma_regularization=args.velocity_gamma_regularization,
+                        ensemble_size=args.ensemble_size, prune_threshold=args.prune_threshold,
+                        block_size=args.block_size, checkpoint_segments=args.checkpoint_segments)
+    if args.warm_start:
+        warm_start(model, dataset, num_nodes, last_time_point, args.warm_start)
+
+    ## Every process integrates its share of the node pairs and trains on their events
+    validation_data = removed_interactions if args.validation_stopping else None
+    if world_size > 1:
+        from utils.compute.distributed import shard_events
+        model.shard_pairs(rank, world_size)
+        dataset = shard_events(dataset, num_nodes, rank, world_size)
+        if validation_data is not None:
+            validation_data = shard_events(validation_data, num_nodes, rank, world_size)
+        print(f'Rank {rank} of {world_size}: {len(model.shard_pair_idxs[0])} node pairs and {len(dataset)} events')
+
+    if args.compile:
+        from utils.compute.compilation import enable_compiled_kernels
+        enable_compiled_kernels()
+
+    ## Optimizer is initialized here, Adam or L-BFGS
+    optimizer = build_optimizer(args, model)
 
     ### Model training: Either non-sequential or sequential
     metrics = {'avg_train_loss': [], 'beta_est': []}
-    
+    gym = TrainTestGym(dataset=dataset,
+                        model=model,
+                        device=device,
+                        batch_size=train_batch_size,
+                        optimizer=optimizer,
+                        metrics=metrics,
+                        time_column_idx=2,
+                        wandb_handler=logger,
+                        num_dyads=num_dyads,
+                        keep_rotation=args.keep_rotation,
+                        profile_dir=args.profile_dir,
+                        profile_trace_epochs=args.profile_trace_epochs,
+                        memory_budget=args.memory_budget*2**30 if args.memory_budget else None,
+                        auto_batch_size=args.auto_batch_size,
+                        beta_update=args.beta_update,
+                        tolerance=args.tolerance,
+                        grad_tolerance=args.grad_tolerance,
+                        target_nll=args.target_nll,
+                        patience=args.patience,
+                        min_delta=args.min_delta,
+                        param_tolerance=args.param_tolerance,
+                        validation_data=validation_data,
+                        validation_fraction=REMOVED_INTERACTIONS_FRACTION if validation_data is not None else None,
+                        distributed=world_size > 1)
+    ## A profiled beta is set in closed form, so Adam only learns z0 and v0
+    learn_beta = args.beta_update is None
+
     ## Non-sequential model training
-    if training_type == 0:
-        model.z0.requires_grad, model.v0.requires_grad, model.beta.requires_grad = True, True, True
-        gym = TrainTestGym(dataset=dataset, 
-                            model=model, 
-                            device=device, 
-                            batch_size=train_batch_size, 
-                            optimizer=optimizer, 
-                            metrics=metrics, 
-                            time_column_idx=2,
-                            wandb_handler = wandb,
-                            num_dyads=num_dyads,
-                            keep_rotation=keep_rotation)
-        gym.train_test_model(epochs=num_epochs)
-        
+    if args.training_type == 0:
+        model.z0.requires_grad, model.v0.requires_grad, model.beta.requires_grad = True, True, learn_beta
+        if args.refine_from_steps:
+            train_coarse_to_fine(args, gym, model, num_steps)
+        else:
+            gym.train_test_model(epochs=args.num_epochs)
+
     ## Sequential model training
-    elif training_type == 1:
+    elif args.training_type == 1:
         model.z0.requires_grad, model.v0.requires_grad, model.beta.requires_grad = False, False, False
-        gym = TrainTestGym(dataset=dataset, 
-                            model=model, 
-                            device=device, 
-                            batch_size=train_batch_size, 
-                            optimizer=optimizer, 
-                            metrics=metrics, 
-                            time_column_idx=2,
-                            wandb_handler = wandb,
-                            keep_rotation=keep_rotation)
         for i in range(3):
             if i == 0:
                 model.z0.requires_grad = True  # Learn Z next
             elif i == 1:
                 model.v0.requires_grad = True  # Learn V last
             elif i == 2:
-                model.beta.requires_grad = True  # Learn beta first
-                
-            gym.optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate)
-            gym.train_test_model(epochs=int(num_epochs/3))
-    
+                model.beta.requires_grad = learn_beta  # Learn beta first
 
+            gym.optimizer = build_optimizer(args, model)
+            gym.train_test_model(epochs=int(args.num_epochs/3))
 
+    ## Keep the ensemble member with the lowest loss as the trained model
+    if getattr(model, 'num_members', None):
+        best_member = model.best_member_index()
+        print(f'Ensemble member losses: {model.member_losses.tolist()}, keeping member {best_member}')
+        logger.log({'ensemble_member_losses': model.member_losses.tolist(), 'ensemble_best_member': best_member})
+        model = model.member(best_member)
+
+    ## The ranks end with the same parameters, the first rank saves and evaluates them
+    if rank > 0:
+        return
 
     ### Results generation
-    ## Build non-vectorized final and ground truth models
-    if device == 'cuda':
-        result_z0 = model.z0.detach().clone()
-        result_v0 = model.v0.detach().clone()
-        result_beta = model.beta.detach().clone()
-        train_t = np.linspace(0, dataset_full.cpu()[-1][2])
-    else:
-        result_z0 = model.z0.detach().clone()
-        result_v0 = model.v0.detach().clone()
-        result_beta = model.beta.detach().clone()
-        train_t = np.linspace(0, dataset_full[-1][2])
-    
-    # Save learned model parameters to weights and biases
-    torch.save(result_z0, os.path.join(wandb.run.dir, "final_z0.pt"))
-    torch.save(result_v0, os.path.join(wandb.run.dir, "final_v0.pt"))
-    wandb.save(os.path.join(wandb.run.dir, "final_z0.pt"))
-    wandb.save(os.path.join(wandb.run.dir, "final_v0.pt"))
+    result_z0 = model.z0.detach().clone()
+    result_v0 = model.v0.detach().clone()
+    result_beta = model.beta.detach().clone()
+
+    # Save learned model parameters to weights and biases, the max time is the end of the last step
+    save_params(logger, result_z0, result_v0, result_beta, last_time_point)
+
+    ## Streamed events are never held in memory as a whole, so they are evaluated with the evaluate command
+    if dataset_full is not None:
+        result_model, gt_model, baseline_mean = build_result_models(args, num_nodes, result_z0, result_v0, result_beta,
+                                                                    z0, v0, true_beta, model_beta, max_time, num_steps)
+        evaluate_results(args, logger, dataset_full, num_nodes, result_model, gt_model, baseline_mean,
+                            removed_node_pairs, removed_interactions)
+
+    if args.animation:
+        animate_model(args, logger, model, max_time)
+
+
+def evaluate(args):
+    setup_run(args)
+    dataset_full, num_nodes, z0, v0, true_beta, model_beta, max_time, num_steps = load_data(args)
+    _, removed_node_pairs, removed_interactions = split_data(args, dataset_full, num_nodes)
+    logger = init_logger(args, vars(args))
+
+    result_z0, result_v0, result_beta = load_params(args.params_dir, args.device)
+    result_model, gt_model, baseline_mean = build_result_models(args, num_nodes, result_z0, result_v0, result_beta,
+                                                                z0, v0, true_beta, model_beta, max_time, num_steps)
+    evaluate_results(args, logger, dataset_full, num_nodes, result_model, gt_model, baseline_mean,
+                        removed_node_pairs, removed_interactions)
+
+
+def animate(args):
+    from models.constantvelocity.stepwise_gt import GTStepwiseConstantVelocityModel
+
+    setup_run(args)
+    dataset_full, num_nodes, z0, v0, true_beta, model_beta, max_time, num_steps = load_data(args)
+    logger = init_logger(args, vars(args))
+
+    result_z0, result_v0, result_beta = load_params(args.params_dir, args.device)
+    result_model = GTStepwiseConstantVelocityModel(n_points=num_nodes, z=result_z0, v=result_v0, beta=result_beta,
+                                                    steps=result_v0.shape[2], max_time=max_time, device=args.device)
+    animate_model(args, logger, result_model, max_time)
+
+
+
+def update(args):
+    '''
+    Incremental training of a saved stepwise model on a dataset that has grown past its max time.
+    Steps are appended until the new events are covered and only the last steps are trained.
+    '''
+    from traintestgyms.ignitegym import TrainTestGym
+    from models.incremental import extend_stepwise_model, train_recent_steps
+
+    thread_config = setup_run(args)
+    dataset, num_nodes, _, _, _, _, _, _ = load_data(args)
+    last_time_point = dataset[:,2][-1].item()
+
+    result_z0, result_v0, result_beta = load_params(args.params_dir, args.device)
+    previous_max_time = args.previous_max_time
+    if previous_max_time is None:
+        max_time_path = os.path.join(args.params_dir, 'final_max_time.pt')
+        if not os.path.exists(max_time_path):
+            raise Exception(f'No final_max_time.pt in {args.params_dir}, give the max time of the saved model with --previous_max_time')
+        previous_max_time = torch.load(max_time_path).item()
+    if last_time_point <= previous_max_time:
+        print(f'Last event at time {last_time_point} is already covered by the model ending at {previous_max_time}')
+
+    model = extend_stepwise_model(result_z0, result_v0, result_beta, previous_max_time=previous_max_time, new_max_time=last_time_point,
+                                    device=args.device, gamma=args.velocity_gamma_regularization)
+    train_recent_steps(model, num_recent_steps=args.recent_steps)
+    max_time = model.end_times[-1].item()
+
+    logger = init_logger(args, {**vars(args), 'previous_max_time': previous_max_time, 'max_time': max_time,
+                                'num_steps': model.num_of_steps, 'threads': thread_config})
+    optimizer = torch.optim.Adam(model.parameters(), lr=args.learning_rate)
+    gym = TrainTestGym(dataset=dataset,
+                        model=model,
+                        device=args.device,
+                        batch_size=args.train_batch_size if args.train_batch_size > 0 else len(dataset),
+                        optimizer=optimizer,
+                        metrics={'avg_train_loss': [], 'beta_est': []},
+                        time_column_idx=2,
+                        wandb_handler=logger,
+                        num_dyads=(num_nodes * (num_nodes - 1)) / 2,
+                        keep_rotation=True,
+                        normalize_params=False)
+    gym.train_test_model(epochs=args.num_epochs)
+
+    save_params(logger, model.z0.detach().clone(), model.v0.detach().clone(), model.beta.detach().clone(), max_time)
 
 
-    ## Data generation is diffrerent for synthetic and RL datasets
-    if real_data == 0:
-        print('Generating GT and RES model')
-        if vectorized != 2: 
-            result_model = GTConstantVelocityModel(n_points=num_nodes, z=result_z0 , v=result_v0 , beta=result_beta).to(device, dtype=torch.float32)
-            gt_model = GTConstantVelocityModel(n_points=num_nodes, z=z0, v=v0, beta=true_beta).to(device, torch.float32)
-        elif vectorized == 2:
-            if isinstance(model_beta, np.ndarray):
-                result_model = GTMultiBetaStepwise(n_points=num_nodes, z=result_z0, v=result_v0, beta=result_beta,
-                                                                steps=num_steps, max_time=max_time, device=device).to(device, dtype=torch.float32)
-                gt_model = GTMultiBetaStepwise(n_points=num_nodes, z=torch.from_numpy(z0), v=v0.clone().detach(), beta=torch.tensor([true_beta]*v0.shape[2]), 
-                                                                steps=v0.shape[2], max_time=max_time, device=device).to(device, dtype=torch.float32)
-            else:
-                result_model = GTStepwiseConstantVelocityModel(n_points=num_nodes, z=result_z0, v=result_v0, beta=result_beta,
-                                                                steps=num_steps, max_time=max_time, device=device).to(device, dtype=torch.float32)
-                gt_model = GTStepwiseConstantVelocityModel(n_points=num_nodes, z=torch.from_numpy(z0), v=v0.clone().detach(), beta=true_beta, 
-                                                                steps=v0.shape[2], max_time=max_time, device=device).to(device, dtype=torch.float32)
-
-    # Overwrite ground truth to mean intensity
-    if baseline_mean:
-        baseline_mean = BaselineMeanIntensity(n_points=num_nodes, z=z0, v=v0, beta=true_beta, 
-                                    steps=v0.shape[2], max_time=max_time, device=device).to(device, dtype=torch.float32)
-        
-        ## Compare intensity rates of removed node pairs
-        if remove_node_pairs_b == 1: 
-            print('Plotting interation intensities for removed dyads')
-            num = 0
-            for removed_node_pair in removed_node_pairs:
-                num += 1
-                plot_num = '_removed_dyad' + str(num)
-                mean_plot_num = '_mean_removed_dyad' + str(num)
-                compare_intensity_rates_plot(train_t=train_t, result_model=result_model, gt_model=gt_model, nodes=[list(removed_node_pair)], wandb_handler=wandb, num=plot_num)
-                compare_intensity_rates_plot(train_t=train_t, result_model=baseline_mean, gt_model=gt_model, nodes=[list(removed_node_pair)], wandb_handler=wandb, num=mean_plot_num)
-    
-    else:
-        print('Generating RES model')
-        if vectorized != 2: 
-            result_model = GTConstantVelocityModel(n_points=num_nodes, z=result_z0 , v=result_v0 , beta=result_beta)
-        elif vectorized == 2:
-            if isinstance(model_beta, np.ndarray):
-                result_model = GTMultiBetaStepwise(n_points=num_nodes, z=result_z0, v=result_v0, beta=result_beta,
-                                                                steps=num_steps, max_time=max_time, device=device)
-            else:
-                result_model = GTStepwiseConstantVelocityModel(n_points=num_nodes, z=result_z0, v=result_v0, beta=result_beta,
-                                                                steps=num_steps, max_time=max_time, device=device)
-
-    
-    ## Compute ROC AUC for removed interactions
-    if remove_interactions_b == 1:
-        print('Computing Accuracy Scores for Removed Interactions')
-        if real_data == 0:
-            acc_removed_interactions(removed_interactions=removed_interactions, num_nodes=num_nodes, result_model=result_model, wandb_handler=wandb, gt_model=gt_model)
-            acc_removed_interactions(removed_interactions=removed_interactions, num_nodes=num_nodes, result_model=baseline_mean, wandb_handler=wandb, gt_model=gt_model, title_extension=' - Mean Ground truth')
-        else:
-            acc_removed_interactions(removed_interactions=removed_interactions, num_nodes=num_nodes, result_model=result_model, wandb_handler=wandb, gt_model=None)
+if __name__ == '__main__':
 
-    if real_data == 0:
-        ## Make intensity rate comparison plots for the synthetic datasets
-        if dataset_number == 1:
-            compare_intensity_rates_plot(train_t=train_t, result_model=result_model, gt_model=gt_model, nodes=[[0,1], [0,2], [0,3], [1,2], [1,3], [2,3]], wandb_handler=wandb, num=1)
-            if baseline_mean:
-                compare_intensity_rates_plot(train_t=train_t, result_model=baseline_mean, gt_model=gt_model, nodes=[[0,1], [0,2], [0,3], [1,2], [1,3], [2,3]], wandb_handler=wandb, num=2)
-        elif dataset_number == 2:
-            compare_intensity_rates_plot(train_t=train_t, result_model=result_model, gt_model=gt_model, nodes=[[0,1], [0,2], [0,3], [0,4], [3,4]], wandb_handler=wandb, num=1)
-            compare_intensity_rates_plot(train_t=train_t, result_model=result_model, gt_model=gt_model, nodes=[[1,2], [1,3], [1,4], [2,3], [2,4]], wandb_handler=wandb, num=2)
-            if baseline_mean:
-                compare_intensity_rates_plot(train_t=train_t, result_model=baseline_mean, gt_model=gt_model, nodes=[[0,1], [0,2], [0,3], [0,4], [3,4]], wandb_handler=wandb, num=3)
-                compare_intensity_rates_plot(train_t=train_t, result_model=baseline_mean, gt_model=gt_model, nodes=[[1,2], [1,3], [1,4], [2,3], [2,4]], wandb_handler=wandb, num=4)
-        elif dataset_number == 3:
-            compare_intensity_rates_plot(train_t=train_t, result_model=result_model, gt_model=gt_model, nodes=[[0,1], [0,21], [0,102], [0,143]], wandb_handler=wandb, num=1)
-            compare_intensity_rates_plot(train_t=train_t, result_model=result_model, gt_model=gt_model, nodes=[[20,11], [95, 106], [45, 150], [77, 88]], wandb_handler=wandb, num=2)
-            compare_intensity_rates_plot(train_t=train_t, result_model=result_model, gt_model=gt_model, nodes=[[13,120], [66, 133], [99, 144], [101, 102]], wandb_handler=wandb, num=3)
-            if baseline_mean:
-                compare_intensity_rates_plot(train_t=train_t, result_model=baseline_mean, gt_model=gt_model, nodes=[[0,1], [0,21], [0,102], [0,143]], wandb_handler=wandb, num=4)
-                compare_intensity_rates_plot(train_t=train_t, result_model=baseline_mean, gt_model=gt_model, nodes=[[20,11], [95, 106], [45, 150], [77, 88]], wandb_handler=wandb, num=5)
-                compare_intensity_rates_plot(train_t=train_t, result_model=baseline_mean, gt_model=gt_model, nodes=[[13,120], [66, 133], [99, 144], [101, 102]], wandb_handler=wandb, num=6)
-
-        ## Compute ground truth training loss for gt model and log  
-        wandb.log({'gt_train_NLL': ((gt_model.forward(data=dataset_full.to(device), t0=dataset_full[0,2].item(), tn=dataset_full[-1,2].item()) / num_dyads))})
-
-        if baseline_mean:
-            wandb.log({'gt_train_NLL': ((baseline_mean.forward(data=dataset_full.to(device), t0=dataset_full[0,2].item(), tn=dataset_full[-1,2].item()) / num_dyads))})
-    
-    if animation:
-        print(f'Creating animation of latent node positions on {animation_time_points} time points')
-        animate(model, t_start=0, t_end=max_time, num_of_time_points=animation_time_points, device=device, wandb_handler=wandb)
\ No newline at end of file
+    ### Parse Arguments for running in terminal
+    args = parse_args(sys.argv[1:])
+
+    if args.command == 'generate':
+        generate(args)
+    elif args.command == 'train':
+        if args.processes > 1:
+            import torch.multiprocessing as mp
+            mp.spawn(train_rank, args=(args,), nprocs=args.processes)
+        else:
+            train(args)
+    elif args.command == 'evaluate':
+        evaluate(args)
+    elif args.command == 'animate':
+        animate(args)
+    elif args.command == 'update':
+        update(args)
@@ -0,0 +1,61 @@
+import math
+import torch
+
+
+def supports_beta_profile(model) -> bool:
+    ## Models with a common beta, per model or ensemble member, and a separate integral term
+    return hasattr(model, 'integral') and model.beta.numel() == (getattr(model, 'num_members', None) or 1)
+
+
+def profile_beta(model, num_events:int, t0, tn, reduce=None) -> None:
+    '''
+    Sets beta to its maximum likelihood value given the positions and velocities of the model.
+    The integral of the intensity is proportional to exp(beta), so the derivative of the log likelihood
+    in beta vanishes at exp(beta) = E / sum of the integrals of exp(-d^2), which is
+    beta + log(E) - log(integral at the current beta). Ensembles profile the beta of every member.
+
+    :param model:       Model with a common beta and an integral method
+    :param num_events:  Number of events E from t0 to tn
+    :param t0:          Start of the interaction period
+    :param tn:          End of the interaction period
+    :param reduce:      Sums a tensor over the processes which share the node pairs, None for a single process
+    '''
+    if num_events == 0 and reduce is None:
+        return
+    with torch.no_grad():
+        integral = model.integral(t0, tn)
+        if reduce is not None:
+            integral = reduce(integral)
+            num_events = int(reduce(torch.tensor(float(num_events), dtype=torch.float64)).item())
+            if num_events == 0:
+                return
+        model.beta.add_((math.log(num_events) - torch.log(integral)).view(model.beta.shape))
+
+
+def unregularized_nll(model, events, t0, tn) -> torch.Tensor:
+    '''
+    Negative log likelihood of the events without the regularization which the forward pass of some models adds
+    '''
+    nll = model(events, t0=t0, tn=tn)
+    return nll - model.penalty() if hasattr(model, 'penalty') else nll
+
+
+def thinned_nll(model, events, t0, tn, fraction:float) -> torch.Tensor:
+    '''
+    Negative log likelihood of held-out events which were drawn from all events with probability fraction,
+    for a model trained on the other events. Thinning scales the intensity of the training events by
+    fraction / (1 - fraction), which is the NLL at beta + log(fraction / (1 - fraction)):
+    the event term shifts by log(scale) per event and the integral is scaled by scale.
+    The regularization of the model is not part of the NLL.
+
+    :param model:       Model with a common beta and an integral method
+    :param events:      The held-out events
+    :param t0:          Start of the interaction period
+    :param tn:          End of the interaction period
+    :param fraction:    Probability with which an event was held out
+
+    :returns:           The NLL of the held-out events
+    '''
+    scale = fraction / (1 - fraction)
+    nll = unregularized_nll(model, events, t0, tn)
+    return nll + (scale - 1)*torch.sum(model.integral(t0, tn)) - len(events)*math.log(scale)
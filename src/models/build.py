@@ -0,0 +1,57 @@
+import torch
+import numpy as np
+from models.nodynamics import NoDynamicsModel
+from models.constantvelocity.standard import ConstantVelocityModel
+from models.constantvelocity.vectorized import VectorizedConstantVelocityModel
+from models.constantvelocity.stepwise import StepwiseVectorizedConstantVelocityModel
+from models.constantvelocity.stepwise_stepbeta import StepwiseVectorizedConstantVelocityModel as MultiBetaStepwise
+from models.constantvelocity.stepwise_ensemble import StepwiseEnsembleConstantVelocityModel
+
+
+def build_model(vectorized:int, num_nodes:int, model_beta, device, max_time=None, num_steps=None,
+                z0=None, v0=None, training_type=0, velocity_gamma_regularization=None, ensemble_size=1, prune_threshold=None, block_size=None,
+                checkpoint_segments=None):
+    '''
+    Builds the model to train
+
+    :param vectorized:                      -1 is 'No dynamics', 0 is 'Non-vectorized CVM', 1 is 'Vectorized CVM'
+                                            and 2 is the stepwise model
+    :param num_nodes:                       Number of nodes in the network
+    :param model_beta:                      Initial beta, a numpy array of betas gives a beta per step
+    :param device:                          Device for torch i.e. cpu or cuda
+    :param max_time:                        Last time point of the training data, used by the stepwise models
+    :param num_steps:                       Number of velocity steps of the stepwise models
+    :param z0:                              True starting positions used by the vectorized CVM
+    :param v0:                              True velocities used by the vectorized CVM
+    :param training_type:                   0 for non-sequential and 1 for sequential training
+    :param velocity_gamma_regularization:   Regularization of the velocity changes of the stepwise model
+    :param ensemble_size:                   Number of independently initialized stepwise models trained together
+    :param prune_threshold:                 Integral bound below which the stepwise model skips a pair in a step
+    :param block_size:                      Evaluates the vectorized and stepwise likelihoods in blocks of node pairs
+    :param checkpoint_segments:             Segments of the stepwise forward pass recomputed in the backward pass
+
+    :returns:   The model as float32 on the given device
+    '''
+    if vectorized == -1:
+        model = NoDynamicsModel(n_points=num_nodes, beta=model_beta)
+    elif vectorized == 0:
+        model = ConstantVelocityModel(n_points=num_nodes, beta=model_beta)
+    elif vectorized == 1:
+        model = VectorizedConstantVelocityModel(n_points=num_nodes, beta=model_beta, device=device, z0=z0, v0=v0, true_init=True, block_size=block_size)
+    elif vectorized == 2:
+        if ensemble_size > 1 and not isinstance(model_beta, np.ndarray):
+            model = StepwiseEnsembleConstantVelocityModel(num_members=ensemble_size, n_points=num_nodes, beta=model_beta,
+                            steps=num_steps, max_time=max_time, device=device, v0_init=training_type,
+                            gamma=velocity_gamma_regularization)
+        elif isinstance(model_beta, np.ndarray):
+            model = MultiBetaStepwise(n_points=num_nodes, beta=model_beta, steps=num_steps, max_time=max_time,
+                                        device=device, z0=z0, v0=v0, true_init=False)
+        else:
+            model = StepwiseVectorizedConstantVelocityModel(n_points=num_nodes, beta=model_beta, steps=num_steps,
+                            max_time=max_time, device=device, z0=z0, v0=v0, v0_init=training_type,
+                            gamma=velocity_gamma_regularization, prune_threshold=prune_threshold, block_size=block_size,
+                            checkpoint_segments=checkpoint_segments)
+    else:
+        raise Exception(f'Unknown model type: {vectorized}')
+
+    return model.to(device, dtype=torch.float32)
@@ -2,6 +2,7 @@ import torch
 import torch.nn as nn
 from utils.nodes.distances import get_squared_euclidean_dist
 from utils.integrals.analytical import analytical_integral as evaluate_integral
+from data.events import EventSet
 
 
 class ConstantVelocityModel(nn.Module):
@@ -68,6 +69,8 @@ class ConstantVelocityModel(nn.Module):
 
         :returns:       Log liklihood of the model based on the given data
         '''
+        if isinstance(data, EventSet):
+            data = data.to_tensor()
         event_intensity = 0.
         for i, j, event_time in data:
             i, j = int(i), int(j) # cast to int for indexing
@@ -1,7 +1,33 @@
 import torch
 import torch.nn as nn
 from utils.nodes.distances import vec_squared_euclidean_dist
-from utils.integrals.analytical import vec_analytical_integral as evaluate_integral
+from utils.integrals.analytical import vec_analytical_integral as evaluate_integral, pruned_integral_sum, tiled_integral_sum, pair_integral_sum
+from data.events import EventSet
+from utils.compute.profiling import phase
+from utils.compute.compilation import compilable
+from utils.compute.memory import checkpoint_segment
+from utils.compute.distributed import pair_owner
+
+
+## Parts of the forward pass which can be recomputed in the backward pass instead of being stored
+CHECKPOINT_SEGMENTS = ['positions', 'event', 'integral']
+
+
+@compilable
+def step_positions(z0:torch.Tensor, v0:torch.Tensor, times:torch.Tensor, start_times:torch.Tensor, step_size:torch.Tensor) -> torch.Tensor:
+    '''
+    Latent positions of shape (N,2,T) at the times, moving through the steps
+    of size step_size starting at start_times with the velocities v0 of shape (N,2,S)
+    '''
+    step_mask = ((times.unsqueeze(1) > start_times) | (start_times == 0).unsqueeze(0))
+    step_end_times = step_mask*torch.cumsum(step_mask*step_size, dim=1)
+    time_mask = times.unsqueeze(1) <= step_end_times
+    time_deltas = (step_size - (step_end_times - times.unsqueeze(1))*time_mask)*step_mask
+
+    movement = torch.sum(v0.unsqueeze(2)*time_deltas, dim=3)
+
+    ## Latent Z positions for all times
+    return z0.unsqueeze(2) + movement
 
 
 class StepwiseVectorizedConstantVelocityModel(nn.Module):
@@ -10,37 +36,75 @@ class StepwiseVectorizedConstantVelocityModel(nn.Module):
     The model predicts starting postion z0, starting velocities v0, and starting background node intensity beta
     using a Euclidean distance measure in latent space for the intensity function.
     '''
-    def __init__(self, n_points:int, beta:float, steps, max_time, device, z0, v0, v0_init, gamma=None):
+    def __init__(self, n_points:int, beta:float, steps, max_time, device, z0, v0, v0_init, gamma=None, prune_threshold=None, block_size=None,
+                    checkpoint_segments=None):
             '''
             :param n_points:                Number of nodes in the temporal dynamics graph network
             :param intensity_func:          The intensity function of the model
             :param integral_approximator:   The function used to approximate the non-event intensity integral
+            :param prune_threshold:         Pairs whose integral in a step is bounded below this are skipped
+            :param block_size:              Evaluates the likelihood in blocks of block_size x block_size node pairs
+            :param checkpoint_segments:     Segments of CHECKPOINT_SEGMENTS which are recomputed in the backward pass
             '''
             super().__init__()
     
             self.gamma = gamma
+            self.prune_threshold = prune_threshold
+            self.block_size = block_size
+            self.checkpoint_segments = set(checkpoint_segments or [])
+            if not self.checkpoint_segments.issubset(CHECKPOINT_SEGMENTS):
+                raise Exception(f'Unknown checkpoint segments: {sorted(self.checkpoint_segments - set(CHECKPOINT_SEGMENTS))}')
+            self.warned_positions_segment = False
+            ## Upper bound of the integral mass skipped by pruning in the last forward pass
+            self.neglected_mass = None
             self.device = device
             self.num_of_steps = steps
             self.beta = nn.Parameter(torch.tensor([[beta]]), requires_grad=True)
 
             if v0_init == 2:
                 self.z0 = nn.Parameter(torch.rand(size=(n_points,2))*0.5, requires_grad=True)
-                self.v0 = nn.Parameter(torch.rand(size=(n_points,2, steps))*torch.eps, requires_grad=True) 
+                self.v0 = nn.Parameter(torch.rand(size=(n_points,2, steps))*torch.finfo(torch.float32).eps, requires_grad=True) 
             else:
                 self.z0 = nn.Parameter(torch.rand(size=(n_points,2))*0.5, requires_grad=True) 
                 self.v0 = nn.Parameter(torch.rand(size=(n_points,2, steps))*0.5, requires_grad=True) 
     
             self.num_of_nodes = n_points
             self.node_pair_idxs = torch.triu_indices(row=self.num_of_nodes, col=self.num_of_nodes, offset=1)
+            ## Rank and number of processes when the node pairs are shared between processes, see shard_pairs
+            self.shard = None
+            self.shard_pair_idxs = None
+
+            self.__init_steps(steps, max_time)
 
-            ## Creating the time step deltas equally distributed
-            time_intervals = torch.linspace(0, max_time, steps+1)
-            self.start_times = time_intervals[:-1].to(self.device, dtype=torch.float32)
-            self.end_times = time_intervals[1:].to(self.device, dtype=torch.float32)
-            self.time_intervals = list(zip(self.start_times.tolist(), self.end_times.tolist()))
-            self.time_deltas = (self.end_times-self.start_times)
-            ## All deltas should be equal do to linspace, so we can take the first
-            self.step_size = self.time_deltas[0]
+    def __init_steps(self, steps:int, max_time):
+        ## Creating the time step deltas equally distributed
+        self.num_of_steps = steps
+        time_intervals = torch.linspace(0, max_time, steps+1)
+        self.start_times = time_intervals[:-1].to(self.device, dtype=torch.float32)
+        self.end_times = time_intervals[1:].to(self.device, dtype=torch.float32)
+        self.time_intervals = list(zip(self.start_times.tolist(), self.end_times.tolist()))
+        self.time_deltas = (self.end_times-self.start_times)
+        ## All deltas should be equal do to linspace, so we can take the first
+        self.step_size = self.time_deltas[0]
+
+    def split_steps(self) -> None:
+        '''
+        Splits every step into two halves which both keep the velocity of the step,
+        so the trajectories of the nodes stay exactly the same with twice the number of steps
+        '''
+        self.v0 = nn.Parameter(self.v0.detach().repeat_interleave(2, dim=2), requires_grad=self.v0.requires_grad)
+        self.__init_steps(2*self.num_of_steps, self.end_times[-1].item())
+
+    def shard_pairs(self, rank:int, world_size:int) -> None:
+        '''
+        Restricts the integral to the node pairs owned by the rank, see pair_owner. Trained on the events
+        of the same pairs, the losses of all ranks sum to the loss of the full model. The velocity
+        regularization is added by rank 0 only.
+        '''
+        i, j = self.node_pair_idxs
+        owned = pair_owner(i, j, self.num_of_nodes, world_size) == rank
+        self.shard = (rank, world_size)
+        self.shard_pair_idxs = self.node_pair_idxs[:,owned].to(self.device)
 
     def steps_z0(self):
         steps_z0 = self.z0.unsqueeze(2) + torch.cumsum(self.v0*self.time_deltas, dim=2)
@@ -58,17 +122,46 @@ class StepwiseVectorizedConstantVelocityModel(nn.Module):
         :param t:   The time to update the latent position vector z with
         :returns:   The updated latent position vector z
         '''
-        step_mask = ((times.unsqueeze(1) > self.start_times) | (self.start_times == 0).unsqueeze(0))
-        step_end_times = step_mask*torch.cumsum(step_mask*self.step_size, axis=1)
-        time_mask = times.unsqueeze(1) <= step_end_times
-        time_deltas = (self.step_size - (step_end_times - times.unsqueeze(1))*time_mask)*step_mask
-           
-        movement = torch.sum(self.v0.unsqueeze(2)*time_deltas, dim=3)
-    
-        ## Latent Z positions for all times
-        zt = self.z0.unsqueeze(2) + movement
+        return self.__positions(self.z0, self.v0, times)
+
+    def __run_segment(self, segment:str, function, *tensors):
+        ## Checkpointed segments keep only their inputs and are recomputed in the backward pass
+        if segment in self.checkpoint_segments:
+            return checkpoint_segment(function, *tensors)
+        return function(*tensors)
+
+    def __positions(self, z0, v0, times):
+        position_term = lambda z0, v0: step_positions(z0, v0, times, self.start_times, self.step_size)
+        return self.__run_segment('positions', position_term, z0, v0)
 
-        return zt
+    def __event_intensity(self, z0, v0, beta, unique_times, unique_time_indices, pair_ids):
+        '''
+        Sum of the log intensities of the events, evaluated at the unique times of the events
+        '''
+        with phase('steps'):
+            Zt = self.__positions(z0, v0, unique_times)
+        if self.block_size:
+            ## Only the distances of the event pairs are computed instead of all N x N distances
+            with phase('event_intensity'):
+                i, j = torch.div(pair_ids, self.num_of_nodes, rounding_mode='floor'), pair_ids % self.num_of_nodes
+                event_diffs = Zt[i,:,unique_time_indices] - Zt[j,:,unique_time_indices]
+                return torch.sum(beta - torch.sum(torch.square(event_diffs), dim=1))
+        with phase('distances'):
+            log_intensities = beta - vec_squared_euclidean_dist(Zt)
+        with phase('event_intensity'):
+            return torch.sum(log_intensities.reshape(-1, log_intensities.shape[2])[pair_ids,unique_time_indices])
+
+    def __integral(self, t0, tn, steps_z0, v0, beta):
+        if self.shard_pair_idxs is not None:
+            i, j = self.shard_pair_idxs
+            return pair_integral_sum(t0, tn, steps_z0, v0, beta, i, j)
+        if self.prune_threshold:
+            non_event_intensity, self.neglected_mass = pruned_integral_sum(t0, tn, z0=steps_z0, v0=v0,
+                                                                            beta=beta, threshold=self.prune_threshold)
+            return non_event_intensity
+        all_integrals = evaluate_integral(t0, tn, z0=steps_z0, v0=v0, beta=beta)
+        ## Sum over time dimension, dim 2, and then sum upper triangular
+        return torch.sum(torch.sum(all_integrals,dim=2).triu(diagonal=1))
     
     def log_intensity_function(self, times:torch.Tensor):
         '''
@@ -79,43 +172,80 @@ class StepwiseVectorizedConstantVelocityModel(nn.Module):
         :returns:   The log of the intensity between i and j at time t as a measure of
                     the two nodes' log-likelihood of interacting.
         '''
-        Zt = self.steps(times)
-        d = vec_squared_euclidean_dist(Zt)
+        with phase('steps'):
+            Zt = self.steps(times)
+        with phase('distances'):
+            d = vec_squared_euclidean_dist(Zt)
 
         ## Only take upper triangular part, since the distance matrix is symmetric and exclude node distance to same node
         return self.beta - d
     
-    def regularize(self, log_likelihood):
+    def integral(self, t0, tn, steps_z0=None) -> torch.Tensor:
         '''
-        Regularizes the model using the squared Frobenius norm of the changes in velocity
+        Sum of the integrals of the intensities of all node pairs i < j from t0 to tn,
+        the non-event term of the log likelihood, or of the pairs of the rank if sharded
+
+        :param steps_z0:    Positions at the start of the steps, computed if not given
+        '''
+        if steps_z0 is None:
+            steps_z0 = self.steps_z0()
+        if self.block_size and self.shard_pair_idxs is None:
+            ## The tiled integral checkpoints every block itself
+            return tiled_integral_sum(t0, tn, z0=steps_z0, v0=self.v0, beta=self.beta, block_size=self.block_size)
+        integral_term = lambda steps_z0, v0, beta: self.__integral(t0, tn, steps_z0, v0, beta)
+        return self.__run_segment('integral', integral_term, steps_z0, self.v0, self.beta)
+
+    def penalty(self):
         '''
+        Squared Frobenius norm of the changes in velocity times gamma, which forward adds to the negative
+        log likelihood. With sharded pairs only rank 0 adds it, 0 when it is not added.
+        '''
+        if not self.gamma or (self.shard is not None and self.shard[0] != 0):
+            return 0.
         velocity_changes = self.v0[:,:,1:]-self.v0[:,:,:-1]
         sq_frob_norms = torch.square(torch.linalg.norm(velocity_changes))
-        return  -log_likelihood + self.gamma * torch.sum(sq_frob_norms)
+        return self.gamma * torch.sum(sq_frob_norms)
+
+    def regularize(self, log_likelihood):
+        '''
+        Regularizes the model using the squared Frobenius norm of the changes in velocity
+        '''
+        return  -log_likelihood + self.penalty()
     
     def forward(self, data:torch.Tensor, t0:torch.Tensor, tn:torch.Tensor) -> torch.Tensor:
         '''
         Standard torch method for training of the model.
-        :param data:    Node pair interaction data with columns [node_i, node_j, time_point]
+        :param data:    Node pair interaction data with columns [node_i, node_j, time_point] or an EventSet
         :param t0:      Start of the interaction period
         :param tn:      End of the interaction period
         :returns:       Log liklihood of the model based on the given data
         '''
-        times = data[:,2].to(self.device, dtype=torch.float32)
-        unique_times, unique_time_indices = torch.unique(times, return_inverse=True)
-        i = data[:,0].long() #long to make i and j int
-        j = data[:,1].long()
-        log_intensities = self.log_intensity_function(times=unique_times)
-
-        event_intensity = torch.sum(log_intensities[i,j,unique_time_indices])
+        with phase('steps_z0'):
+            steps_z0 = self.steps_z0()
+        if isinstance(data, EventSet) and data.num_steps == self.num_of_steps:
+            ## Prepared events are reduced to sufficient statistics per active (pair, step), which need no positions
+            if 'positions' in self.checkpoint_segments and not self.warned_positions_segment:
+                print('The positions checkpoint segment is not used with prepared events, which need no positions')
+                self.warned_positions_segment = True
+            statistics_term = lambda steps_z0, v0, beta: beta.view(-1)[0]*len(data) - torch.sum(data.step_statistics.squared_distance_sum(steps_z0, v0))
+            with phase('event_statistics'):
+                event_intensity = self.__run_segment('event', statistics_term, steps_z0, self.v0, self.beta)
+        else:
+            if isinstance(data, EventSet):
+                ## Indices are cached on the event set
+                unique_times = data.unique_times.to(self.device, dtype=torch.float32)
+                unique_time_indices, pair_ids = data.time_inverse, data.pair_ids
+            else:
+                times = data[:,2].to(self.device, dtype=torch.float32)
+                unique_times, unique_time_indices = torch.unique(times, return_inverse=True)
+                pair_ids = data[:,0].long()*self.num_of_nodes + data[:,1].long()
+            event_term = lambda z0, v0, beta: self.__event_intensity(z0, v0, beta, unique_times, unique_time_indices, pair_ids)
+            event_intensity = self.__run_segment('event', event_term, self.z0, self.v0, self.beta)
 
-        all_integrals = evaluate_integral(t0, tn, z0=self.steps_z0(), 
-                                            v0=self.v0, beta=self.beta)
-        ## Sum over time dimension, dim 2, and then sum upper triangular
-        integral = torch.sum(torch.sum(all_integrals,dim=2).triu(diagonal=1))
-        non_event_intensity = torch.sum(integral)
+        with phase('integral'):
+            non_event_intensity = self.integral(t0, tn, steps_z0=steps_z0)
 
         log_likelihood =  event_intensity - non_event_intensity 
     
         ## Regularize model on velocity change if gamma is set
-        return self.regularize(log_likelihood) if self.gamma else -log_likelihood
\ No newline at end of file
+        return self.regularize(log_likelihood)
\ No newline at end of file
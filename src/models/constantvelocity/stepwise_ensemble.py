@@ -0,0 +1,166 @@
+import torch
+import torch.nn as nn
+from utils.integrals.analytical import pairwise_integral
+from models.constantvelocity.stepwise import StepwiseVectorizedConstantVelocityModel
+from data.events import EventSet
+from utils.compute.profiling import phase
+
+
+class StepwiseEnsembleConstantVelocityModel(nn.Module):
+    '''
+    K independently initialized stepwise constant velocity models trained in one forward pass.
+    The parameters of the members are stacked along a leading dimension, so all members share
+    the event indexing and are evaluated by the same vectorized kernels.
+    The loss is the sum of the member losses, which keeps the gradients of the members
+    independent of each other, and Adam updates each member as if it was trained alone.
+    '''
+    def __init__(self, num_members:int, n_points:int, beta:float, steps, max_time, device, v0_init, gamma=None):
+            '''
+            :param num_members: Number of independently initialized models K
+            :param n_points:    Number of nodes in the temporal dynamics graph network
+            :param beta:        Initial common bias term of all members
+            :param steps:       Number of velocity steps
+            :param max_time:    End of the last step
+            :param device:      Device for torch i.e. cpu or cuda
+            :param v0_init:     2 initializes the velocities close to 0
+            :param gamma:       Optional regularization of the velocity changes
+            '''
+            super().__init__()
+
+            self.gamma = gamma
+            self.device = device
+            self.max_time = max_time
+            self.num_members = num_members
+            self.num_of_steps = steps
+            self.beta = nn.Parameter(torch.full(size=(num_members,1,1), fill_value=beta), requires_grad=True)
+
+            self.z0 = nn.Parameter(torch.rand(size=(num_members,n_points,2))*0.5, requires_grad=True)
+            if v0_init == 2:
+                self.v0 = nn.Parameter(torch.rand(size=(num_members,n_points,2,steps))*torch.finfo(torch.float32).eps, requires_grad=True)
+            else:
+                self.v0 = nn.Parameter(torch.rand(size=(num_members,n_points,2,steps))*0.5, requires_grad=True)
+
+            self.num_of_nodes = n_points
+
+            ## Creating the time step deltas equally distributed
+            time_intervals = torch.linspace(0, max_time, steps+1)
+            self.start_times = time_intervals[:-1].to(self.device, dtype=torch.float32)
+            self.end_times = time_intervals[1:].to(self.device, dtype=torch.float32)
+            self.time_deltas = (self.end_times-self.start_times)
+            ## All deltas should be equal do to linspace, so we can take the first
+            self.step_size = self.time_deltas[0]
+
+            ## Loss of every member in the last forward pass
+            self.member_losses = None
+
+    def steps_z0(self):
+        steps_z0 = self.z0.unsqueeze(3) + torch.cumsum(self.v0*self.time_deltas, dim=3)
+        ## Adding the initial Z0 position as first step
+        steps_z0 = torch.cat((self.z0.unsqueeze(3), steps_z0), dim=3)
+        ## We don't take the very last z0, because that is the final z positions and not the start of any new step
+        return steps_z0[:,:,:,:-1]
+
+    def steps(self, times:torch.Tensor) -> torch.Tensor:
+        '''
+        Latent positions of all members at the given times
+
+        :param times:   The times to compute the positions at
+
+        :returns:       Positions of shape (K,N,2,len(times))
+        '''
+        step_mask = ((times.unsqueeze(1) > self.start_times) | (self.start_times == 0).unsqueeze(0))
+        step_end_times = step_mask*torch.cumsum(step_mask*self.step_size, axis=1)
+        time_mask = times.unsqueeze(1) <= step_end_times
+        time_deltas = (self.step_size - (step_end_times - times.unsqueeze(1))*time_mask)*step_mask
+
+        movement = torch.sum(self.v0.unsqueeze(3)*time_deltas, dim=4)
+
+        return self.z0.unsqueeze(3) + movement
+
+    def regularize(self):
+        '''
+        Squared Frobenius norm of the velocity changes of every member
+        '''
+        velocity_changes = self.v0[:,:,:,1:]-self.v0[:,:,:,:-1]
+        return self.gamma * torch.sum(torch.square(velocity_changes), dim=(1,2,3))
+
+    def penalty(self):
+        '''
+        Sum of the regularizations of the members, which forward adds to the summed loss, 0 without gamma
+        '''
+        return torch.sum(self.regularize()) if self.gamma else 0.
+
+    def integral(self, t0, tn, steps_z0=None) -> torch.Tensor:
+        '''
+        Sums of the integrals of the intensities of all node pairs i < j from t0 to tn
+        of every member, the non-event terms of the log likelihoods of shape (K,)
+        '''
+        if steps_z0 is None:
+            steps_z0 = self.steps_z0()
+        a = steps_z0[:,:,0].unsqueeze(2) - steps_z0[:,:,0].unsqueeze(1)
+        b = steps_z0[:,:,1].unsqueeze(2) - steps_z0[:,:,1].unsqueeze(1)
+        m = self.v0[:,:,0].unsqueeze(2) - self.v0[:,:,0].unsqueeze(1)
+        n = self.v0[:,:,1].unsqueeze(2) - self.v0[:,:,1].unsqueeze(1)
+        all_integrals = pairwise_integral(t0, tn, a, b, m, n, self.beta.unsqueeze(3))
+        ## Sum over time dimension, dim 3, and then sum upper triangular of every member
+        return torch.sum(torch.sum(all_integrals, dim=3).triu(diagonal=1), dim=(1,2))
+
+    def forward(self, data:torch.Tensor, t0:torch.Tensor, tn:torch.Tensor) -> torch.Tensor:
+        '''
+        Standard torch method for training of the model.
+        :param data:    Node pair interaction data with columns [node_i, node_j, time_point]
+        :param t0:      Start of the interaction period
+        :param tn:      End of the interaction period
+        :returns:       Sum of the negative log likelihoods of all members
+        '''
+        with phase('steps_z0'):
+            steps_z0 = self.steps_z0()
+        if isinstance(data, EventSet) and data.num_steps == self.num_of_steps:
+            ## Prepared events are reduced to sufficient statistics per active (pair, step), shape (P,K)
+            with phase('event_statistics'):
+                event_distances = data.step_statistics.squared_distance_sum(steps_z0, self.v0)
+        else:
+            ## Only the distances of the observed events are needed, shape (E,K,2)
+            if isinstance(data, EventSet):
+                unique_times = data.unique_times.to(self.device, dtype=torch.float32)
+                unique_time_indices, i, j = data.time_inverse, data.src.long(), data.dst.long()
+            else:
+                times = data[:,2].to(self.device, dtype=torch.float32)
+                unique_times, unique_time_indices = torch.unique(times, return_inverse=True)
+                i = data[:,0].long() #long to make i and j int
+                j = data[:,1].long()
+            with phase('steps'):
+                Zt = self.steps(unique_times)
+            event_diffs = Zt[:,i,:,unique_time_indices] - Zt[:,j,:,unique_time_indices]
+            event_distances = torch.sum(torch.square(event_diffs), dim=2)
+        event_intensity = self.beta.view(-1)*len(data) - torch.sum(event_distances, dim=0)
+
+        with phase('integral'):
+            non_event_intensity = self.integral(t0, tn, steps_z0=steps_z0)
+
+        member_losses = non_event_intensity - event_intensity
+        if self.gamma:
+            with phase('regularize'):
+                member_losses = member_losses + self.regularize()
+        self.member_losses = member_losses.detach().clone()
+
+        return torch.sum(member_losses)
+
+    def best_member_index(self) -> int:
+        return int(torch.argmin(self.member_losses))
+
+    def member(self, k:int) -> StepwiseVectorizedConstantVelocityModel:
+        '''
+        Extracts member k as a standalone stepwise model
+
+        :param k:   Index of the member
+
+        :returns:   StepwiseVectorizedConstantVelocityModel with the parameters of member k
+        '''
+        model = StepwiseVectorizedConstantVelocityModel(n_points=self.num_of_nodes, beta=self.beta[k].item(),
+                                                        steps=self.num_of_steps, max_time=self.max_time, device=self.device,
+                                                        z0=None, v0=None, v0_init=0, gamma=self.gamma)
+        model.load_state_dict({'beta': self.beta[k].detach().clone(),
+                                'z0': self.z0[k].detach().clone(),
+                                'v0': self.v0[k].detach().clone()})
+        return model.to(self.device, dtype=self.z0.dtype)
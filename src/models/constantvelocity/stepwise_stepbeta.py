@@ -3,6 +3,8 @@ import numpy as np
 import torch.nn as nn
 from utils.nodes.distances import vec_squared_euclidean_dist
 from utils.integrals.analytical import vec_analytical_integral as evaluate_integral
+from data.events import EventSet
+from utils.compute.profiling import phase
 
 
 class StepwiseVectorizedConstantVelocityModel(nn.Module):
@@ -101,17 +103,24 @@ class StepwiseVectorizedConstantVelocityModel(nn.Module):
 
         :returns:       Log liklihood of the model based on the given data
         '''
-        steps_z0, log_intensities = self.log_intensity_function(times=data[:,2])
-        t = list(range(data.shape[0]))
-        i = torch.floor(data[:,0]).tolist() #torch.floor to make i and j int
-        j = torch.floor(data[:,1]).tolist()
-        event_intensity = torch.sum(log_intensities[i,j,t])
+        if isinstance(data, EventSet):
+            times, i, j = data.t, data.src.long(), data.dst.long()
+            t = torch.arange(len(data))
+        else:
+            times = data[:,2]
+            t = list(range(data.shape[0]))
+            i = torch.floor(data[:,0]).tolist() #torch.floor to make i and j int
+            j = torch.floor(data[:,1]).tolist()
+        with phase('event_intensity'):
+            steps_z0, log_intensities = self.log_intensity_function(times=times)
+            event_intensity = torch.sum(log_intensities[i,j,t])
         #event_intensity = torch.sum(torch.sum(log_intensities, dim=2))
-        all_integrals = evaluate_integral(t0, tn, z0=steps_z0, 
-                                            v0=self.v0, beta=self.beta)
-        #Sum over time dimension, dim 2, and then sum upper triangular
-        integral = torch.sum(torch.sum(all_integrals,dim=2).triu(diagonal=1))
-        non_event_intensity = torch.sum(integral)
+        with phase('integral'):
+            all_integrals = evaluate_integral(t0, tn, z0=steps_z0, 
+                                                v0=self.v0, beta=self.beta)
+            #Sum over time dimension, dim 2, and then sum upper triangular
+            integral = torch.sum(torch.sum(all_integrals,dim=2).triu(diagonal=1))
+            non_event_intensity = torch.sum(integral)
 
         # Log likelihood
         log_likelihood = event_intensity - non_event_intensity
@@ -1,7 +1,9 @@
 import torch
 import torch.nn as nn
 from utils.nodes.distances import vec_squared_euclidean_dist
-from utils.integrals.analytical import vec_analytical_integral as evaluate_integral
+from utils.integrals.analytical import vec_analytical_integral as evaluate_integral, tiled_integral_sum
+from data.events import EventSet
+from utils.compute.profiling import phase
 
 
 class VectorizedConstantVelocityModel(nn.Module):
@@ -10,15 +12,17 @@ class VectorizedConstantVelocityModel(nn.Module):
     The model predicts starting postion z0, starting velocities v0, and starting background node intensity beta
     using a Euclidean distance measure in latent space for the intensity function.
     '''
-    def __init__(self, n_points:int, beta:float, device, z0, v0, true_init):
+    def __init__(self, n_points:int, beta:float, device, z0, v0, true_init, block_size=None):
             '''
             :param n_points:                Number of nodes in the temporal dynamics graph network
             :param intensity_func:          The intensity function of the model
             :param integral_approximator:   The function used to approximate the non-event intensity integral
+            :param block_size:              Evaluates the likelihood in blocks of block_size x block_size node pairs
             '''
             super().__init__()
     
             self.device = device
+            self.block_size = block_size
             self.beta = nn.Parameter(torch.tensor([[beta]]), requires_grad=True)
             
             if true_init:
@@ -67,24 +71,46 @@ class VectorizedConstantVelocityModel(nn.Module):
         return self.beta - d
 
 
+    def integral(self, t0, tn) -> torch.Tensor:
+        '''
+        Sum of the integrals of the intensities of all node pairs i < j from t0 to tn,
+        the non-event term of the log likelihood
+        '''
+        if self.block_size:
+            return tiled_integral_sum(t0, tn, z0=self.z0, v0=self.v0, beta=self.beta, block_size=self.block_size)
+        return torch.sum(evaluate_integral(t0, tn, z0=self.z0, v0=self.v0, beta=self.beta).triu(diagonal=1))
+
+
     def forward(self, data:torch.Tensor, t0:torch.Tensor, tn:torch.Tensor) -> torch.Tensor:
         '''
         Standard torch method for training of the model.
 
-        :param data:    Node pair interaction data with columns [node_i, node_j, time_point]
+        :param data:    Node pair interaction data with columns [node_i, node_j, time_point] or an EventSet
         :param t0:      Start of the interaction period
         :param tn:      End of the interaction period
 
         :returns:       Log liklihood of the model based on the given data
         '''
-        log_intensities = self.log_intensity_function(times=data[:,2])
-        t = list(range(data.size()[0]))
-        i = torch.floor(data[:,0]).tolist() #torch.floor to make i and j int
-        j = torch.floor(data[:,1]).tolist()
-
-        event_intensity = torch.sum(log_intensities[i,j,t])
-        non_event_intensity = torch.sum(evaluate_integral(t0, tn, z0=self.z0, 
-                                                            v0=self.v0, beta=self.beta).triu(diagonal=1))
+        if isinstance(data, EventSet) and self.block_size:
+            ## Only the distances of the event pairs are computed instead of all N x N distances
+            with phase('event_intensity'):
+                i, j, times = data.src.long(), data.dst.long(), data.t.to(self.z0.dtype).unsqueeze(1)
+                event_diffs = (self.z0[i] - self.z0[j]) + (self.v0[i] - self.v0[j])*times
+                event_intensity = torch.sum(self.beta - torch.sum(torch.square(event_diffs), dim=1))
+        elif isinstance(data, EventSet):
+            ## Only the unique times are evaluated, the indices are cached on the event set
+            with phase('event_intensity'):
+                log_intensities = self.log_intensity_function(times=data.unique_times)
+                event_intensity = torch.sum(log_intensities.reshape(-1, log_intensities.shape[2])[data.pair_ids,data.time_inverse])
+        else:
+            log_intensities = self.log_intensity_function(times=data[:,2])
+            t = list(range(data.size()[0]))
+            i = torch.floor(data[:,0]).tolist() #torch.floor to make i and j int
+            j = torch.floor(data[:,1]).tolist()
+
+            event_intensity = torch.sum(log_intensities[i,j,t])
+        with phase('integral'):
+            non_event_intensity = self.integral(t0, tn)
 
         log_liklihood = event_intensity - non_event_intensity
         return -log_liklihood
\ No newline at end of file
@@ -0,0 +1,53 @@
+import math
+import torch
+from models.constantvelocity.stepwise import StepwiseVectorizedConstantVelocityModel
+
+
+def extend_stepwise_model(z0:torch.Tensor, v0:torch.Tensor, beta:torch.Tensor, previous_max_time:float, new_max_time:float,
+                            device, gamma=None) -> StepwiseVectorizedConstantVelocityModel:
+    '''
+    Warm-starts a stepwise model from saved parameters and appends steps of the same size
+    until the steps cover the new max time. The new steps start with the last velocity,
+    which extrapolates the last known movement of the nodes.
+
+    :param z0:                  Saved starting positions of shape (N,2)
+    :param v0:                  Saved velocities of shape (N,2,S)
+    :param beta:                Saved beta
+    :param previous_max_time:   End of the last saved step
+    :param new_max_time:        Last time point of the new events
+    :param device:              Device for torch i.e. cpu or cuda
+    :param gamma:               Optional regularization of the velocity changes
+
+    :returns:   The extended model as float32 on the given device
+    '''
+    num_steps = v0.shape[2]
+    step_size = previous_max_time / num_steps
+    num_new_steps = max(0, math.ceil((new_max_time - previous_max_time) / step_size - 1e-9))
+    max_time = previous_max_time + num_new_steps*step_size
+
+    new_v0 = torch.cat((v0, v0[:,:,-1:].repeat(1,1,num_new_steps)), dim=2)
+    print(f'Extending the model from {num_steps} to {num_steps+num_new_steps} steps, covering times up to {max_time}')
+
+    model = StepwiseVectorizedConstantVelocityModel(n_points=z0.shape[0], beta=float(beta.flatten()[0]), steps=num_steps+num_new_steps,
+                                                    max_time=max_time, device=device, z0=None, v0=None, v0_init=0, gamma=gamma)
+    model.load_state_dict({'beta': beta.detach().clone().view(1,1), 'z0': z0.detach().clone(), 'v0': new_v0.detach().clone()})
+    return model.to(device, dtype=torch.float32)
+
+
+def train_recent_steps(model:StepwiseVectorizedConstantVelocityModel, num_recent_steps:int):
+    '''
+    Restricts training of a stepwise model to the velocities of its last steps and beta.
+    The velocities of the older steps and the starting positions are kept, so the
+    positions in the already fitted part of the timeline do not change.
+
+    :param model:               The stepwise model
+    :param num_recent_steps:    Number of trailing steps to train
+
+    :returns:   The handle of the gradient hook, remove it to train all steps again
+    '''
+    first_trained_step = max(0, model.num_of_steps - num_recent_steps)
+    step_mask = (torch.arange(model.num_of_steps, device=model.v0.device) >= first_trained_step).to(model.v0.dtype)
+    model.z0.requires_grad = first_trained_step == 0
+    model.v0.requires_grad, model.beta.requires_grad = True, True
+    ## Zero gradients also keep the Adam moments of the frozen steps at zero, so they are never updated
+    return model.v0.register_hook(lambda grad: grad*step_mask)
@@ -1,6 +1,8 @@
 import torch
 import torch.nn as nn
 from utils.nodes.distances import vec_squared_euclidean_dist
+from data.events import EventSet
+from utils.compute.profiling import phase
 
 
 class NoDynamicsModel(nn.Module):
@@ -54,9 +56,13 @@ class NoDynamicsModel(nn.Module):
 
         :returns:       Log liklihood of the data based on the current model params
         '''
-        i = data[:,0].long() #Long for indexing
-        j = data[:,1].long()
-        distances = vec_squared_euclidean_dist(self.z0)
+        if isinstance(data, EventSet):
+            i, j = data.src.long(), data.dst.long()
+        else:
+            i = data[:,0].long() #Long for indexing
+            j = data[:,1].long()
+        with phase('distances'):
+            distances = vec_squared_euclidean_dist(self.z0)
 
         log_intensities = self.log_intensity_function(distances)
         event_intensity = torch.sum(log_intensities[i,j])
@@ -0,0 +1,166 @@
+import os
+import torch
+import numpy as np
+from utils.integrals.analytical import pairwise_integral
+from utils.nodes.spatial_index import StepwiseSpatialIndex
+from utils.nodes.positions import find_steps_and_offsets
+
+
+class StepwiseScorer:
+    '''
+    Inference-only view of trained stepwise parameters.
+    The step start positions are computed once when the scorer is created and no
+    tensor tracks gradients, so every query is a few gathers on fixed tensors.
+    All queries are batched, they take arrays of node indices and times.
+    '''
+    def __init__(self, z0:torch.Tensor, v0:torch.Tensor, beta:torch.Tensor, max_time:float, device='cpu') -> None:
+        '''
+        :param z0:          Starting positions of shape (N,2)
+        :param v0:          Velocities of shape (N,2,S)
+        :param beta:        Common bias term
+        :param max_time:    End of the last step
+        :param device:      Device for torch i.e. cpu or cuda
+        '''
+        self.device = device
+        self.num_of_nodes, _, self.num_of_steps = v0.shape
+        self.max_time = float(max_time)
+        self.beta = torch.as_tensor(beta).detach().flatten()[0].to(device, dtype=torch.float64)
+        self.v0 = v0.detach().to(device, dtype=torch.float64)
+
+        time_intervals = torch.linspace(0, self.max_time, self.num_of_steps+1, dtype=torch.float64, device=device)
+        self.start_times = time_intervals[:-1]
+        self.end_times = time_intervals[1:]
+        step_size = self.max_time / self.num_of_steps
+        steps_z0 = z0.detach().to(device, dtype=torch.float64).unsqueeze(2) + torch.cumsum(self.v0*step_size, dim=2)
+        self.steps_z0 = torch.cat((z0.detach().to(device, dtype=torch.float64).unsqueeze(2), steps_z0), dim=2)[:,:,:-1]
+        self.spatial_index = None
+
+    @classmethod
+    def from_params_dir(cls, params_dir:str, max_time:float=None, device='cpu'):
+        '''
+        Loads final_z0.pt, final_v0.pt and final_beta.pt of a run, and final_max_time.pt unless max_time is given
+        '''
+        load = lambda name: torch.load(os.path.join(params_dir, name), map_location=device)
+        if max_time is None:
+            max_time_path = os.path.join(params_dir, 'final_max_time.pt')
+            if not os.path.exists(max_time_path):
+                raise Exception(f'No final_max_time.pt in {params_dir}, the max time of the model has to be given')
+            max_time = load('final_max_time.pt').item()
+        return cls(z0=load('final_z0.pt'), v0=load('final_v0.pt'), beta=load('final_beta.pt'), max_time=max_time, device=device)
+
+    def __as_index(self, values) -> torch.Tensor:
+        return torch.as_tensor(values, device=self.device).long().view(-1)
+
+    def __as_time(self, values) -> torch.Tensor:
+        return torch.as_tensor(values, device=self.device, dtype=torch.float64).view(-1)
+
+    def __step_of(self, t:torch.Tensor):
+        return find_steps_and_offsets(t, self.start_times, self.end_times)
+
+    @torch.no_grad()
+    def positions(self, t) -> torch.Tensor:
+        '''
+        :param t:   Times of shape (T,)
+
+        :returns:   Positions of all nodes at the times of shape (T,N,2)
+        '''
+        step_index, step_offset = self.__step_of(self.__as_time(t))
+        positions = self.steps_z0[:,:,step_index] + self.v0[:,:,step_index]*step_offset
+        return positions.permute(2,0,1)
+
+    @torch.no_grad()
+    def log_intensity(self, i, j, t) -> torch.Tensor:
+        '''
+        :param i:   Indices of node i of shape (Q,)
+        :param j:   Indices of node j of shape (Q,)
+        :param t:   Times of shape (Q,)
+
+        :returns:   log lambda_ij(t) = beta - |z_i(t) - z_j(t)|^2 of every query
+        '''
+        i, j = self.__as_index(i), self.__as_index(j)
+        step_index, step_offset = self.__step_of(self.__as_time(t))
+        offset = step_offset.unsqueeze(1)
+        z_i = self.steps_z0[i,:,step_index] + self.v0[i,:,step_index]*offset
+        z_j = self.steps_z0[j,:,step_index] + self.v0[j,:,step_index]*offset
+        return self.beta - torch.sum(torch.square(z_i - z_j), dim=1)
+
+    @torch.no_grad()
+    def expected_count(self, i, j, t0, tn) -> torch.Tensor:
+        '''
+        Expected number of events of every queried pair in its interval, the integral of the intensity.
+        The interval is split at the step boundaries and every part is integrated in closed form.
+
+        :param i:   Indices of node i of shape (Q,)
+        :param j:   Indices of node j of shape (Q,)
+        :param t0:  Starts of the intervals of shape (Q,)
+        :param tn:  Ends of the intervals of shape (Q,)
+
+        :returns:   The expected counts of shape (Q,)
+        '''
+        i, j = self.__as_index(i), self.__as_index(j)
+        t0, tn = self.__as_time(t0).unsqueeze(1), self.__as_time(tn).unsqueeze(1)
+        ## Part of every interval inside every step relative to the step start, shape (Q,S)
+        start = torch.min(torch.max(t0, self.start_times), self.end_times) - self.start_times
+        end = torch.min(torch.max(tn, self.start_times), self.end_times) - self.start_times
+
+        dz = self.steps_z0[i] - self.steps_z0[j]
+        dv = self.v0[i] - self.v0[j]
+        integrals = pairwise_integral(start, end, dz[:,0], dz[:,1], dv[:,0], dv[:,1], self.beta)
+        expected_counts = torch.sum(integrals*(end > start), dim=1)
+
+        ## The positions stay at their final values after the last step, as in the models
+        sq_dist_end = torch.sum(torch.square(dz[:,:,-1] + dv[:,:,-1]*(self.end_times[-1] - self.start_times[-1])), dim=1)
+        time_after_end = torch.clamp(tn.squeeze(1) - torch.clamp(t0.squeeze(1), min=self.max_time), min=0.)
+        return expected_counts + torch.exp(self.beta - sq_dist_end)*time_after_end
+
+    def build_spatial_index(self, nodes_per_cell:float=2.) -> StepwiseSpatialIndex:
+        '''
+        Builds a grid index of every step, after which partner queries search
+        the neighbourhood of the node instead of computing the distances to all nodes
+        '''
+        self.spatial_index = StepwiseSpatialIndex(self.steps_z0.cpu().numpy(), self.v0.cpu().numpy(),
+                                                    self.start_times.cpu().numpy(), self.end_times.cpu().numpy(),
+                                                    nodes_per_cell=nodes_per_cell)
+        return self.spatial_index
+
+    @torch.no_grad()
+    def partners_within(self, i:int, t:float, min_log_intensity:float):
+        '''
+        All partners of node i at time t with a log intensity of at least min_log_intensity.
+        Uses the spatial index, which is built on first use.
+
+        :returns:   Indices of the partners and their log intensities
+        '''
+        if self.spatial_index is None:
+            self.build_spatial_index()
+        radius_sq = self.beta.item() - min_log_intensity
+        if radius_sq < 0:
+            return torch.empty(0, dtype=torch.long), torch.empty(0, dtype=torch.float64)
+        partners, sq_dists = self.spatial_index.radius(int(i), float(t), radius_sq**0.5)
+        return torch.from_numpy(partners), self.beta.cpu() - torch.from_numpy(sq_dists)
+
+    @torch.no_grad()
+    def top_k_partners(self, i, t, k:int):
+        '''
+        Most likely interaction partners of every queried node at its time.
+        With a spatial index only the neighbourhood of every node is searched.
+
+        :param i:   Indices of the nodes of shape (Q,)
+        :param t:   Times of shape (Q,)
+        :param k:   Number of partners
+
+        :returns:   Indices of the partners of shape (Q,k) and their log intensities
+        '''
+        i = self.__as_index(i)
+        if self.spatial_index is not None:
+            k = min(k, self.num_of_nodes-1)
+            neighbours = [self.spatial_index.knn(node, time, k) for node, time in zip(i.tolist(), self.__as_time(t).tolist())]
+            partners = torch.as_tensor(np.stack([partners for partners, _ in neighbours]), device=self.device)
+            sq_dists = torch.as_tensor(np.stack([sq_dists for _, sq_dists in neighbours]), device=self.device)
+            return partners, self.beta - sq_dists
+        positions = self.positions(t)
+        sq_dists = torch.sum(torch.square(positions - positions[torch.arange(len(i)),i].unsqueeze(1)), dim=2)
+        ## A node is not its own partner
+        sq_dists[torch.arange(len(i)),i] = float('inf')
+        sq_dists, partners = torch.topk(sq_dists, k=min(k, self.num_of_nodes-1), dim=1, largest=False)
+        return partners, self.beta - sq_dists
@@ -0,0 +1,192 @@
+### Packages
+import os
+import sys
+import json
+import queue
+import select
+import threading
+import torch
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+
+### Code imports
+from models.scoring import StepwiseScorer
+from utils.compute.threads import configure_threads, print_thread_configuration
+
+
+## Query types and the fields they concatenate when requests are batched
+QUERY_FIELDS = {'log_intensity': ['i', 'j', 't'],
+                'expected_count': ['i', 'j', 't0', 'tn'],
+                'top_k_partners': ['i', 't']}
+
+
+def score_requests(scorer:StepwiseScorer, requests:list) -> list:
+    '''
+    Answers a batch of requests with one scorer call per query type.
+    A request is a dict with a 'type', the arrays of its query type and an optional 'id',
+    top_k_partners requests also give 'k'. Requests of the same type are concatenated,
+    so many small requests cost about as much as one large request.
+
+    :param scorer:      The scorer of the served model
+    :param requests:    The requests
+
+    :returns:   A response for every request in the same order
+    '''
+    responses = [None]*len(requests)
+    groups = {}
+    for idx, request in enumerate(requests):
+        query_type = request.get('type')
+        if query_type not in QUERY_FIELDS:
+            responses[idx] = {'id': request.get('id'), 'error': request.get('error', f'Unknown query type: {query_type}')}
+            continue
+        key = (query_type, int(request.get('k', 10))) if query_type == 'top_k_partners' else (query_type,)
+        groups.setdefault(key, []).append(idx)
+
+    for key, idxs in groups.items():
+        query_type = key[0]
+        try:
+            columns = [torch.cat([torch.as_tensor(requests[idx][field], dtype=torch.float64).view(-1) for idx in idxs])
+                        for field in QUERY_FIELDS[query_type]]
+            if query_type == 'log_intensity':
+                results = [scorer.log_intensity(*columns)]
+            elif query_type == 'expected_count':
+                results = [scorer.expected_count(*columns)]
+            else:
+                partners, log_intensities = scorer.top_k_partners(*columns, k=key[1])
+                results = [partners, log_intensities]
+        except Exception as e:
+            for idx in idxs:
+                responses[idx] = {'id': requests[idx].get('id'), 'error': repr(e)}
+            continue
+
+        ## Split the concatenated results back into the requests
+        sizes = [torch.as_tensor(requests[idx][QUERY_FIELDS[query_type][0]]).numel() for idx in idxs]
+        for idx, *parts in zip(idxs, *[result.split(sizes) for result in results]):
+            if query_type == 'top_k_partners':
+                responses[idx] = {'id': requests[idx].get('id'), 'partners': parts[0].tolist(), 'log_intensity': parts[1].tolist()}
+            else:
+                responses[idx] = {'id': requests[idx].get('id'), query_type: parts[0].tolist()}
+    return responses
+
+
+class RequestBatcher:
+    '''
+    Collects requests of concurrent clients and answers them in batches on one thread.
+    A batch is closed when it holds max_batch requests or max_wait seconds after its first request.
+    '''
+    def __init__(self, scorer:StepwiseScorer, max_batch:int=256, max_wait:float=0.002) -> None:
+        self.scorer = scorer
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending = queue.Queue()
+        self.worker = threading.Thread(target=self.__run, daemon=True)
+        self.worker.start()
+
+    def submit(self, request:dict) -> dict:
+        done = threading.Event()
+        slot = {'request': request, 'done': done}
+        self.pending.put(slot)
+        done.wait()
+        return slot['response']
+
+    def __run(self):
+        while True:
+            batch = [self.pending.get()]
+            try:
+                while len(batch) < self.max_batch:
+                    batch.append(self.pending.get(timeout=self.max_wait))
+            except queue.Empty:
+                pass
+            responses = score_requests(self.scorer, [slot['request'] for slot in batch])
+            for slot, response in zip(batch, responses):
+                slot['response'] = response
+                slot['done'].set()
+
+
+def serve_stdin(scorer:StepwiseScorer, max_batch:int):
+    '''
+    Reads one JSON request per line from stdin and writes one JSON response per line to stdout.
+    All lines that are already waiting on stdin are answered as one batch.
+    '''
+    while True:
+        lines = [sys.stdin.readline()]
+        while len(lines) < max_batch and select.select([sys.stdin], [], [], 0)[0]:
+            lines.append(sys.stdin.readline())
+        end_of_input = lines[-1] == ''
+        requests = []
+        for line in lines:
+            if line.strip():
+                try:
+                    requests.append(json.loads(line))
+                except ValueError as e:
+                    requests.append({'type': None, 'error': f'Invalid JSON: {e}'})
+        for response in score_requests(scorer, requests):
+            sys.stdout.write(json.dumps(response) + '\n')
+        sys.stdout.flush()
+        if end_of_input:
+            return
+
+
+def serve_http(scorer:StepwiseScorer, host:str, port:int, max_batch:int, max_wait:float):
+    '''
+    Answers POST requests with a JSON request, or a list of them, in the body
+    '''
+    batcher = RequestBatcher(scorer, max_batch=max_batch, max_wait=max_wait)
+
+    class ScoringHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            except ValueError as e:
+                self.send_error(400, f'Invalid JSON: {e}')
+                return
+            if isinstance(body, list):
+                ## A list is already a batch
+                response = score_requests(scorer, body)
+            else:
+                response = batcher.submit(body)
+            payload = json.dumps(response).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), ScoringHandler)
+    print(f'Serving {scorer.num_of_nodes} nodes and {scorer.num_of_steps} steps on http://{host}:{port}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+
+    ### Parse Arguments for running in terminal
+    arg_parser = ArgumentParser()
+    arg_parser.add_argument('--params_dir', '-PD', required=True, type=str)
+    arg_parser.add_argument('--max_time', '-MT', default=None, type=float)
+    arg_parser.add_argument('--device', '-device', default='cpu', type=str)
+    arg_parser.add_argument('--http', '-http', action='store_true')
+    arg_parser.add_argument('--host', '-host', default='127.0.0.1', type=str)
+    arg_parser.add_argument('--port', '-port', default=8080, type=int)
+    arg_parser.add_argument('--max_batch', '-MB', default=256, type=int)
+    arg_parser.add_argument('--max_wait', '-MW', default=0.002, type=float)
+    arg_parser.add_argument('--num_threads', '-NT', default=None, type=int)
+    arg_parser.add_argument('--spatial_index', '-SI', action='store_true')
+    args = arg_parser.parse_args()
+
+    thread_config = configure_threads(num_threads=args.num_threads)
+    scorer = StepwiseScorer.from_params_dir(args.params_dir, max_time=args.max_time, device=args.device)
+    if args.spatial_index:
+        scorer.build_spatial_index()
+
+    if args.http:
+        print_thread_configuration(thread_config)
+        serve_http(scorer, args.host, args.port, args.max_batch, args.max_wait)
+    else:
+        ## stdout carries the responses, so nothing else is printed
+        serve_stdin(scorer, args.max_batch)
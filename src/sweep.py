@@ -0,0 +1,204 @@
+### Packages
+import os
+import sys
+import csv
+import time
+import itertools
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from argparse import ArgumentParser
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+
+### Code imports
+from data.dataset import load_or_generate_dataset
+from data.events import EventSet, EventBatches
+from models.build import build_model
+from traintestgyms.ignitegym import TrainTestGym
+from traintestgyms.locallogger import LocalRunLogger
+from utils.compute.threads import configure_threads, print_thread_configuration
+
+
+## Columns of the results table
+RESULT_COLUMNS = ['seed', 'steps', 'learning_rate', 'velocity_gamma_regularization',
+                    'final_avg_train_loss', 'beta', 'train_seconds', 'stopping_epoch', 'best_epoch', 'best_loss', 'status']
+
+## Read-only state shared with every worker of the pool
+_shared = {}
+
+
+def _init_worker(batches, dataset_info, threads_per_worker):
+    '''
+    Initializes a pool worker. The prepared batches of every step count arrive as shared memory tensors,
+    so no worker copies the events or their statistics, or regenerates them.
+    '''
+    _shared['batches'] = batches
+    _shared['info'] = dataset_info
+    configure_threads(num_threads=threads_per_worker)
+
+
+def _train_config(config:dict) -> dict:
+    '''
+    Trains one configuration of the sweep on the shared dataset
+
+    :param config:  Sweep configuration with seed, steps, learning_rate and velocity_gamma_regularization
+
+    :returns:       Row of the results table
+    '''
+    info = _shared['info']
+    row = {key: config[key] for key in ['seed', 'steps', 'learning_rate', 'velocity_gamma_regularization']}
+
+    try:
+        np.random.seed(config['seed'])
+        torch.manual_seed(config['seed'])
+
+        model = sweep_model(info, config['steps'], velocity_gamma_regularization=config['velocity_gamma_regularization'])
+        model.z0.requires_grad, model.v0.requires_grad, model.beta.requires_grad = True, True, True
+        optimizer = torch.optim.Adam(model.parameters(), lr=config['learning_rate'])
+
+        run_name = '_'.join(f'{key}{value}' for key, value in row.items())
+        logger = LocalRunLogger(os.path.join(info['output_dir'], run_name))
+        metrics = {'avg_train_loss': [], 'beta_est': []}
+        gym = TrainTestGym(dataset=_shared['batches'][config['steps']],
+                            model=model,
+                            device=info['device'],
+                            batch_size=info['batch_size'],
+                            optimizer=optimizer,
+                            metrics=metrics,
+                            time_column_idx=2,
+                            wandb_handler=logger,
+                            num_dyads=info['num_dyads'],
+                            keep_rotation=info['keep_rotation'],
+                            tolerance=info['tolerance'],
+                            patience=info['patience'],
+                            min_delta=info['min_delta'])
+
+        start_time = time.perf_counter()
+        gym.train_test_model(epochs=info['num_epochs'])
+        row['train_seconds'] = time.perf_counter() - start_time
+
+        torch.save(model.z0.detach().clone(), os.path.join(logger.run.dir, 'final_z0.pt'))
+        torch.save(model.v0.detach().clone(), os.path.join(logger.run.dir, 'final_v0.pt'))
+        ## With early stopping the saved parameters are the restored best state, otherwise those of the last epoch
+        row['final_avg_train_loss'] = gym.best['loss'] if gym.best['loss'] is not None else metrics['avg_train_loss'][-1]
+        row['stopping_epoch'] = gym.stopping_epoch
+        row['best_epoch'] = gym.best['epoch']
+        row['best_loss'] = gym.best['loss']
+        row['beta'] = model.beta.detach().flatten().tolist()
+        row['status'] = 'ok'
+    except Exception as e:
+        ## A failing configuration should not take the rest of the sweep down
+        row['status'] = f'failed: {e!r}'
+
+    return row
+
+
+def sweep_model(info:dict, num_steps:int, velocity_gamma_regularization=None):
+    return build_model(vectorized=info['vectorized'], num_nodes=info['num_nodes'], model_beta=info['model_beta'],
+                        device=info['device'], max_time=info['max_time'], num_steps=num_steps,
+                        z0=info['z0'], v0=info['v0'], velocity_gamma_regularization=velocity_gamma_regularization)
+
+
+def prepare_shared_batches(dataset:torch.Tensor, info:dict, step_counts:list) -> dict:
+    '''
+    Splits the dataset into batches and prepares them once for every step count of the sweep,
+    in shared memory. Stepwise models train on sufficient statistics which depend on the steps,
+    the other models on the same batches for all step counts.
+
+    :returns:   The prepared batches of every step count
+    '''
+    events = EventSet.from_tensor(dataset, num_nodes=info['num_nodes'])
+    prepared = {}
+    for num_steps in step_counts:
+        model = sweep_model(info, num_steps)
+        start_times = getattr(model, 'start_times', None)
+        key = num_steps if start_times is not None else None
+        if key not in prepared:
+            batches = EventBatches(events, batch_size=info['batch_size'])
+            batches.prepare(info['device'], dtype=model.z0.dtype, start_times=start_times, end_times=getattr(model, 'end_times', None))
+            prepared[key] = batches.share_memory_()
+        prepared[num_steps] = prepared[key]
+    return prepared
+
+
+def make_grid(seeds:list, steps:list, learning_rates:list, gammas:list) -> list:
+    return [{'seed': seed, 'steps': num_steps, 'learning_rate': lr, 'velocity_gamma_regularization': gamma}
+                for seed, num_steps, lr, gamma in itertools.product(seeds, steps, learning_rates, gammas)]
+
+
+if __name__ == '__main__':
+
+    ### Parse Arguments for running in terminal
+    arg_parser = ArgumentParser()
+    arg_parser.add_argument('--seeds', '-seeds', default=[1], type=int, nargs='+')
+    arg_parser.add_argument('--steps', '-steps', default=[10], type=int, nargs='+')
+    arg_parser.add_argument('--learning_rates', '-LR', default=[0.025], type=float, nargs='+')
+    arg_parser.add_argument('--velocity_gamma_regularizations', '-VGR', default=[None], type=float, nargs='+')
+    arg_parser.add_argument('--data_seed', '-DSEED', default=1, type=int)
+    arg_parser.add_argument('--device', '-device', default='cpu', type=str)
+    arg_parser.add_argument('--num_epochs', '-NE', default=5000, type=int)
+    arg_parser.add_argument('--train_batch_size', '-TBS', default=-1, type=int)
+    arg_parser.add_argument('--real_data', '-RD', default=0, type=int)
+    arg_parser.add_argument('--dataset_number', '-DS', default=2, type=int)
+    arg_parser.add_argument('--vectorized', '-VEC', default=2, type=int)
+    arg_parser.add_argument('--keep_rotation', '-KR', action='store_true')
+    arg_parser.add_argument('--tolerance', '-TOL', default=None, type=float)
+    arg_parser.add_argument('--patience', '-PAT', default=None, type=int)
+    arg_parser.add_argument('--min_delta', '-MD', default=0., type=float)
+    arg_parser.add_argument('--max_workers', '-MW', default=os.cpu_count(), type=int)
+    arg_parser.add_argument('--threads_per_worker', '-TPW', default=1, type=int)
+    arg_parser.add_argument('--output_dir', '-OUT', default='sweep_results', type=str)
+    args = arg_parser.parse_args()
+
+    ## Seeding of the data generation, the model seeds are part of the grid
+    np.random.seed(args.data_seed)
+    torch.manual_seed(args.data_seed)
+    print_thread_configuration(configure_threads(num_threads=args.threads_per_worker))
+
+    ### Data: Generated or loaded once, prepared for every step count and shared read-only with all workers
+    dataset, num_nodes, z0, v0, true_beta, model_beta, max_time = load_or_generate_dataset(real_data=args.real_data,
+                                                                    dataset_number=args.dataset_number, vectorized=args.vectorized,
+                                                                    seed=args.data_seed, device=args.device)
+    dataset_info = {'num_nodes': num_nodes,
+                    'num_dyads': (num_nodes * (num_nodes - 1)) / 2,
+                    'model_beta': model_beta,
+                    'z0': z0,
+                    'v0': v0,
+                    'vectorized': args.vectorized,
+                    'device': args.device,
+                    'max_time': dataset[-1,2].item(),
+                    'num_epochs': args.num_epochs,
+                    'batch_size': args.train_batch_size if args.train_batch_size > 0 else len(dataset),
+                    'keep_rotation': args.keep_rotation,
+                    'tolerance': args.tolerance,
+                    'patience': args.patience,
+                    'min_delta': args.min_delta,
+                    'output_dir': args.output_dir}
+
+    grid = make_grid(args.seeds, args.steps, args.learning_rates, args.velocity_gamma_regularizations)
+    ## The batches of all step counts are views of the same event storages. The file descriptor strategy passes a
+    ## storage once per view to a spawned worker, which fails, the file system strategy passes it by name
+    mp.set_sharing_strategy('file_system')
+    batches = prepare_shared_batches(dataset, dataset_info, args.steps)
+    del dataset
+    num_workers = max(1, min(args.max_workers, len(grid)))
+    print(f'Running {len(grid)} configurations on {num_workers} workers with {args.threads_per_worker} threads each')
+
+    ### Sweep: Bounded pool of workers, results are written as the configurations finish
+    os.makedirs(args.output_dir, exist_ok=True)
+    results_path = os.path.join(args.output_dir, 'results.csv')
+    sweep_start = time.perf_counter()
+    context = mp.get_context('spawn')
+    with context.Pool(processes=num_workers, initializer=_init_worker,
+                        initargs=(batches, dataset_info, args.threads_per_worker)) as pool, \
+            open(results_path, 'w', newline='') as results_file:
+        writer = csv.DictWriter(results_file, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
+        for row in pool.imap_unordered(_train_config, grid):
+            writer.writerow(row)
+            results_file.flush()
+            print(f"Finished {row}")
+
+    print(f'Sweep completed in {time.perf_counter() - sweep_start:.1f} seconds, results saved to {results_path}')
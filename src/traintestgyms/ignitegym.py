@@ -1,25 +1,85 @@
 import os
+import time
 import torch
 import numpy as np
 from utils.nodes.remove_drift import remove_v_drift, center_z0, remove_rotation
+from data.eventsource import EventSource, EventChunk, PrefetchLoader
+from data.events import EventSet, EventBatches
+from utils.compute.threads import configure_threads, print_thread_configuration
+from utils.compute.profiling import phase, timed, enable_profiling, EpochProfiler
+from models.betaprofile import supports_beta_profile, profile_beta, thinned_nll, unregularized_nll
+from utils.compute.distributed import all_reduce_sum, all_reduce_gradients, broadcast_parameters, global_time_window
+from utils.compute.memory import estimate_forward_bytes, max_batch_size_within, max_block_size_within, format_bytes, PeakMemoryTracker
 from ignite.engine import Engine
 from ignite.engine import Events
-from torch.utils.data import DataLoader
 from ignite.contrib.handlers.tqdm_logger import ProgressBar
 
 class TrainTestGym:
     def __init__(self, dataset, model, device, batch_size,
                     optimizer, metrics,
-                    time_column_idx, wandb_handler, num_dyads, keep_rotation) -> None:
+                    time_column_idx, wandb_handler, num_dyads, keep_rotation,
+                    num_threads=None, num_interop_threads=None, cores=None, prefetch_chunks=2, normalize_params=True,
+                    profile_dir=None, profile_trace_epochs=1, memory_budget=None, auto_batch_size=False, beta_update=None,
+                    tolerance=None, grad_tolerance=None, target_nll=None,
+                    patience=None, min_delta=0., param_tolerance=None, validation_data=None, validation_fraction=None,
+                    distributed=False) -> None:
 
-        ## Split dataset and intiate dataloder
-        len_training_set = int(len(dataset))
-        train_data = dataset[:len_training_set]
+        if isinstance(dataset, EventSource):
+            ## Streamed datasets are read chunk by chunk on a background thread, the chunk size replaces the batch size
+            self.train_loader = PrefetchLoader(dataset, prefetch=prefetch_chunks)
+        elif isinstance(dataset, EventBatches):
+            ## Batches prepared for the model beforehand, e.g. once for several processes, are used as they are
+            num_steps = getattr(model, 'num_of_steps', None) if getattr(model, 'start_times', None) is not None else None
+            if any(batch.num_steps != num_steps for batch in dataset):
+                raise Exception(f'The batches are prepared for {dataset.batches[0].num_steps} steps, the model has {num_steps}')
+            self.train_loader = dataset
+        else:
+            ## The event indices do not depend on the parameters, so every batch is prepared once and reused in all epochs
+            if not isinstance(dataset, EventSet):
+                dataset = EventSet.from_tensor(dataset, num_nodes=getattr(model, 'num_of_nodes', None), time_column_idx=time_column_idx)
+            self.train_loader = self.__prepare_batches(dataset, model, device, batch_size)
 
-        self.train_loader = DataLoader(train_data, batch_size=batch_size, shuffle= False)
+        ## Pre-flight memory check, before any epoch allocates the dense tensors
+        self.memory_estimate = self.__estimate_memory(model)
+        print(f'Estimated peak memory of a training step: {format_bytes(self.memory_estimate)}')
+        prepared = isinstance(self.train_loader, EventBatches)
+        if memory_budget is not None and self.memory_estimate > memory_budget and auto_batch_size and self.__can_tile(model) \
+                and (max_batch_size_within(model, memory_budget, prepared=prepared) or 0) < 1:
+            ## Smaller batches do not help when the integral over all N x N pairs alone outgrows the budget,
+            ## the tiled integral bounds its memory by the block size
+            block_size = max_block_size_within(model, memory_budget)
+            if block_size > 0:
+                model.block_size = block_size
+                self.memory_estimate = self.__estimate_memory(model)
+                print(f'Estimated memory exceeds the budget of {format_bytes(memory_budget)}, using the tiled integral with blocks of {block_size} nodes, '
+                        f'estimated peak memory {format_bytes(self.memory_estimate)}')
+        if memory_budget is not None and self.memory_estimate > memory_budget:
+            max_batch_size = max_batch_size_within(model, memory_budget, prepared=prepared)
+            if auto_batch_size and isinstance(dataset, EventSet) and max_batch_size:
+                if max_batch_size < 0:
+                    raise Exception(f'The model alone needs more than the memory budget of {format_bytes(memory_budget)}')
+                print(f'Estimated memory exceeds the budget of {format_bytes(memory_budget)}, using batches of {max_batch_size} events')
+                self.train_loader = self.__prepare_batches(dataset, model, device, max_batch_size)
+                self.memory_estimate = self.__estimate_memory(model)
+            else:
+                raise Exception(f'Estimated memory {format_bytes(self.memory_estimate)} exceeds the budget of {format_bytes(memory_budget)}. '
+                                f'Use a smaller batch size, the tiled integral (--block_size) or enable the automatic batch size, '
+                                f'which also switches to the tiled integral')
 
 
         self.model = model
+        ## Distributed ranks train on the events of the node pairs whose integral their model owns, the losses and
+        ## gradients are summed over the ranks, so every rank takes the same step from the same parameters
+        self.distributed = distributed
+        self.time_window = None
+        if distributed:
+            if not isinstance(self.train_loader, EventBatches) or len(self.train_loader) != 1:
+                raise Exception('Distributed training needs the full batch of events of every rank in memory')
+            if len(self.train_loader.batches[0]) == 0:
+                raise Exception('A rank owns no events, train with fewer processes')
+            ## All ranks integrate over the time window of all events, as a single process does
+            self.time_window = global_time_window(self.train_loader.batches[0].t)
+            broadcast_parameters(model)
         self.model_state = self.model.state_dict()
         self.device = device
         self.optimizer = optimizer
@@ -28,16 +88,80 @@ class TrainTestGym:
 
         self.time_column_idx = time_column_idx
 
+        ## Optional closed form update of beta after every training step or every epoch, instead of learning it
+        if beta_update not in [None, 'step', 'epoch']:
+            raise Exception(f'Unknown beta update: {beta_update}')
+        if beta_update is not None and not supports_beta_profile(model):
+            raise Exception(f'{type(model).__name__} has no common beta which can be profiled')
+        self.beta_update = beta_update
+        ## Time window and number of events of the current epoch, from the start of its first batch to the end of its last batch
+        self.epoch_window = {'t0': None, 'tn': None, 'num_events': 0}
+        self.trainer.add_event_handler(Events.EPOCH_STARTED, lambda: self.epoch_window.update({'t0': None, 'tn': None, 'num_events': 0}))
+
+        ## Training stops once the relative change of the loss, the gradient norm and the relative change of the
+        ## parameters are below their tolerances, or once the monitored loss has not improved by min_delta for patience epochs
+        self.tolerance = tolerance
+        self.grad_tolerance = grad_tolerance
+        self.param_tolerance = param_tolerance
+        self.patience = patience
+        self.min_delta = min_delta
+        self.target_nll = target_nll
+        self.grad_norm = None
+        self.num_dyads = num_dyads
+        ## The monitored loss is the NLL of the held-out events if given, otherwise the average train loss.
+        ## Events held out with probability validation_fraction are scored with the intensity thinned accordingly
+        if validation_fraction is not None and not 0 < validation_fraction < 1:
+            raise Exception(f'The validation fraction has to be in (0, 1), got {validation_fraction}')
+        if validation_data is not None and validation_fraction is not None and not hasattr(model, 'integral'):
+            raise Exception(f'{type(model).__name__} has no integral method to score the held-out events with')
+        self.validation_fraction = validation_fraction
+        self.validation_set = None
+        if validation_data is not None:
+            if not isinstance(validation_data, EventSet):
+                validation_data = EventSet.from_tensor(validation_data, num_nodes=getattr(model, 'num_of_nodes', None), time_column_idx=time_column_idx)
+            self.validation_set = validation_data.prepare(device, dtype=model.z0.dtype, start_times=getattr(model, 'start_times', None),
+                                                            end_times=getattr(model, 'end_times', None))
+        self.early_stopping = any(criterion is not None for criterion in [tolerance, grad_tolerance, param_tolerance, patience])
+        self.best = {'loss': None, 'epoch': None, 'state': None}
+        self.previous_params = None
+        self.stopping_epoch = None
+        self.start_time = None
+        self.time_to_target = None
+        ## L-BFGS keeps curvature pairs of the parameters, which the normalization of every epoch would invalidate
+        self.closure_step = isinstance(optimizer, torch.optim.LBFGS)
+        self.normalize_params = normalize_params
+        self.keep_rotation = keep_rotation
+
+        ## Thread budget for training, None keeps the configuration of the process
+        self.num_threads = num_threads
+        self.num_interop_threads = num_interop_threads
+        self.cores = cores
+
+        ## Opt-in profiling, the phase timings and traces are written to profile_dir
+        self.profiler = EpochProfiler(profile_dir, trace_epochs=profile_trace_epochs) if profile_dir else None
+        if self.profiler:
+            self.trainer.add_event_handler(Events.EPOCH_STARTED, self.profiler.epoch_started)
+
+        ## Profile beta on all events of the epoch, before it is printed and logged
+        if beta_update == 'epoch':
+            self.trainer.add_event_handler(Events.EPOCH_COMPLETED(every=1), timed('profile_beta', lambda: profile_beta(self.model,
+                                            self.epoch_window['num_events'], self.epoch_window['t0'], self.epoch_window['tn'],
+                                            reduce=all_reduce_sum if self.distributed else None)))
+
         ## Every Epoch print z, v and beta value to terminal for inspection
-        self.trainer.add_event_handler(Events.EPOCH_COMPLETED(every=1), lambda: print(f'z0: {model.z0}  \
+        self.trainer.add_event_handler(Events.EPOCH_COMPLETED(every=1), timed('print_params', lambda: print(f'z0: {model.z0}  \
                                                                                         \n v0: {model.v0} \
-                                                                                       \n beta: {model.beta}'))
+                                                                                       \n beta: {model.beta}')))
 
         ### Metrics of training
         self.wandb_handler = wandb_handler
         self.metrics = metrics
         self.temp_metrics = {'train_loss': [], 'beta_est': []}  # Used for computing average of losses
 
+        ## Track the peak memory of every epoch
+        self.memory_tracker = PeakMemoryTracker(device)
+        self.trainer.add_event_handler(Events.EPOCH_STARTED, lambda: self.memory_tracker.reset())
+
         ## Keep count of epoch
         self.epoch_count = []
         self.trainer.add_event_handler(Events.EPOCH_COMPLETED(every=1), lambda: self.epoch_count.append(0))
@@ -51,45 +175,198 @@ class TrainTestGym:
         self.trainer.add_event_handler(Events.EPOCH_COMPLETED(every=1), lambda: self.temp_metrics['beta_est'].clear())
 
         ## Log metrics using WandB
-        self.trainer.add_event_handler(Events.EPOCH_COMPLETED(every=1), lambda: wandb_handler.log({'Epoch': len(self.epoch_count),
+        self.trainer.add_event_handler(Events.EPOCH_COMPLETED(every=1), timed('log_metrics', lambda: wandb_handler.log({'Epoch': len(self.epoch_count),
                                                                                                     'beta': model.beta.detach().clone(),
-                                                                                                    'avg_train_loss': self.metrics['avg_train_loss'][len(self.epoch_count)-1]}))
+                                                                                                    'avg_train_loss': self.metrics['avg_train_loss'][len(self.epoch_count)-1],
+                                                                                                    'peak_memory_mb': self.__peak_memory_mb(),
+                                                                                                    'train_seconds': time.perf_counter() - self.start_time,
+                                                                                                    **self.__model_metrics()})))
+        self.trainer.add_event_handler(Events.EPOCH_COMPLETED(every=1), self.__check_convergence)
 
-        ## Reset z0 and v0
-        self.trainer.add_event_handler(Events.EPOCH_COMPLETED(every=1), lambda: self.__reset_model(keep_rotation))
+        ## Reset z0 and v0, skipped when parts of the parameters are frozen, since the reset moves all of them.
+        ## L-BFGS runs are normalized once after training instead.
+        if normalize_params:
+            self.trainer.add_event_handler(Events.EPOCH_COMPLETED(every=1), timed('reset_model',
+                                            lambda: None if self.closure_step else self.__reset_model(keep_rotation)))
         ## Save z0 and v0
-        self.trainer.add_event_handler(Events.EPOCH_COMPLETED(every=500), self.__log_params)
+        self.trainer.add_event_handler(Events.EPOCH_COMPLETED(every=500), timed('save_params', self.__log_params))
+
+        ## Registered last, so the epoch summary includes all other handlers
+        if self.profiler:
+            self.trainer.add_event_handler(Events.EPOCH_COMPLETED(every=1), self.profiler.epoch_completed)
                                                                                                 
 
         pbar = ProgressBar()
         pbar.attach(self.trainer)
 
+    def __peak_memory_mb(self):
+        peak = self.memory_tracker.peak_bytes()
+        return peak / 2**20 if peak is not None else None
+
+    @staticmethod
+    def __can_tile(model) -> bool:
+        ## Models with a tiled integral which is not already used, or replaced by pruning or a shard of the pairs
+        return hasattr(model, 'block_size') and not model.block_size and not getattr(model, 'prune_threshold', None) \
+                and getattr(model, 'shard', None) is None
+
+    def __model_metrics(self) -> dict:
+        ## Diagnostics some models keep of their last forward pass
+        metrics = {}
+        if getattr(self.model, 'neglected_mass', None) is not None:
+            metrics['neglected_integral_mass'] = float(self.model.neglected_mass)
+        return metrics
+
+    def __validation_nll(self) -> float:
+        self.model.eval()
+        with torch.no_grad():
+            ## The held-out events are scored over the time window of the training epoch, without the regularization
+            t0, tn = self.epoch_window['t0'], self.epoch_window['tn']
+            if self.validation_fraction is not None:
+                nll = thinned_nll(self.model, self.validation_set, t0, tn, self.validation_fraction)
+            else:
+                nll = unregularized_nll(self.model, self.validation_set, t0, tn)
+        if self.distributed:
+            nll = all_reduce_sum(nll)
+        return nll.item() / self.num_dyads
+
+    def __check_convergence(self, engine):
+        losses = self.metrics['avg_train_loss']
+        epoch = len(losses)
+        if self.target_nll is not None and self.time_to_target is None and losses[-1] <= self.target_nll:
+            self.time_to_target = time.perf_counter() - self.start_time
+            print(f'Reached the target NLL {self.target_nll} after {self.time_to_target:.2f} seconds and {epoch} epochs')
+            self.wandb_handler.log({'time_to_target_nll': self.time_to_target, 'epochs_to_target_nll': epoch})
+        if not self.early_stopping:
+            return
+
+        monitored = losses[-1]
+        if self.validation_set is not None:
+            monitored = self.__validation_nll()
+            self.wandb_handler.log({'Epoch': epoch, 'validation_nll': monitored})
+        params = torch.cat([parameter.detach().flatten() for parameter in self.model.parameters()])
+        param_change = None
+        if self.previous_params is not None:
+            param_change = torch.norm(params - self.previous_params).item() / max(torch.norm(self.previous_params).item(), np.finfo(np.float64).tiny)
+        self.previous_params = params
+
+        ## Keep the state with the lowest monitored loss, to restore it when training ends
+        if self.best['loss'] is None or monitored < self.best['loss'] - self.min_delta:
+            self.best.update({'loss': monitored, 'epoch': epoch,
+                                'state': {key: value.detach().clone() for key, value in self.model.state_dict().items()}})
+        if self.patience is not None and epoch - self.best['epoch'] >= self.patience:
+            print(f"No improvement of more than {self.min_delta} for {self.patience} epochs")
+            self.__stop(engine, epoch)
+            return
+
+        criteria = [self.tolerance, self.grad_tolerance, self.param_tolerance]
+        if epoch < 2 or all(criterion is None for criterion in criteria):
+            return
+        relative_change = abs(losses[-2] - losses[-1]) / max(abs(losses[-2]), np.finfo(np.float64).tiny)
+        if (self.tolerance is None or relative_change < self.tolerance) and \
+                (self.grad_tolerance is None or (self.grad_norm is not None and self.grad_norm < self.grad_tolerance)) and \
+                (self.param_tolerance is None or (param_change is not None and param_change < self.param_tolerance)):
+            print(f'Converged with relative loss change {relative_change:.3g}, gradient norm {self.grad_norm} and relative parameter change {param_change}')
+            self.__stop(engine, epoch)
+
+    def __stop(self, engine, epoch:int):
+        self.stopping_epoch = epoch
+        print(f"Stopping after epoch {epoch}, restoring the best state of epoch {self.best['epoch']} with loss {self.best['loss']}")
+        self.wandb_handler.log({'stopping_epoch': epoch, 'best_epoch': self.best['epoch'], 'best_loss': self.best['loss']})
+        engine.terminate()
+
+    def __prepare_batches(self, dataset, model, device, batch_size) -> EventBatches:
+        batches = EventBatches(dataset, batch_size=batch_size)
+        batches.prepare(device, dtype=model.z0.dtype, start_times=getattr(model, 'start_times', None),
+                        end_times=getattr(model, 'end_times', None))
+        return batches
+
+    def __estimate_memory(self, model) -> int:
+        if isinstance(self.train_loader, EventBatches):
+            return max(estimate_forward_bytes(model, len(batch), batch.num_unique_times, prepared=True) for batch in self.train_loader)
+        ## Streamed chunks are not prepared and have at most chunk size unique times
+        chunk_size = self.train_loader.source.chunk_size
+        return estimate_forward_bytes(model, chunk_size, chunk_size, prepared=False)
+
     def __log_params(self):
         result_z0 = self.model.z0.detach().clone()
         result_v0 = self.model.v0.detach().clone()
         torch.save(result_z0, os.path.join(self.wandb_handler.run.dir, "final_z0.pt"))
         torch.save(result_v0, os.path.join(self.wandb_handler.run.dir, "final_v0.pt"))
+        torch.save(self.model.beta.detach().clone(), os.path.join(self.wandb_handler.run.dir, "final_beta.pt"))
 
     def __reset_model(self, keep_rotation):
-        z0, v0 = center_z0(self.model.z0), remove_v_drift(self.model.v0)
-        if not keep_rotation:
-            z0, v0 = remove_rotation(z0,v0)
+        if getattr(self.model, 'num_members', None):
+            ## Ensembles stack the parameters of their members along the first dimension
+            members = [self.__normalize_params(z0, v0, keep_rotation) for z0, v0 in zip(self.model.z0, self.model.v0)]
+            z0, v0 = torch.stack([z0 for z0, _ in members]), torch.stack([v0 for _, v0 in members])
+        else:
+            z0, v0 = self.__normalize_params(self.model.z0, self.model.v0, keep_rotation)
         ## Adjust model parameters for nicer visualizations
         self.model_state['z0'], self.model_state['v0'] = z0, v0
         self.model.load_state_dict(self.model_state)
+        if self.distributed:
+            ## Guards against the ranks drifting apart by rounding in the normalization
+            broadcast_parameters(self.model)
+
+    def __normalize_params(self, z0, v0, keep_rotation):
+        z0, v0 = center_z0(z0), remove_v_drift(v0)
+        if not keep_rotation:
+            z0, v0 = remove_rotation(z0,v0)
+        return z0, v0
 
 
     ### Training step
     def __train_step(self, engine, batch):
-        if engine.t_start != 0:
-            engine.t_start = batch[0,self.time_column_idx]
+        if isinstance(batch, EventChunk):
+            ## Streamed chunks carry their own time window
+            with phase('load_batch'):
+                t0, tn, batch = batch.t0, batch.tn, batch.events.to(self.device)
+        elif isinstance(batch, EventSet):
+            if engine.t_start != 0:
+                engine.t_start = self.time_window[0] if self.distributed else batch.t[0]
+            t0, tn = engine.t_start, self.time_window[1] if self.distributed else batch.t[-1]
+        else:
+            if engine.t_start != 0:
+                engine.t_start = batch[0,self.time_column_idx]
+            t0, tn = engine.t_start, batch[-1,self.time_column_idx]
 
         self.model.train()
-        self.optimizer.zero_grad()
-        loss = self.model(batch, t0=engine.t_start,
-                                            tn=batch[-1,self.time_column_idx])
-        loss.backward()
-        self.optimizer.step()
+        if self.closure_step:
+            ## The line search evaluates the loss and gradients as often as it needs, the returned loss is the one before the step
+            def closure():
+                self.optimizer.zero_grad()
+                with phase('forward'):
+                    loss = self.model(batch, t0=t0, tn=tn)
+                with phase('backward'):
+                    loss.backward()
+                if self.distributed:
+                    with phase('all_reduce'):
+                        all_reduce_gradients(self.model.parameters())
+                        loss = all_reduce_sum(loss)
+                return loss
+            with phase('optimizer_step'):
+                loss = self.optimizer.step(closure)
+        else:
+            self.optimizer.zero_grad()
+            with phase('forward'):
+                loss = self.model(batch, t0=t0, tn=tn)
+            with phase('backward'):
+                loss.backward()
+            if self.distributed:
+                with phase('all_reduce'):
+                    all_reduce_gradients(self.model.parameters())
+                    loss = all_reduce_sum(loss)
+            with phase('optimizer_step'):
+                self.optimizer.step()
+        grads = [parameter.grad for parameter in self.model.parameters() if parameter.grad is not None]
+        self.grad_norm = torch.norm(torch.stack([torch.norm(grad) for grad in grads])).item() if grads else None
+        if self.beta_update == 'step':
+            with phase('profile_beta'):
+                profile_beta(self.model, len(batch), t0, tn, reduce=all_reduce_sum if self.distributed else None)
+        if self.epoch_window['t0'] is None:
+            self.epoch_window['t0'] = t0
+        self.epoch_window['tn'] = tn
+        self.epoch_window['num_events'] += len(batch)
         self.temp_metrics['train_loss'].append(loss.item())
         self.temp_metrics['beta_est'].append(self.model.beta.detach().clone())
         if engine.t_start == 0:
@@ -98,9 +375,58 @@ class TrainTestGym:
         return loss.item()
 
 
+    ### Coarse-to-fine training of stepwise models
+    def refine_steps(self):
+        '''
+        Splits every step of the stepwise model into two halves with the velocity of the step,
+        which keeps the trajectories. The optimizer continues with its state, the moments of the
+        velocities are split like the velocities, and the batches are prepared for the new steps.
+        '''
+        old_v0 = self.model.v0
+        self.model.split_steps()
+        for group in self.optimizer.param_groups:
+            group['params'] = [self.model.v0 if parameter is old_v0 else parameter for parameter in group['params']]
+        if isinstance(self.optimizer, torch.optim.LBFGS):
+            ## The curvature pairs are flat vectors of all parameters, L-BFGS restarts from the new parameters
+            self.optimizer = torch.optim.LBFGS(self.optimizer.param_groups[0]['params'], **self.optimizer.defaults)
+        elif old_v0 in self.optimizer.state:
+            state = self.optimizer.state.pop(old_v0)
+            self.optimizer.state[self.model.v0] = {key: value.repeat_interleave(2, dim=2) if torch.is_tensor(value) and value.shape == old_v0.shape else value
+                                                    for key, value in state.items()}
+        self.model_state = self.model.state_dict()
+        self.best, self.previous_params = {'loss': None, 'epoch': None, 'state': None}, None
+
+        step_times = {'start_times': self.model.start_times, 'end_times': self.model.end_times}
+        if isinstance(self.train_loader, EventBatches):
+            self.train_loader.prepare(self.device, dtype=self.model.z0.dtype, **step_times)
+        if self.validation_set is not None:
+            self.validation_set = self.validation_set.prepare(self.device, dtype=self.model.z0.dtype, **step_times)
+        print(f'Refined the model to {self.model.num_of_steps} steps')
+
+
     ### Train and evaluate the model for n epochs
     def train_test_model(self, epochs:int):
+        if self.num_threads is not None or self.cores is not None:
+            thread_config = configure_threads(num_threads=self.num_threads,
+                                                num_interop_threads=self.num_interop_threads, cores=self.cores)
+            print_thread_configuration(thread_config)
         print(f'Starting model training with {epochs} epochs')
+        if self.profiler:
+            enable_profiling()
+        self.closure_step = isinstance(self.optimizer, torch.optim.LBFGS)
+        self.start_time, self.time_to_target = time.perf_counter(), None
+        self.best, self.previous_params, self.stopping_epoch = {'loss': None, 'epoch': None, 'state': None}, None, None
+        ## A run that was stopped early would otherwise be resumed instead of started anew
+        self.trainer.state.max_epochs = None
         self.trainer.run(self.train_loader, max_epochs=epochs)
+        self.memory_tracker.close()
+        if self.profiler:
+            self.profiler.close()
+            print(f'Profiling results saved to {self.profiler.output_dir}')
+        if self.best['state'] is not None:
+            self.model.load_state_dict(self.best['state'])
+            self.model_state.update(self.best['state'])
+        if self.closure_step and self.normalize_params:
+            self.__reset_model(self.keep_rotation)
         self.model.load_state_dict(self.model_state)
         print('Completed model training')
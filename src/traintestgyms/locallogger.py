@@ -0,0 +1,44 @@
+import os
+import json
+from types import SimpleNamespace
+
+
+class LocalRunLogger:
+    '''
+    Stand-in for the Weights and Biases handler used by the training gym and the evaluation code.
+    Metrics are kept in memory and written to metrics.jsonl, figures and html are saved
+    in the local run directory, so runs work without wandb installed or logged in.
+    '''
+    def __init__(self, run_dir:str) -> None:
+        os.makedirs(run_dir, exist_ok=True)
+        self.run = SimpleNamespace(dir=run_dir)
+        self.history = []
+
+    @staticmethod
+    def Image(figure):
+        return figure
+
+    @staticmethod
+    def Html(html:str):
+        return html
+
+    def save(self, path:str) -> None:
+        ## Files are already in the run directory
+        pass
+
+    def log(self, metrics:dict) -> None:
+        row = {}
+        for key, value in metrics.items():
+            if hasattr(value, 'savefig'):
+                value.savefig(os.path.join(self.run.dir, f'{key}.png'))
+                value = f'{key}.png'
+            elif isinstance(value, str) and value.lstrip().startswith('<'):
+                with open(os.path.join(self.run.dir, f'{key}.html'), 'w') as html_file:
+                    html_file.write(value)
+                value = f'{key}.html'
+            elif hasattr(value, 'tolist'):
+                value = value.tolist()
+            row[key] = value
+        self.history.append(row)
+        with open(os.path.join(self.run.dir, 'metrics.jsonl'), 'a') as metrics_file:
+            metrics_file.write(json.dumps(row, default=str) + '\n')
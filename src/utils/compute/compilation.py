@@ -0,0 +1,63 @@
+import torch
+
+## Compiled kernels are off unless enabled, kernels then call their eager function directly
+_state = {'enabled': False, 'compiled': {}}
+
+
+def compile_function(function):
+    '''
+    Compiles a pure tensor function with torch.compile when the installed torch provides it,
+    and with TorchScript otherwise. If neither works the function is returned unchanged.
+
+    :param function:    Function of tensors and python numbers
+
+    :returns:           The compiled function or the function itself
+    '''
+    try:
+        if hasattr(torch, 'compile'):
+            return torch.compile(function, dynamic=True)
+        return torch.jit.script(function)
+    except Exception as e:
+        print(f'Could not compile {function.__name__}, running it eagerly: {e}')
+        return function
+
+
+def compilable(function):
+    '''
+    Marks a chain of elementwise tensor operations as a kernel, which runs compiled
+    when compiled kernels are enabled. The function is compiled on its first call and must not
+    call other kernels. Costs one dict lookup when compiled kernels are disabled.
+    '''
+    def kernel(*args):
+        if not _state['enabled']:
+            return function(*args)
+        compiled = _state['compiled'].get(function)
+        if compiled is not None:
+            return compiled(*args)
+        ## torch.compile only fails when the function is first run
+        compiled = compile_function(function)
+        try:
+            result = compiled(*args)
+        except Exception as e:
+            print(f'Could not run the compiled {function.__name__}, running it eagerly: {e}')
+            compiled, result = function, function(*args)
+        _state['compiled'][function] = compiled
+        return result
+    kernel.__name__ = function.__name__
+    kernel.__doc__ = function.__doc__
+    kernel.eager = function
+    return kernel
+
+
+def enable_compiled_kernels(enabled:bool=True) -> None:
+    '''
+    Switches all kernels to their compiled versions. The TorchScript fuser
+    only fuses on cpu when it is allowed to explicitly.
+    '''
+    _state['enabled'] = enabled
+    if enabled and not hasattr(torch, 'compile') and hasattr(torch._C, '_jit_override_can_fuse_on_cpu'):
+        torch._C._jit_override_can_fuse_on_cpu(True)
+
+
+def compiled_kernels_enabled() -> bool:
+    return _state['enabled']
@@ -0,0 +1,73 @@
+import torch
+import torch.distributed as dist
+
+
+def init_process_group(rank:int, world_size:int, port:int=29500) -> None:
+    '''
+    Joins the gloo process group of the processes training on this machine
+    '''
+    dist.init_process_group('gloo', init_method=f'tcp://127.0.0.1:{port}', rank=rank, world_size=world_size)
+
+
+def pair_owner(i:torch.Tensor, j:torch.Tensor, num_nodes:int, world_size:int) -> torch.Tensor:
+    '''
+    Rank owning the node pairs (i,j), the integral and all events of a pair belong to one rank.
+    Consecutive pairs of a row go to different ranks, which balances the pairs between the ranks.
+    '''
+    i, j = i.long(), j.long()
+    return (torch.min(i, j)*num_nodes + torch.max(i, j)) % world_size
+
+
+def shard_events(dataset:torch.Tensor, num_nodes:int, rank:int, world_size:int) -> torch.Tensor:
+    '''
+    Events of the node pairs owned by the rank, in their time order
+
+    :param dataset: Events with columns [node_i, node_j, time_point]
+    '''
+    return dataset[pair_owner(dataset[:,0], dataset[:,1], num_nodes, world_size) == rank]
+
+
+def all_reduce_sum(tensor:torch.Tensor) -> torch.Tensor:
+    '''
+    Sum of the tensor over all ranks, without gradients
+    '''
+    total = tensor.detach().clone()
+    dist.all_reduce(total, op=dist.ReduceOp.SUM)
+    return total
+
+
+def all_reduce_gradients(parameters) -> None:
+    '''
+    Sums the gradients of all ranks in one flat buffer. The losses of the ranks are sums over
+    disjoint node pairs, so the summed gradients are the gradients of the full loss.
+    '''
+    grads = [parameter.grad for parameter in parameters if parameter.grad is not None]
+    if not grads:
+        return
+    flat = torch.cat([grad.flatten() for grad in grads])
+    dist.all_reduce(flat, op=dist.ReduceOp.SUM)
+    offset = 0
+    for grad in grads:
+        grad.copy_(flat[offset:offset+grad.numel()].view_as(grad))
+        offset += grad.numel()
+
+
+def broadcast_parameters(module:torch.nn.Module, src:int=0) -> None:
+    '''
+    Copies the parameters of rank src to all other ranks, so every rank steps from the same parameters
+    '''
+    with torch.no_grad():
+        for parameter in module.parameters():
+            dist.broadcast(parameter.data, src=src)
+
+
+def global_time_window(times:torch.Tensor):
+    '''
+    First and last event time over the events of all ranks
+
+    :returns:   Python floats t_first and t_last
+    '''
+    ## A rank without events does not move the window
+    window = torch.stack([-times.min(), times.max()]).double() if len(times) else torch.full((2,), -float('inf'), dtype=torch.float64)
+    dist.all_reduce(window, op=dist.ReduceOp.MAX)
+    return -window[0].item(), window[1].item()
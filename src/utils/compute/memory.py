@@ -0,0 +1,190 @@
+import os
+import threading
+import torch
+from torch.utils.checkpoint import checkpoint
+try:
+    import resource
+except ImportError:
+    ## Not available on Windows, the peak memory of cpu runs is then not reported
+    resource = None
+
+
+## Rough number of (N,N,...) sized tensors the closed form integral keeps alive for the backward pass
+INTEGRAL_TEMPORARIES = 32
+## Number of tensors of the size of the dense distance tensors kept alive for the backward pass
+DENSE_TEMPORARIES = 4
+
+
+def forward_memory_model(model, prepared:bool=True):
+    '''
+    Linear model of the memory of one forward and backward pass of a model
+
+    :param model:       The model to train
+    :param prepared:    Whether the batches are prepared event sets, which lets the
+                        stepwise models use sufficient statistics instead of dense distances
+
+    :returns:           Bytes independent of the batch, bytes per unique time and bytes per event of a batch
+    '''
+    dtype_size = torch.finfo(model.z0.dtype).bits // 8
+    num_members = getattr(model, 'num_members', None) or 1
+    num_nodes = model.z0.shape[-2]
+    pairs = num_members*num_nodes*num_nodes
+    block_size = getattr(model, 'block_size', None)
+    if block_size:
+        ## Tiled models hold the pairs of one block, and gather the distances of the event pairs only
+        num_steps = getattr(model, 'num_of_steps', 1)
+        fixed = min(block_size, num_nodes)**2*num_steps*INTEGRAL_TEMPORARIES
+        per_time = num_nodes*2*num_steps if hasattr(model, 'num_of_steps') and not prepared else 0
+        return fixed*dtype_size, per_time*dtype_size, 8*dtype_size
+
+    if hasattr(model, 'num_of_steps'):
+        num_steps = model.num_of_steps
+        fixed = pairs*num_steps*INTEGRAL_TEMPORARIES
+        if prepared:
+            ## A few numbers per active (pair, step), at most one per event
+            return fixed*dtype_size, 0, 8*num_members*dtype_size
+        ## Positions of every node at every unique time through every step, and the dense distances
+        per_time = num_members*num_nodes*2*num_steps + pairs*DENSE_TEMPORARIES
+        return fixed*dtype_size, per_time*dtype_size, 0
+    if hasattr(model, 'steps'):
+        ## Constant velocity models evaluate the dense distances at every unique time
+        return pairs*INTEGRAL_TEMPORARIES*dtype_size, (num_nodes*2 + pairs*DENSE_TEMPORARIES)*dtype_size, 0
+    return pairs*DENSE_TEMPORARIES*dtype_size, 0, 0
+
+
+def checkpoint_segment(function, *tensors):
+    '''
+    Evaluates function(*tensors) keeping only the input tensors for the backward pass,
+    which recomputes the intermediate tensors of the function. Other arguments of the
+    function have to be closed over, as checkpoints only pass tensors.
+    Runs the function directly when no gradients are needed.
+    '''
+    if torch.is_grad_enabled() and any(tensor.requires_grad for tensor in tensors):
+        return checkpoint(function, *tensors)
+    return function(*tensors)
+
+
+def estimate_forward_bytes(model, num_events:int, num_unique_times:int, prepared:bool=True) -> int:
+    '''
+    Estimated peak memory in bytes of one forward and backward pass on a batch
+    '''
+    fixed, per_time, per_event = forward_memory_model(model, prepared=prepared)
+    return fixed + per_time*num_unique_times + per_event*num_events
+
+
+def max_batch_size_within(model, budget:int, prepared:bool=True):
+    '''
+    Largest number of events in a batch whose estimated memory stays within the budget.
+    A batch has at most as many unique times as events.
+
+    :returns:   The batch size, None if the memory does not depend on the batch size and -1 if no batch fits
+    '''
+    fixed, per_time, per_event = forward_memory_model(model, prepared=prepared)
+    if fixed >= budget:
+        return -1
+    if per_time + per_event == 0:
+        return None
+    return max(0, int((budget - fixed) // (per_time + per_event)))
+
+
+def max_block_size_within(model, budget:int) -> int:
+    '''
+    Largest block size of the tiled integral whose blocks need at most half of the budget,
+    which leaves the other half for the events. The memory of the tiled integral does not grow with N.
+
+    :returns:   The block size, -1 if not even blocks of one node fit
+    '''
+    dtype_size = torch.finfo(model.z0.dtype).bits // 8
+    num_steps = getattr(model, 'num_of_steps', 1)
+    block_size = int(((budget / 2) / (num_steps*INTEGRAL_TEMPORARIES*dtype_size)) ** 0.5)
+    return min(block_size, model.z0.shape[-2]) if block_size >= 1 else -1
+
+
+def format_bytes(num_bytes:float) -> str:
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if num_bytes < 1024:
+            return f'{num_bytes:.1f} {unit}'
+        num_bytes /= 1024
+    return f'{num_bytes:.1f} TB'
+
+
+def reset_peak_memory(device) -> None:
+    if torch.device(device).type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+
+
+def peak_memory_bytes(device) -> int:
+    '''
+    Peak allocation on a cuda device since the last reset, or the peak resident
+    memory of the process over its lifetime on cpu, which can not be reset. See PeakMemoryTracker
+    for the peak of a part of a cpu run.
+    '''
+    if torch.device(device).type == 'cuda':
+        return torch.cuda.max_memory_allocated(device)
+    if resource is None:
+        return 0
+    ## ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+
+def current_rss_bytes():
+    '''
+    Resident memory of the process now, None where neither /proc nor psutil is available
+    '''
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+
+class PeakMemoryTracker:
+    '''
+    Peak memory since the last reset. On cuda these are the allocator statistics.
+    On cpu a background thread samples the resident memory of the process every interval seconds,
+    so peaks shorter than the interval can be missed.
+    '''
+    def __init__(self, device, interval:float=0.005) -> None:
+        self.device = torch.device(device)
+        self.interval = interval
+        self.peak = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def __sample(self) -> None:
+        while not self.stopped.wait(self.interval):
+            rss = current_rss_bytes()
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+
+    def reset(self) -> None:
+        if self.device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(self.device)
+            return
+        self.peak = current_rss_bytes()
+        if self.thread is None and self.peak is not None:
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.__sample, daemon=True)
+            self.thread.start()
+
+    def peak_bytes(self):
+        '''
+        :returns:   The peak in bytes since the last reset, None if it can not be measured
+        '''
+        if self.device.type == 'cuda':
+            return torch.cuda.max_memory_allocated(self.device)
+        rss = current_rss_bytes()
+        if rss is not None and self.peak is not None:
+            self.peak = max(self.peak, rss)
+        return self.peak
+
+    def close(self) -> None:
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
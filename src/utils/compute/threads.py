@@ -0,0 +1,98 @@
+import os
+import torch
+
+try:
+    from threadpoolctl import threadpool_limits, threadpool_info
+except ImportError:
+    threadpool_limits, threadpool_info = None, None
+
+
+## Environment variables read by the BLAS and OpenMP runtimes when they start
+BLAS_THREAD_VARIABLES = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                            'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+
+def parse_core_list(cores:str) -> list:
+    '''
+    Parses a core specification like "0-7,16,18-19" into a list of core ids
+
+    :param cores:   Comma separated core ids and inclusive core ranges
+
+    :returns:       Sorted list of unique core ids
+    '''
+    core_ids = set()
+    for part in cores.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            core_ids.update(range(int(first), int(last)+1))
+        else:
+            core_ids.add(int(part))
+    return sorted(core_ids)
+
+
+def configure_threads(num_threads:int=None, num_interop_threads:int=None, cores:str=None) -> dict:
+    '''
+    Sets the thread budget of the running process.
+    The torch intra-op and inter-op thread pools and the BLAS libraries loaded
+    by numpy, scipy and sklearn are limited to the budget, and the process can
+    optionally be pinned to a set of cores.
+
+    :param num_threads:         Number of intra-op threads for torch and BLAS.
+                                If None the number of pinned cores is used, or the torch default
+    :param num_interop_threads: Number of inter-op threads for torch. Defaults to 1 when num_threads is set
+    :param cores:               Optional core specification e.g. "0-7" to pin the process to
+
+    :returns:                   The effective thread configuration
+    '''
+    if cores is not None:
+        core_ids = parse_core_list(cores)
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, core_ids)
+        else:
+            print('Core pinning is not supported on this platform and is skipped')
+        if num_threads is None:
+            num_threads = len(core_ids)
+
+    if num_threads is not None:
+        ## Environment variables only reach runtimes started after this point e.g. in spawned workers
+        for variable in BLAS_THREAD_VARIABLES:
+            os.environ[variable] = str(num_threads)
+        torch.set_num_threads(num_threads)
+        if threadpool_limits is not None:
+            threadpool_limits(limits=num_threads)
+        if num_interop_threads is None:
+            num_interop_threads = 1
+
+    if num_interop_threads is not None and torch.get_num_interop_threads() != num_interop_threads:
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError:
+            ## The inter-op pool can only be sized once, before any inter-op work has started
+            print(f'Could not set inter-op threads to {num_interop_threads}, keeping {torch.get_num_interop_threads()}')
+
+    return thread_configuration()
+
+
+def thread_configuration() -> dict:
+    '''
+    Collects the effective thread configuration of the running process
+
+    :returns:   Dictionary with torch thread counts, BLAS thread counts and the cores the process may run on
+    '''
+    config = {'torch_num_threads': torch.get_num_threads(),
+                'torch_num_interop_threads': torch.get_num_interop_threads()}
+    if threadpool_info is not None:
+        config['blas_num_threads'] = {info['internal_api']: info['num_threads'] for info in threadpool_info()}
+    if hasattr(os, 'sched_getaffinity'):
+        config['cores'] = sorted(os.sched_getaffinity(0))
+    return config
+
+
+def print_thread_configuration(config:dict) -> None:
+    cores = config.get('cores')
+    cores = f'{len(cores)} cores ({cores[0]}-{cores[-1]})' if cores else 'unknown cores'
+    print(f"Threads: torch intra-op {config['torch_num_threads']}, inter-op {config['torch_num_interop_threads']}, "
+            f"BLAS {config.get('blas_num_threads', 'unknown')}, running on {cores}")
@@ -1,12 +1,118 @@
+import math
 import torch
+from utils.compute.compilation import compilable
+from utils.compute.memory import checkpoint_segment
 
+_NATIVE_ERFCX = hasattr(torch, 'special') and hasattr(torch.special, 'erfcx')
 
-def analytical_integral(t0:torch.Tensor, tn:torch.Tensor, 
+
+def __erfcx(x:torch.Tensor) -> torch.Tensor:
+    '''
+    Scaled complementary error function exp(x^2)*erfc(x) for x >= 0.
+    Uses torch.special.erfcx when the installed torch provides it and otherwise
+    evaluates exp(x^2)*erfc(x) in double precision with an asymptotic tail.
+    The fallback is also used by the TorchScript version of the integral kernel.
+
+    :param x:   Non-negative input tensor
+
+    :returns:   erfcx(x) in the dtype of x
+    '''
+    ## TorchScript does not compile the branch under is_scripting, so it never sees the python global
+    if not torch.jit.is_scripting():
+        if _NATIVE_ERFCX:
+            return torch.special.erfcx(x)
+
+    xd = x.double()
+    ## exp(x^2)*erfc(x) is representable in double precision until x is about 26
+    near = xd < 25.
+    x_near = torch.where(near, xd, torch.zeros_like(xd))
+    x_far = torch.where(near, torch.full_like(xd, 25.), xd)
+    erfcx_near = torch.exp(torch.square(x_near))*torch.erfc(x_near)
+    erfcx_far = (1. - 1./(2.*x_far**2) + 3./(4.*x_far**4)) / (x_far*math.sqrt(math.pi))
+    return torch.where(near, erfcx_near, erfcx_far).to(x.dtype)
+
+
+def pairwise_integral(t0, tn, a:torch.Tensor, b:torch.Tensor,
+                        m:torch.Tensor, n:torch.Tensor, beta:torch.Tensor) -> torch.Tensor:
+    '''
+    Closed form of the integral from t0 to tn of exp(beta - |dz + dv*t|^2)
+    for position differences dz = (a,b) and velocity differences dv = (m,n).
+
+    The difference erf(xn)-erf(x0) is rewritten with scaled erfc terms so no
+    factor underflows or cancels when the nodes are far apart, and pairs which
+    barely move relative to each other are integrated with Simpson's rule,
+    which reduces to exp(beta - |dz|^2)*(tn-t0) for dv = 0.
+    All branches are finite, so gradients stay finite in float32.
+
+    :param t0:      Start of integral interval, scalar or tensor broadcastable to a
+    :param tn:      End of integral interval, scalar or tensor broadcastable to a
+    :param a:       Differences of the x coordinates of the positions
+    :param b:       Differences of the y coordinates of the positions
+    :param m:       Differences of the x coordinates of the velocities
+    :param n:       Differences of the y coordinates of the velocities
+    :param beta:    Common bias term broadcastable to a
+
+    :returns:       The integral for every entry of the difference tensors
+    '''
+    t0 = torch.as_tensor(t0, dtype=a.dtype, device=a.device)
+    tn = torch.as_tensor(tn, dtype=a.dtype, device=a.device)
+    ## The threshold balances Simpson's error against the cancellation of the erfc difference
+    tau = (90 * torch.finfo(a.dtype).eps) ** 0.2
+    return __pairwise_integral_kernel(t0, tn, a, b, m, n, beta, tau)
+
+
+@compilable
+def __pairwise_integral_kernel(t0:torch.Tensor, tn:torch.Tensor, a:torch.Tensor, b:torch.Tensor,
+                                m:torch.Tensor, n:torch.Tensor, beta:torch.Tensor, tau:float) -> torch.Tensor:
+    delta_t = tn - t0
+    t_mid = (t0 + tn) / 2
+
+    ## Squared distances at the ends and the middle of the interval
+    sq_dist_t0 = torch.square(a + m*t0) + torch.square(b + n*t0)
+    sq_dist_tn = torch.square(a + m*tn) + torch.square(b + n*tn)
+    sq_dist_mid = torch.square(a + m*t_mid) + torch.square(b + n*t_mid)
+
+    sqmn = torch.square(m) + torch.square(n)
+    am_bn = a*m + b*n
+
+    ## Width and location of the interval in erf units, computed without dividing by |dv|
+    small = torch.sqrt(sqmn)*delta_t + delta_t*torch.abs(sqmn*t_mid + am_bn) < tau
+
+    simpson = delta_t / 6 * (torch.exp(beta - sq_dist_t0)
+                                + 4*torch.exp(beta - sq_dist_mid)
+                                + torch.exp(beta - sq_dist_tn))
+
+    ## Safe velocity norm so the unused closed form branch never divides by 0
+    sqmn_safe = torch.where(small, torch.ones_like(sqmn), sqmn)
+    sqrtmn = torch.sqrt(sqmn_safe)
+    x0 = (sqmn_safe*t0 + am_bn) / sqrtmn
+    xn = (sqmn_safe*tn + am_bn) / sqrtmn
+    ## Squared distance at the time of closest approach
+    sq_dist_min = torch.square(a*n - b*m) / sqmn_safe
+
+    ## Interval after the closest approach: erfc(x0) - erfc(xn)
+    x0_pos, xn_pos = torch.clamp(x0, min=0), torch.clamp(xn, min=0)
+    after = (torch.exp(beta - sq_dist_t0)*__erfcx(x0_pos)
+                - torch.exp(beta - sq_dist_tn)*__erfcx(xn_pos))
+    ## Interval before the closest approach: erfc(-xn) - erfc(-x0)
+    x0_neg, xn_neg = -torch.clamp(x0, max=0), -torch.clamp(xn, max=0)
+    before = (torch.exp(beta - sq_dist_tn)*__erfcx(xn_neg)
+                - torch.exp(beta - sq_dist_t0)*__erfcx(x0_neg))
+    ## Interval containing the closest approach has no cancellation
+    around = torch.exp(beta - sq_dist_min)*(2 - torch.erfc(xn) - torch.erfc(-x0))
+
+    closed_form = (math.sqrt(math.pi) / (2*sqrtmn)) * torch.where(x0 >= 0, after,
+                                                                torch.where(xn <= 0, before, around))
+
+    return torch.where(small, simpson, closed_form)
+
+
+def analytical_integral(t0:torch.Tensor, tn:torch.Tensor,
                         i:int, j:int,
                         z:torch.Tensor, v:torch.Tensor,  beta:torch.Tensor) -> torch.Tensor:
     '''
-    Calculates the Riemann sum for the integral from t0 to tn
-    based on the nodes i and j and the given function func.
+    Calculates the closed form integral from t0 to tn
+    of the intensity function of the nodes i and j.
 
     :param t0:          Start of integral interval
     :param tn:          End of integral interval
@@ -14,7 +120,7 @@ def analytical_integral(t0:torch.Tensor, tn:torch.Tensor,
     :param v:           The constant velocity vector
     :param i:           The index of node i
     :param j:           The index of node j
-    :param func:        The intensity function to compute the integral of
+    :param beta:        The common bias term
 
     :returns:           The closed form solution of the squared euclidean intensity function
     '''
@@ -24,38 +130,129 @@ def analytical_integral(t0:torch.Tensor, tn:torch.Tensor,
     m = v[i,0] - v[j,0]
     n = v[i,1] - v[j,1]
 
-    return (    -   
-                (torch.sqrt(torch.pi) / (2*torch.sqrt(m**2 + n**2)))
-                *
-                (torch.exp(((-b**2 + beta) * m**2 + 2*a*b*m*n - n**2 * (a**2 - beta)) / (m**2 + n**2))) 
-                * 
-                (torch.erf(((m**2 + n**2)*t0 + a*m + b*n) / torch.sqrt(m**2 + n**2)) - 
-                torch.erf(((m**2 + n**2)*tn + a*m + b*n) / torch.sqrt(m**2 + n**2))) 
-            )
+    return pairwise_integral(t0, tn, a, b, m, n, beta)
 
 
-def vec_analytical_integral(t0:torch.Tensor, tn:torch.Tensor, 
+def vec_analytical_integral(t0:torch.Tensor, tn:torch.Tensor,
                             z0:torch.Tensor, v0:torch.Tensor, beta:torch.Tensor):
+    '''
+    Calculates the closed form integral from t0 to tn
+    of the intensity function for all node pairs at once.
+
+    :param t0:      Start of integral interval
+    :param tn:      End of integral interval
+    :param z0:      Latent positions of shape (N,2) or stepwise (N,2,S)
+    :param v0:      Velocities matching the shape of z0
+    :param beta:    The common bias term
+
+    :returns:       Integrals of shape (N,N) or (N,N,S)
+    '''
+    a = z0[:,0].unsqueeze(1) - z0[:,0].unsqueeze(0)
+    b = z0[:,1].unsqueeze(1) - z0[:,1].unsqueeze(0)
+    m = v0[:,0].unsqueeze(1) - v0[:,0].unsqueeze(0)
+    n = v0[:,1].unsqueeze(1) - v0[:,1].unsqueeze(0)
+
+    return pairwise_integral(t0, tn, a, b, m, n, beta)
+
+
+def min_squared_distance(t0, tn, a:torch.Tensor, b:torch.Tensor, m:torch.Tensor, n:torch.Tensor) -> torch.Tensor:
+    '''
+    Minimum of |dz + dv*t|^2 over t in [t0, tn], attained at the critical time
+    -(dz . dv)/|dv|^2, as in the critical time points of the data simulator, clamped to the interval
+
+    :returns:   The minimum squared distance for every entry of the difference tensors
+    '''
+    t0 = torch.as_tensor(t0, dtype=a.dtype, device=a.device)
+    tn = torch.as_tensor(tn, dtype=a.dtype, device=a.device)
+    critical_time = -(a*m + b*n) / (torch.square(m) + torch.square(n) + torch.finfo(a.dtype).eps)
+    critical_time = torch.min(torch.max(critical_time, t0), tn)
+    return torch.square(a + m*critical_time) + torch.square(b + n*critical_time)
+
+
+def pruned_integral_sum(t0, tn, z0:torch.Tensor, v0:torch.Tensor, beta:torch.Tensor, threshold:float):
+    '''
+    Sum of the closed form integrals of all node pairs i < j, skipping every pair (and step)
+    whose integral is bounded by exp(beta - min squared distance)*(tn - t0) < threshold.
+    The bound is computed without gradients and only the remaining pairs are integrated.
+
+    :param t0:          Start of integral interval, a scalar
+    :param tn:          End of integral interval, a scalar
+    :param z0:          Latent positions of shape (N,2) or stepwise (N,2,S)
+    :param v0:          Velocities matching the shape of z0
+    :param beta:        The common bias term, a scalar tensor
+    :param threshold:   Pairs with an integral bound below the threshold are skipped
+
+    :returns:           The sum of the integrals of the remaining pairs and the
+                        upper bound of the sum of the skipped integrals
+    '''
+    i, j = torch.triu_indices(row=z0.shape[0], col=z0.shape[0], offset=1, device=z0.device)
+    beta = beta.reshape(())
+    with torch.no_grad():
+        dz, dv = z0[i] - z0[j], v0[i] - v0[j]
+        sq_dist_min = min_squared_distance(t0, tn, dz[:,0], dz[:,1], dv[:,0], dv[:,1])
+        bound = torch.exp(beta - sq_dist_min)*(torch.as_tensor(tn, dtype=z0.dtype) - torch.as_tensor(t0, dtype=z0.dtype))
+        active = bound >= threshold
+        neglected = torch.sum(bound[~active])
+
+    ## Pair and, for stepwise positions, step index of every remaining integral
+    active_idx = active.nonzero(as_tuple=True)
+    pair_i, pair_j = i[active_idx[0]], j[active_idx[0]]
+    steps = active_idx[1:]
+    dz = z0[(pair_i, slice(None)) + steps] - z0[(pair_j, slice(None)) + steps]
+    dv = v0[(pair_i, slice(None)) + steps] - v0[(pair_j, slice(None)) + steps]
+    integrals = pairwise_integral(t0, tn, dz[:,0], dz[:,1], dv[:,0], dv[:,1], beta)
+    return torch.sum(integrals), neglected
 
-    a = (z0[:,0].unsqueeze(1) - z0[:,0].unsqueeze(0)) + torch.eps
-    b = (z0[:,1].unsqueeze(1) - z0[:,1].unsqueeze(0)) + torch.eps
-    m = (v0[:,0].unsqueeze(1) - v0[:,0].unsqueeze(0)) + torch.eps
-    n = (v0[:,1].unsqueeze(1) - v0[:,1].unsqueeze(0)) + torch.eps
-
-    am = a*m
-    bn = b*n
-    sqa = torch.square(a)
-    sqb = torch.square(b)
-    sqm = torch.square(m)
-    sqn = torch.square(n)
-    sqrtmn = torch.sqrt(sqm + sqn)
-    psqmn = sqm+sqn
-
-    return (    -   
-                (torch.sqrt(torch.pi) / (2*sqrtmn))
-                *
-                (torch.exp(((-sqb + beta) * sqm + 2*a*b*m*n - sqn * (sqa - beta)) / psqmn)) 
-                * 
-                (torch.erf((psqmn*t0 + am + bn) / sqrtmn) - 
-                torch.erf((psqmn*tn + am + bn) / sqrtmn)) 
-            )
\ No newline at end of file
+
+def pair_integral_sum(t0, tn, z0:torch.Tensor, v0:torch.Tensor, beta:torch.Tensor, i:torch.Tensor, j:torch.Tensor) -> torch.Tensor:
+    '''
+    Sum of the closed form integrals of the node pairs (i,j) only, used when
+    the node pairs are shared between processes
+
+    :param z0:  Latent positions of shape (N,2) or stepwise (N,2,S)
+    :param v0:  Velocities matching the shape of z0
+    :param i:   Nodes i of the pairs
+    :param j:   Nodes j of the pairs
+    '''
+    dz, dv = z0[i] - z0[j], v0[i] - v0[j]
+    return torch.sum(pairwise_integral(t0, tn, dz[:,0], dz[:,1], dv[:,0], dv[:,1], beta.reshape(())))
+
+
+def __tile_integral_sum(t0, tn, z_rows:torch.Tensor, v_rows:torch.Tensor, z_cols:torch.Tensor, v_cols:torch.Tensor,
+                        beta:torch.Tensor, diagonal:bool) -> torch.Tensor:
+    a = z_rows[:,0].unsqueeze(1) - z_cols[:,0].unsqueeze(0)
+    b = z_rows[:,1].unsqueeze(1) - z_cols[:,1].unsqueeze(0)
+    m = v_rows[:,0].unsqueeze(1) - v_cols[:,0].unsqueeze(0)
+    n = v_rows[:,1].unsqueeze(1) - v_cols[:,1].unsqueeze(0)
+    integrals = pairwise_integral(t0, tn, a, b, m, n, beta)
+    ## Sum over the steps, if any, and only count the pairs i < j of blocks on the diagonal
+    integrals = torch.sum(integrals.reshape(integrals.shape[0], integrals.shape[1], -1), dim=2)
+    return torch.sum(integrals.triu(diagonal=1) if diagonal else integrals)
+
+
+def tiled_integral_sum(t0, tn, z0:torch.Tensor, v0:torch.Tensor, beta:torch.Tensor, block_size:int) -> torch.Tensor:
+    '''
+    Sum of the closed form integrals of all node pairs i < j, evaluated in blocks of
+    block_size x block_size pairs. Every block is checkpointed, so only the block inputs are
+    kept for the backward pass, which recomputes the blocks one at a time. The gradients are
+    exact and the peak memory is that of one block, O(block_size^2 * S), for any N.
+
+    :param t0:          Start of integral interval
+    :param tn:          End of integral interval
+    :param z0:          Latent positions of shape (N,2) or stepwise (N,2,S)
+    :param v0:          Velocities matching the shape of z0
+    :param beta:        The common bias term
+    :param block_size:  Number of nodes in a block of rows or columns
+
+    :returns:           The sum of the integrals
+    '''
+    num_nodes = z0.shape[0]
+    total = torch.zeros((), dtype=z0.dtype, device=z0.device)
+    for row in range(0, num_nodes, block_size):
+        for col in range(row, num_nodes, block_size):
+            ## The times and the diagonal flag are closed over, so only tensors pass through the checkpoint
+            tile = lambda z_rows, v_rows, z_cols, v_cols, beta, diagonal=(row == col): \
+                        __tile_integral_sum(t0, tn, z_rows, v_rows, z_cols, v_cols, beta, diagonal)
+            blocks = (z0[row:row+block_size], v0[row:row+block_size], z0[col:col+block_size], v0[col:col+block_size], beta)
+            total = total + checkpoint_segment(tile, *blocks)
+    return total
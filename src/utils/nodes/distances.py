@@ -1,5 +1,6 @@
 import torch
 import torch.nn as nn
+from utils.compute.compilation import compilable
 
 
 def get_squared_euclidean_dist(z:torch.Tensor, i:torch.Tensor, j:torch.Tensor) -> torch.Tensor:
@@ -21,5 +22,6 @@ def get_squared_euclidean_dist(z:torch.Tensor, i:torch.Tensor, j:torch.Tensor) -
     return pdist(z_i, z_j)**2
     
 
-def vec_squared_euclidean_dist(Z):
+@compilable
+def vec_squared_euclidean_dist(Z:torch.Tensor) -> torch.Tensor:
     return torch.sum(torch.square(Z.unsqueeze(0) - Z.unsqueeze(1)), dim=2)
\ No newline at end of file
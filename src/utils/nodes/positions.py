@@ -2,6 +2,32 @@ import torch
 import numpy as np
 
 
+def find_steps(t:torch.Tensor, start_times:torch.Tensor) -> torch.Tensor:
+    '''
+    Index of the step of a stepwise model every time falls into.
+    As in the step masks of the models, a time at the end of a step belongs to that step
+    and times before the first step belong to the first step.
+
+    :param t:           Times
+    :param start_times: Start times of the steps, in the dtype of t
+
+    :returns:           Step index of every time
+    '''
+    return torch.clamp(torch.bucketize(t.contiguous(), start_times) - 1, min=0)
+
+
+def find_steps_and_offsets(t:torch.Tensor, start_times:torch.Tensor, end_times:torch.Tensor):
+    '''
+    Step of every time and the time since the start of the step, see find_steps.
+    The offsets are clamped to the step, so times after the last step are at its end.
+
+    :returns:   Step indices and offsets
+    '''
+    step_index = find_steps(t, start_times)
+    step_offset = torch.min(torch.clamp(t - start_times[step_index], min=0.), end_times[step_index] - start_times[step_index])
+    return step_index, step_offset
+
+
 def stepwise_get_current_position(z:torch.Tensor, v:torch.Tensor, i:int, t:int, t_deltas:int) -> np.ndarray:
     '''
     Calculates position of node i at time t.
@@ -0,0 +1,154 @@
+import heapq
+import numpy as np
+import torch
+from utils.nodes.positions import find_steps_and_offsets
+
+
+class StepGrid:
+    '''
+    Uniform grid over the node positions at the start of one step.
+    Inside the step every node moves linearly, so a node is never further than
+    max_speed*offset from its start position at the time start+offset. Queries search the
+    start grid with distance bounds inflated by that amount and check the exact positions
+    of the candidates only.
+    '''
+    def __init__(self, start_positions:np.ndarray, velocities:np.ndarray, cell_size:float) -> None:
+        '''
+        :param start_positions: Positions of the nodes at the start of the step of shape (N,2)
+        :param velocities:      Velocities of the nodes in the step of shape (N,2)
+        :param cell_size:       Side length of the grid cells
+        '''
+        self.start_positions = start_positions
+        self.velocities = velocities
+        self.max_speed = float(np.max(np.linalg.norm(velocities, axis=1))) if len(velocities) else 0.
+        self.cell_size = cell_size
+        self.origin = start_positions.min(axis=0)
+
+        cells = np.floor((start_positions - self.origin) / cell_size).astype(np.int64)
+        self.num_cells = cells.max(axis=0) + 1
+        keys = cells[:,0]*self.num_cells[1] + cells[:,1]
+        ## Nodes sorted by cell, the nodes of cell key are order[cell_starts[key]:cell_starts[key+1]]
+        self.order = np.argsort(keys, kind='stable')
+        self.cell_starts = np.searchsorted(keys[self.order], np.arange(self.num_cells[0]*self.num_cells[1] + 1))
+
+    def positions(self, offset:float) -> np.ndarray:
+        return self.start_positions + self.velocities*offset
+
+    def __cell_of(self, point:np.ndarray) -> np.ndarray:
+        return np.floor((point - self.origin) / self.cell_size).astype(np.int64)
+
+    def __nodes_in_cells(self, x_range, y_range) -> np.ndarray:
+        x0, x1 = max(x_range[0], 0), min(x_range[1], self.num_cells[0]-1)
+        y0, y1 = max(y_range[0], 0), min(y_range[1], self.num_cells[1]-1)
+        if x0 > x1 or y0 > y1:
+            return np.empty(0, dtype=np.int64)
+        ## The cells of one grid column are contiguous in the sorted order
+        columns = [self.order[self.cell_starts[x*self.num_cells[1] + y0]:self.cell_starts[x*self.num_cells[1] + y1 + 1]]
+                    for x in range(x0, x1+1)]
+        return np.concatenate(columns)
+
+    def __ring(self, center:np.ndarray, r:int) -> np.ndarray:
+        ## Nodes of the cells at Chebyshev distance exactly r from the center cell
+        if r == 0:
+            return self.__nodes_in_cells((center[0], center[0]), (center[1], center[1]))
+        cx, cy = center
+        return np.concatenate([self.__nodes_in_cells((cx-r, cx-r), (cy-r, cy+r)),
+                                self.__nodes_in_cells((cx+r, cx+r), (cy-r, cy+r)),
+                                self.__nodes_in_cells((cx-r+1, cx+r-1), (cy-r, cy-r)),
+                                self.__nodes_in_cells((cx-r+1, cx+r-1), (cy+r, cy+r))])
+
+    def knn(self, point:np.ndarray, offset:float, k:int, exclude:int=None):
+        '''
+        k nearest nodes to a point at the time start+offset
+
+        :param point:   Query point of shape (2,)
+        :param offset:  Time since the start of the step
+        :param k:       Number of neighbours
+        :param exclude: Node left out of the result, e.g. the query node itself
+
+        :returns:       Node indices and squared distances sorted by distance
+        '''
+        center = self.__cell_of(point)
+        inflation = self.max_speed*offset
+        max_ring = int(max(np.max(np.abs(center)), np.max(np.abs(self.num_cells - 1 - center))))
+        best = []  ## Max heap of the k best as (-squared distance, node)
+        for r in range(max_ring+1):
+            candidates = self.__ring(center, r)
+            if exclude is not None:
+                candidates = candidates[candidates != exclude]
+            if len(candidates):
+                sq_dists = np.sum(np.square(self.start_positions[candidates] + self.velocities[candidates]*offset - point), axis=1)
+                for node, sq_dist in zip(candidates.tolist(), sq_dists.tolist()):
+                    if len(best) < k:
+                        heapq.heappush(best, (-sq_dist, node))
+                    elif sq_dist < -best[0][0]:
+                        heapq.heapreplace(best, (-sq_dist, node))
+            ## Every node outside the searched rings starts at least r*cell_size away
+            lower_bound = r*self.cell_size - inflation
+            if len(best) == k and lower_bound > 0 and -best[0][0] <= lower_bound**2:
+                break
+        best = sorted((-neg_sq_dist, node) for neg_sq_dist, node in best)
+        return np.asarray([node for _, node in best], dtype=np.int64), np.asarray([sq_dist for sq_dist, _ in best])
+
+    def radius(self, point:np.ndarray, offset:float, radius:float, exclude:int=None):
+        '''
+        Nodes within a radius of a point at the time start+offset
+
+        :returns:   Node indices and squared distances sorted by distance
+        '''
+        search_radius = radius + self.max_speed*offset
+        low, high = self.__cell_of(point - search_radius), self.__cell_of(point + search_radius)
+        candidates = self.__nodes_in_cells((low[0], high[0]), (low[1], high[1]))
+        if exclude is not None:
+            candidates = candidates[candidates != exclude]
+        sq_dists = np.sum(np.square(self.start_positions[candidates] + self.velocities[candidates]*offset - point), axis=1)
+        inside = sq_dists <= radius**2
+        sorting = np.argsort(sq_dists[inside], kind='stable')
+        return candidates[inside][sorting], sq_dists[inside][sorting]
+
+
+class StepwiseSpatialIndex:
+    '''
+    Grid index of every step of a stepwise model for k-nearest and radius queries at any time
+    '''
+    def __init__(self, steps_z0:np.ndarray, v0:np.ndarray, start_times:np.ndarray, end_times:np.ndarray, nodes_per_cell:float=2.) -> None:
+        '''
+        :param steps_z0:        Positions at the start of every step of shape (N,2,S)
+        :param v0:              Velocities of every step of shape (N,2,S)
+        :param start_times:     Start times of the steps
+        :param end_times:       End times of the steps
+        :param nodes_per_cell:  Average number of nodes per grid cell
+        '''
+        self.start_times = np.asarray(start_times, dtype=np.float64)
+        self.end_times = np.asarray(end_times, dtype=np.float64)
+        self.step_start_times, self.step_end_times = torch.from_numpy(self.start_times), torch.from_numpy(self.end_times)
+        num_nodes = steps_z0.shape[0]
+        self.grids = []
+        for k in range(steps_z0.shape[2]):
+            extent = np.max(np.ptp(steps_z0[:,:,k], axis=0))
+            cell_size = max(extent / np.sqrt(num_nodes / nodes_per_cell), np.finfo(np.float64).eps)
+            self.grids.append(StepGrid(steps_z0[:,:,k], v0[:,:,k], cell_size))
+
+    def step_of(self, t:float):
+        k, offset = find_steps_and_offsets(torch.tensor([float(t)], dtype=torch.float64), self.step_start_times, self.step_end_times)
+        return self.grids[k.item()], offset.item()
+
+    def positions(self, t:float) -> np.ndarray:
+        grid, offset = self.step_of(t)
+        return grid.positions(offset)
+
+    def knn(self, node:int, t:float, k:int):
+        '''
+        k nearest nodes of a node at time t, which are its k most likely interaction partners
+        '''
+        grid, offset = self.step_of(t)
+        point = grid.start_positions[node] + grid.velocities[node]*offset
+        return grid.knn(point, offset, k, exclude=node)
+
+    def radius(self, node:int, t:float, radius:float):
+        '''
+        Nodes within a radius of a node at time t, i.e. with log intensity above beta - radius^2
+        '''
+        grid, offset = self.step_of(t)
+        point = grid.start_positions[node] + grid.velocities[node]*offset
+        return grid.radius(point, offset, radius, exclude=node)
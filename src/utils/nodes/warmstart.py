@@ -0,0 +1,121 @@
+import torch
+from utils.nodes.positions import find_steps
+
+
+def window_counts(src:torch.Tensor, dst:torch.Tensor, t:torch.Tensor, num_nodes:int, start_times:torch.Tensor) -> torch.Tensor:
+    '''
+    Number of events of every node pair in every step window
+
+    :param src:         Node i of every event
+    :param dst:         Node j of every event
+    :param t:           Time of every event
+    :param num_nodes:   Number of nodes N
+    :param start_times: Start times of the S windows
+
+    :returns:           Symmetric counts of shape (S,N,N)
+    '''
+    num_steps = len(start_times)
+    step = find_steps(t.double(), start_times.double())
+    i, j = src.long(), dst.long()
+    counts = torch.zeros(num_steps*num_nodes*num_nodes, dtype=torch.float64)
+    ones = torch.ones(len(t), dtype=torch.float64)
+    counts.index_add_(0, (step*num_nodes + i)*num_nodes + j, ones)
+    counts.index_add_(0, (step*num_nodes + j)*num_nodes + i, ones)
+    return counts.view(num_steps, num_nodes, num_nodes)
+
+
+def log_count_squared_distances(counts:torch.Tensor, pseudo_count:float=0.5) -> torch.Tensor:
+    '''
+    Squared latent distances implied by the counts. With the intensity exp(beta - d^2) the expected
+    count of a pair is proportional to exp(-d^2), so d^2 is the log count of the most active pair
+    minus the log count of the pair. The pseudo count keeps pairs without events at a finite distance.
+
+    :param counts:          Counts of shape (S,N,N)
+    :param pseudo_count:    Count added to every pair
+
+    :returns:               Squared distances of shape (S,N,N), on a common scale for all windows
+    '''
+    log_counts = torch.log(counts + pseudo_count)
+    sq_distances = torch.max(log_counts) - log_counts
+    sq_distances.diagonal(dim1=-2, dim2=-1).zero_()
+    return sq_distances
+
+
+def classical_mds(sq_distances:torch.Tensor, dim:int=2) -> torch.Tensor:
+    '''
+    Classical multidimensional scaling, the positions whose inner products best match the
+    double centered squared distances
+
+    :returns:   Centered positions of shape (N,dim)
+    '''
+    gram = -0.5*(sq_distances - sq_distances.mean(dim=0, keepdim=True) - sq_distances.mean(dim=1, keepdim=True) + sq_distances.mean())
+    eigenvalues, eigenvectors = torch.linalg.eigh(gram)
+    ## eigh sorts the eigenvalues ascending
+    return eigenvectors[:,-dim:].flip(1)*torch.sqrt(torch.clamp(eigenvalues[-dim:].flip(0), min=0.))
+
+
+def spectral_embedding(counts:torch.Tensor, sq_distances:torch.Tensor, dim:int=2, pseudo_count:float=0.5) -> torch.Tensor:
+    '''
+    Laplacian eigenmap of the counts as affinities, scaled by least squares to the squared distances
+
+    :returns:   Centered positions of shape (N,dim)
+    '''
+    affinity = counts + pseudo_count
+    affinity.fill_diagonal_(0.)
+    inv_sqrt_degree = 1. / torch.sqrt(torch.sum(affinity, dim=1))
+    normalized_affinity = inv_sqrt_degree.unsqueeze(1)*affinity*inv_sqrt_degree.unsqueeze(0)
+    ## The largest eigenvectors of the normalized affinity are the smallest of the normalized Laplacian, the first is trivial
+    _, eigenvectors = torch.linalg.eigh(normalized_affinity)
+    positions = eigenvectors[:,-dim-1:-1].flip(1)*inv_sqrt_degree.unsqueeze(1)
+    positions = positions - positions.mean(dim=0)
+
+    embedded_sq_distances = torch.sum(torch.square(positions.unsqueeze(0) - positions.unsqueeze(1)), dim=2)
+    scale = torch.sum(embedded_sq_distances*sq_distances) / torch.clamp(torch.sum(torch.square(embedded_sq_distances)), min=torch.finfo(positions.dtype).tiny)
+    return positions*torch.sqrt(torch.clamp(scale, min=0.))
+
+
+def procrustes_align(positions:torch.Tensor, reference:torch.Tensor) -> torch.Tensor:
+    '''
+    Rotates, and if needed reflects, centered positions onto centered reference positions.
+    Embeddings are only defined up to these, so consecutive windows are aligned before velocities are taken.
+    '''
+    u, _, vt = torch.linalg.svd(positions.T @ reference)
+    return positions @ (u @ vt)
+
+
+def warm_start_positions(src:torch.Tensor, dst:torch.Tensor, t:torch.Tensor, num_nodes:int,
+                            start_times:torch.Tensor, end_times:torch.Tensor, method:str='mds'):
+    '''
+    Initial positions and velocities of a stepwise model from the events.
+    The events are counted per pair in every step window, every window is embedded from its
+    log count distances and aligned to the previous window. The embedding of window k is the position at the
+    start of step k, and the velocity of a step moves the nodes to the start of the next step.
+    The last step keeps the velocity of the step before it.
+
+    :param src:         Node i of every event
+    :param dst:         Node j of every event
+    :param t:           Time of every event
+    :param num_nodes:   Number of nodes N
+    :param start_times: Start times of the S steps
+    :param end_times:   End times of the S steps
+    :param method:      'mds' for classical MDS or 'spectral' for a Laplacian eigenmap
+
+    :returns:           z0 of shape (N,2) and v0 of shape (N,2,S)
+    '''
+    if method not in ['mds', 'spectral']:
+        raise Exception(f'Unknown warm start method: {method}')
+    counts = window_counts(src.cpu(), dst.cpu(), t.cpu(), num_nodes, start_times.cpu())
+    sq_distances = log_count_squared_distances(counts)
+
+    windows = []
+    for k in range(len(counts)):
+        positions = classical_mds(sq_distances[k]) if method == 'mds' else spectral_embedding(counts[k], sq_distances[k])
+        windows.append(procrustes_align(positions, windows[-1]) if windows else positions)
+    windows = torch.stack(windows, dim=2)
+
+    step_sizes = (end_times - start_times).cpu().double()
+    v0 = torch.zeros_like(windows)
+    if windows.shape[2] > 1:
+        v0[:,:,:-1] = (windows[:,:,1:] - windows[:,:,:-1]) / step_sizes[:-1]
+        v0[:,:,-1] = v0[:,:,-2]
+    return windows[:,:,0], v0
@@ -9,9 +9,17 @@ from sklearn.metrics import accuracy_score
 import scipy.stats as stats
 import random
 from tqdm import tqdm
+from data.events import EventSet
 
 
 def remove_interactions(dataset, percentage, device):
+    if isinstance(dataset, EventSet):
+        ## The same draws per event as for the tensor layout, so both layouts remove the same events
+        removed = torch.tensor([random.random() <= percentage for _ in range(len(dataset))], dtype=torch.bool)
+        dataset_reduced, removed_interactions = dataset[~removed].to(device), dataset[removed].to(device)
+        print(f'Reduced training set by random selection, interactions: {len(dataset_reduced)}')
+        print(f'Removed number of interactions: {len(removed_interactions)}')
+        return dataset_reduced, removed_interactions
 
     dataset_reduced = []
     removed_interactions = []
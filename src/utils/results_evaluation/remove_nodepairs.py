@@ -2,6 +2,16 @@ import numpy as np
 import random
 random.seed(1)
 import torch
+from data.events import EventSet
+
+def __in_node_pairs(events:EventSet, node_pairs) -> torch.Tensor:
+    ## Whether the pair of every event is one of the node pairs, in either order
+    i, j = events.src.long(), events.dst.long()
+    event_keys = torch.min(i, j)*events.num_nodes + torch.max(i, j)
+    keys = torch.unique(torch.tensor([int(min(a, b))*events.num_nodes + int(max(a, b)) for a, b in node_pairs], dtype=torch.long))
+    position = torch.clamp(torch.searchsorted(keys, event_keys), max=len(keys)-1)
+    return keys[position] == event_keys
+
 
 def remove_node_pairs(dataset, num_nodes, percentage, device, node_pairs=None):
     
@@ -15,6 +25,11 @@ def remove_node_pairs(dataset, num_nodes, percentage, device, node_pairs=None):
     else:
         removed_node_pairs = node_pairs
         
+    if isinstance(dataset, EventSet):
+        dataset_reduced = dataset[~__in_node_pairs(dataset, removed_node_pairs)].to(device)
+        print(f'Removed node pairs: {removed_node_pairs}, training set now contains interactions: {len(dataset_reduced)}')
+        return dataset_reduced, removed_node_pairs
+
     dataset_reduced = []
     for tup in dataset.tolist():
         keep = True
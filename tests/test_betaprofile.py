@@ -0,0 +1,63 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+torch = pytest.importorskip('torch')
+
+from models.build import build_model
+from models.betaprofile import profile_beta, supports_beta_profile
+
+
+EVENTS = torch.tensor([[0, 1, 0.5], [1, 2, 2.], [0, 3, 4.5], [2, 4, 6.], [1, 4, 7.5], [0, 1, 9.5], [3, 4, 9.7]], dtype=torch.float64)
+
+
+def build(ensemble_size=1, vectorized=2):
+    torch.manual_seed(0)
+    if vectorized == 1:
+        return build_model(vectorized=1, num_nodes=5, model_beta=3., device='cpu',
+                            z0=(torch.rand(5, 2)*2).numpy(), v0=(torch.rand(5, 2) - 0.5).numpy())
+    return build_model(vectorized=2, num_nodes=5, model_beta=3., device='cpu', max_time=10., num_steps=3, ensemble_size=ensemble_size)
+
+
+@pytest.mark.parametrize('ensemble_size, vectorized', [(1, 2), (3, 2), (1, 1)])
+def test_profiled_beta_is_stationary(ensemble_size, vectorized):
+    model = build(ensemble_size, vectorized)
+    assert supports_beta_profile(model)
+    profile_beta(model, len(EVENTS), 0., 10.)
+    with torch.no_grad():
+        ## The expected number of events of every member equals the number of events
+        integral = model.integral(0., 10.)
+        assert torch.allclose(integral, torch.full_like(integral, float(len(EVENTS))), rtol=1e-5)
+    model.zero_grad()
+    model(EVENTS, t0=0., tn=10.).backward()
+    assert torch.allclose(model.beta.grad, torch.zeros_like(model.beta.grad), atol=1e-4)
+
+
+def test_profiled_beta_maximizes_the_likelihood():
+    model = build()
+    profile_beta(model, len(EVENTS), 0., 10.)
+    with torch.no_grad():
+        profiled = model(EVENTS, t0=0., tn=10.).item()
+        for delta in [-0.1, 0.1]:
+            model.beta.add_(delta)
+            assert model(EVENTS, t0=0., tn=10.).item() > profiled
+            model.beta.sub_(delta)
+
+
+def test_profile_with_reduce_uses_the_totals_of_all_processes():
+    ## Two processes with identical shards double both the integral and the events, which leaves beta unchanged
+    model, reduced = build(), build()
+    profile_beta(model, len(EVENTS), 0., 10.)
+    profile_beta(reduced, len(EVENTS), 0., 10., reduce=lambda tensor: 2*tensor)
+    assert torch.allclose(reduced.beta, model.beta)
+
+
+def test_profile_without_events_keeps_beta():
+    model = build()
+    beta = model.beta.detach().clone()
+    profile_beta(model, 0, 0., 10.)
+    assert torch.equal(model.beta, beta)
+
+
+def test_models_with_a_beta_per_step_are_not_profiled():
+    model = build_model(vectorized=2, num_nodes=5, model_beta=np.array([1., 2., 3.]), device='cpu', max_time=10., num_steps=3)
+    assert not supports_beta_profile(model)
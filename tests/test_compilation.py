@@ -0,0 +1,61 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from utils.compute import compilation
+from utils.integrals import analytical
+from utils.integrals.analytical import pairwise_integral
+from utils.nodes.distances import vec_squared_euclidean_dist
+from models.constantvelocity.stepwise import step_positions
+
+
+@pytest.fixture
+def torchscript_kernels(monkeypatch):
+    ## Without torch.compile, as in torch 1.9, the kernels are compiled with TorchScript
+    monkeypatch.delattr(torch, 'compile', raising=False)
+    monkeypatch.setitem(compilation._state, 'compiled', {})
+    compilation.enable_compiled_kernels(True)
+    yield compilation._state['compiled']
+    compilation.enable_compiled_kernels(False)
+
+
+def integral_inputs():
+    ## Far apart, slowly moving, crossing and nearly static pairs in float32
+    torch.manual_seed(0)
+    a, b = torch.randn(2, 200)*torch.tensor([0.1, 1., 5., 30.]).repeat_interleave(50)
+    m, n = torch.randn(2, 200)*torch.tensor([0., 1e-6, 1e-2, 2.]).repeat(50)
+    return a, b, m, n, torch.tensor(1.5)
+
+
+def test_integral_kernel_runs_as_torchscript(torchscript_kernels):
+    a, b, m, n, beta = integral_inputs()
+    compilation.enable_compiled_kernels(False)
+    eager = pairwise_integral(0.5, 3., a, b, m, n, beta)
+    compilation.enable_compiled_kernels(True)
+    scripted = pairwise_integral(0.5, 3., a, b, m, n, beta)
+
+    kernel = analytical.__dict__['__pairwise_integral_kernel']
+    assert isinstance(torchscript_kernels[kernel.eager], torch.jit.ScriptFunction)
+    assert torch.all(torch.isfinite(scripted))
+    assert torch.allclose(scripted, eager, rtol=1e-4, atol=1e-30)
+
+
+def test_position_and_distance_kernels_run_as_torchscript(torchscript_kernels):
+    torch.manual_seed(0)
+    z0, v0 = torch.rand(5, 2), torch.rand(5, 2, 3)
+    times, start_times = torch.tensor([0., 0.7, 1.5, 3.]), torch.tensor([0., 1., 2.])
+    positions = step_positions(z0, v0, times, start_times, torch.tensor(1.))
+    distances = vec_squared_euclidean_dist(positions)
+
+    for kernel in [step_positions, vec_squared_euclidean_dist]:
+        assert isinstance(torchscript_kernels[kernel.eager], torch.jit.ScriptFunction)
+    assert torch.allclose(positions, step_positions.eager(z0, v0, times, start_times, torch.tensor(1.)))
+    assert torch.allclose(distances, vec_squared_euclidean_dist.eager(positions))
+
+
+def test_erfcx_fallback_matches_the_native_erfcx(monkeypatch):
+    a, b, m, n, beta = integral_inputs()
+    native = pairwise_integral(0.5, 3., a, b, m, n, beta)
+    monkeypatch.setattr(analytical, '_NATIVE_ERFCX', False)
+    fallback = pairwise_integral(0.5, 3., a, b, m, n, beta)
+    assert torch.allclose(fallback, native, rtol=1e-5, atol=1e-30)
@@ -0,0 +1,79 @@
+import os
+import socket
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('ignite')
+import torch.multiprocessing as mp
+
+from models.build import build_model
+from traintestgyms.ignitegym import TrainTestGym
+from traintestgyms.locallogger import LocalRunLogger
+from utils.compute.distributed import init_process_group, shard_events
+
+NUM_NODES = 6
+NUM_EPOCHS = 5
+WORLD_SIZE = 2
+
+
+def make_events(num_events:int, seed:int) -> torch.Tensor:
+    ## Random time ordered events between distinct nodes
+    generator = torch.Generator().manual_seed(seed)
+    i = torch.randint(0, NUM_NODES, (num_events,), generator=generator)
+    j = (i + torch.randint(1, NUM_NODES, (num_events,), generator=generator)) % NUM_NODES
+    t = torch.sort(torch.rand(num_events, generator=generator, dtype=torch.float64)*10.).values
+    return torch.stack([torch.min(i, j).double(), torch.max(i, j).double(), t], dim=1)
+
+
+def train_gym(output_dir:str, beta_update, rank:int=0, world_size:int=1) -> dict:
+    '''
+    Trains the SCVM with the gym, on the shard of the rank when distributed
+
+    :returns:   The average train loss of every epoch and the final parameters
+    '''
+    dataset, validation_data = make_events(300, seed=1), make_events(30, seed=2)
+    torch.manual_seed(0)
+    model = build_model(vectorized=2, num_nodes=NUM_NODES, model_beta=1., device='cpu', max_time=dataset[-1,2].item(),
+                        num_steps=2, velocity_gamma_regularization=0.1)
+    if world_size > 1:
+        model.shard_pairs(rank, world_size)
+        dataset = shard_events(dataset, NUM_NODES, rank, world_size)
+        validation_data = shard_events(validation_data, NUM_NODES, rank, world_size)
+    model.beta.requires_grad = beta_update is None
+    metrics = {'avg_train_loss': [], 'beta_est': []}
+    gym = TrainTestGym(dataset=dataset, model=model, device='cpu', batch_size=len(dataset),
+                        optimizer=torch.optim.Adam(model.parameters(), lr=0.025), metrics=metrics, time_column_idx=2,
+                        wandb_handler=LocalRunLogger(os.path.join(output_dir, f'rank{rank}')),
+                        num_dyads=NUM_NODES*(NUM_NODES-1)/2, keep_rotation=False, beta_update=beta_update,
+                        patience=NUM_EPOCHS, validation_data=validation_data, validation_fraction=0.1,
+                        distributed=world_size > 1)
+    gym.train_test_model(epochs=NUM_EPOCHS)
+    return {'losses': metrics['avg_train_loss'], 'state': {key: value.detach().clone() for key, value in model.state_dict().items()}}
+
+
+def run_rank(rank:int, world_size:int, port:int, output_dir:str, beta_update) -> None:
+    torch.set_num_threads(1)
+    init_process_group(rank, world_size, port=port)
+    try:
+        result = train_gym(output_dir, beta_update, rank=rank, world_size=world_size)
+        torch.save(result, os.path.join(output_dir, f'result_rank{rank}.pt'))
+    finally:
+        torch.distributed.destroy_process_group()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.parametrize('beta_update', [None, 'epoch'])
+def test_distributed_training_matches_a_single_process(tmp_path, beta_update):
+    single = train_gym(str(tmp_path / 'single'), beta_update)
+    mp.spawn(run_rank, args=(WORLD_SIZE, free_port(), str(tmp_path), beta_update), nprocs=WORLD_SIZE)
+
+    for rank in range(WORLD_SIZE):
+        distributed = torch.load(tmp_path / f'result_rank{rank}.pt')
+        assert distributed['losses'] == pytest.approx(single['losses'], rel=1e-4)
+        for key, value in single['state'].items():
+            assert torch.allclose(distributed['state'][key], value, rtol=1e-4, atol=1e-5), f'{key} differs on rank {rank}'
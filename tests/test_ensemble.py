@@ -0,0 +1,56 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from data.events import EventSet
+from models.build import build_model
+
+
+EVENTS = torch.tensor([[0, 1, 0.], [1, 2, 2.], [0, 3, 5.], [2, 4, 6.5], [1, 4, 8.], [0, 1, 10.]], dtype=torch.float64)
+
+
+def make_ensemble(gamma=None):
+    torch.manual_seed(0)
+    return build_model(vectorized=2, num_nodes=5, model_beta=0.5, device='cpu', max_time=10., num_steps=3,
+                        velocity_gamma_regularization=gamma, ensemble_size=3)
+
+
+@pytest.mark.parametrize('gamma', [None, 2.])
+@pytest.mark.parametrize('prepared', [False, True])
+def test_member_losses_are_the_losses_of_standalone_members(gamma, prepared):
+    ensemble = make_ensemble(gamma)
+    data = EVENTS
+    if prepared:
+        data = EventSet.from_tensor(EVENTS, num_nodes=5).prepare('cpu', start_times=ensemble.start_times, end_times=ensemble.end_times)
+    loss = ensemble(data, t0=0., tn=10.)
+    assert loss.item() == pytest.approx(torch.sum(ensemble.member_losses).item(), rel=1e-6)
+    for k in range(ensemble.num_members):
+        member = ensemble.member(k)
+        assert ensemble.member_losses[k].item() == pytest.approx(member(data, t0=0., tn=10.).item(), rel=1e-5)
+
+
+def test_member_integrals_are_the_integrals_of_standalone_members():
+    ensemble = make_ensemble()
+    integrals = ensemble.integral(0., 10.)
+    for k in range(ensemble.num_members):
+        assert integrals[k].item() == pytest.approx(ensemble.member(k).integral(0., 10.).item(), rel=1e-5)
+
+
+def test_member_gradients_are_the_gradients_of_standalone_members():
+    ## The loss is the sum of the member losses, so the gradient of a member only depends on the member
+    ensemble = make_ensemble(gamma=2.)
+    ensemble(EVENTS, t0=0., tn=10.).backward()
+    for k in range(ensemble.num_members):
+        member = ensemble.member(k)
+        member(EVENTS, t0=0., tn=10.).backward()
+        assert torch.allclose(ensemble.z0.grad[k], member.z0.grad, rtol=1e-4, atol=1e-5)
+        assert torch.allclose(ensemble.v0.grad[k], member.v0.grad, rtol=1e-4, atol=1e-5)
+        assert torch.allclose(ensemble.beta.grad[k].view(-1), member.beta.grad.view(-1), rtol=1e-4, atol=1e-5)
+
+
+def test_member_positions_are_the_positions_of_standalone_members():
+    ensemble = make_ensemble()
+    times = torch.tensor([0., 1., 3.4, 5., 9.9, 10.])
+    positions = ensemble.steps(times)
+    for k in range(ensemble.num_members):
+        assert torch.allclose(positions[k], ensemble.member(k).steps(times), atol=1e-6)
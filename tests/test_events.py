@@ -0,0 +1,72 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from data.events import EventSet, EventBatches, StepStatistics
+from models.build import build_model
+
+
+## Events at the start and end of the training window, on step boundaries and repeated within a step
+EVENTS = torch.tensor([[0, 1, 0.], [1, 2, 2.], [1, 2, 2.], [0, 3, 2.5], [0, 3, 3.1], [2, 4, 5.],
+                        [1, 4, 6.5], [1, 4, 7.5], [0, 1, 10.]], dtype=torch.float64)
+
+
+def make_model(gamma=None, checkpoint_segments=None):
+    torch.manual_seed(0)
+    return build_model(vectorized=2, num_nodes=5, model_beta=0.5, device='cpu', max_time=10., num_steps=4,
+                        velocity_gamma_regularization=gamma, checkpoint_segments=checkpoint_segments)
+
+
+def loss_and_gradients(model, data):
+    model.zero_grad()
+    loss = model(data, t0=0., tn=10.)
+    loss.backward()
+    return loss.detach(), [p.grad.clone() for p in model.parameters()]
+
+
+@pytest.mark.parametrize('gamma, checkpoint_segments', [(None, None), (2., None), (None, ['event', 'integral'])])
+def test_statistics_path_matches_the_per_event_path(gamma, checkpoint_segments):
+    model = make_model(gamma, checkpoint_segments)
+    prepared = EventSet.from_tensor(EVENTS, num_nodes=5).prepare('cpu', start_times=model.start_times, end_times=model.end_times)
+    assert prepared.num_steps == model.num_of_steps
+    statistics_loss, statistics_grads = loss_and_gradients(model, prepared)
+    event_loss, event_grads = loss_and_gradients(model, EVENTS)
+    assert statistics_loss.item() == pytest.approx(event_loss.item(), rel=1e-5)
+    for statistics_grad, event_grad in zip(statistics_grads, event_grads):
+        assert torch.allclose(statistics_grad, event_grad, rtol=1e-4, atol=1e-5)
+
+
+def test_events_prepared_for_other_steps_take_the_per_event_path():
+    model = make_model()
+    other = EventSet.from_tensor(EVENTS, num_nodes=5).prepare('cpu', start_times=torch.tensor([0., 5.]), end_times=torch.tensor([5., 10.]))
+    unprepared = EventSet.from_tensor(EVENTS, num_nodes=5).prepare('cpu')
+    with torch.no_grad():
+        expected = model(EVENTS, t0=0., tn=10.).item()
+        assert model(other, t0=0., tn=10.).item() == pytest.approx(expected, rel=1e-6)
+        assert model(unprepared, t0=0., tn=10.).item() == pytest.approx(expected, rel=1e-6)
+
+
+def test_statistics_sum_the_events_of_every_pair_and_step():
+    model = make_model()
+    events = EventSet.from_tensor(EVENTS, num_nodes=5)
+    statistics = events.prepare('cpu', start_times=model.start_times, end_times=model.end_times).step_statistics
+    assert torch.sum(statistics.count).item() == len(events)
+    ## Every event lands in the step whose interval contains it, the last time in the last step
+    with torch.no_grad():
+        Zt = model.steps(events.t.float())
+        event_idx = torch.arange(len(events))
+        squared_distances = torch.sum(torch.square(Zt[events.src.long(),:,event_idx] - Zt[events.dst.long(),:,event_idx]), dim=1)
+        assert torch.sum(statistics.squared_distance_sum(model.steps_z0(), model.v0)).item() == pytest.approx(torch.sum(squared_distances).item(), rel=1e-5)
+
+
+def test_batches_prepare_the_statistics_of_every_batch():
+    model = make_model()
+    batches = EventBatches(EventSet.from_tensor(EVENTS, num_nodes=5), batch_size=4)
+    batches.prepare('cpu', start_times=model.start_times, end_times=model.end_times)
+    assert len(batches) == 3
+    with torch.no_grad():
+        batch_event_terms = sum(model(batch, t0=0., tn=10.).item() - model.integral(0., 10.).item() for batch in batches)
+        event_term = model(EVENTS, t0=0., tn=10.).item() - model.integral(0., 10.).item()
+    ## The integral is subtracted from float32 losses, so only absolute differences are meaningful
+    assert batch_event_terms == pytest.approx(event_term, abs=1e-3)
+    assert all(isinstance(batch.step_statistics, StepStatistics) for batch in batches)
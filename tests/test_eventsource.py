@@ -0,0 +1,69 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+torch = pytest.importorskip('torch')
+
+from data.eventsource import EventSource, ShardedEventSource, MemmapEventSource, last_line
+
+
+def write_shards(directory, events:np.ndarray, num_shards:int) -> list:
+    ## Alternating csv and npy shards of consecutive events, the csv shards end with blank lines
+    paths = []
+    for k, shard in enumerate(np.array_split(events, num_shards)):
+        if k % 2 == 0:
+            path = directory / f'shard{k}.csv'
+            path.write_text(''.join(f'{int(i)},{int(j)},{t:.17g}\n' for i, j, t in shard) + '\n\n')
+        else:
+            path = directory / f'shard{k}.npy'
+            np.save(path, shard)
+        paths.append(str(path))
+    return paths
+
+
+def make_events(num_events:int) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    return np.stack([rng.integers(0, 5, num_events), rng.integers(5, 10, num_events), np.sort(rng.random(num_events))*100], axis=1)
+
+
+def test_event_source_is_abstract():
+    with pytest.raises(TypeError):
+        EventSource(chunk_size=10)
+
+
+def test_sharded_source_streams_csv_shards_in_chunks(tmp_path, monkeypatch):
+    events = make_events(103)
+    paths = write_shards(tmp_path, events, num_shards=3)
+    source = ShardedEventSource(paths, chunk_size=8)
+    assert source.num_events == 103
+    assert source.last_time == events[-1,2]
+
+    ## No more than chunk_size csv lines are parsed at once
+    genfromtxt, parsed_lines = np.genfromtxt, []
+    def recording_genfromtxt(lines, *args, **kwargs):
+        parsed_lines.append(len(lines))
+        return genfromtxt(lines, *args, **kwargs)
+    monkeypatch.setattr(np, 'genfromtxt', recording_genfromtxt)
+    chunks = list(source)
+    assert max(parsed_lines) <= 8
+    assert len(chunks) == len(source)
+    assert all(len(chunk) <= 8 for chunk in chunks)
+
+    assert torch.equal(torch.cat([chunk.events for chunk in chunks]), torch.from_numpy(events))
+    ## The windows of consecutive chunks are contiguous
+    assert chunks[0].t0 == 0.
+    assert all(previous.tn == chunk.t0 for previous, chunk in zip(chunks, chunks[1:]))
+
+
+def test_last_line_skips_trailing_blank_lines(tmp_path):
+    path = tmp_path / 'events.csv'
+    path.write_text('0,1,0.5\n' + '1,2,1.5\n'*2000 + '2,3,2.5\n\n \n')
+    assert last_line(str(path), block_size=16) == '2,3,2.5'
+
+
+def test_unordered_events_inside_a_chunk_are_rejected(tmp_path):
+    events = make_events(20)
+    events[[5, 6],2] = events[[6, 5],2]
+    path = tmp_path / 'events.npy'
+    np.save(path, events)
+    with pytest.raises(Exception, match='not time ordered'):
+        list(MemmapEventSource(str(path), chunk_size=10))
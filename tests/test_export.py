@@ -0,0 +1,67 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+torch = pytest.importorskip('torch')
+
+from models.scoring import StepwiseScorer
+from export import expected_counts, save_expected_counts
+
+
+BIN_EDGES = np.array([0., 1.5, 4., 5., 9.5, 12.])
+
+
+def make_scorer(num_nodes=8):
+    torch.manual_seed(0)
+    return StepwiseScorer(z0=torch.rand(num_nodes, 2)*3, v0=torch.rand(num_nodes, 2, 3) - 0.5, beta=torch.tensor([[0.5]]), max_time=10.)
+
+
+@pytest.mark.parametrize('max_elements', [1, 50, 2**22])
+def test_expected_counts_are_the_scorer_counts_of_every_pair_and_bin(max_elements):
+    scorer = make_scorer()
+    counts = expected_counts(scorer, BIN_EDGES, threshold=0., max_elements=max_elements)
+    num_pairs, num_bins = 8*7//2, len(BIN_EDGES) - 1
+    assert len(counts['expected_count']) == num_pairs*num_bins
+    assert np.all(counts['i'] < counts['j'])
+    expected = scorer.expected_count(counts['i'], counts['j'], BIN_EDGES[counts['bin']], BIN_EDGES[counts['bin']+1])
+    assert np.allclose(counts['expected_count'], expected.numpy(), rtol=1e-12)
+    ## The bins partition the window, so the counts of a pair sum to its count over the window
+    window_counts = scorer.expected_count([2], [5], [BIN_EDGES[0]], [BIN_EDGES[-1]]).item()
+    pair = (counts['i'] == 2) & (counts['j'] == 5)
+    assert np.sum(counts['expected_count'][pair]) == pytest.approx(window_counts, rel=1e-9)
+
+
+def test_expected_counts_keep_the_given_pairs_above_the_threshold():
+    scorer = make_scorer()
+    pairs = np.array([[0, 1], [3, 6], [2, 7]])
+    all_counts = expected_counts(scorer, BIN_EDGES, pairs=pairs, threshold=0.)
+    threshold = np.median(all_counts['expected_count'])
+    counts = expected_counts(scorer, BIN_EDGES, pairs=pairs, threshold=threshold)
+    above = all_counts['expected_count'] > threshold
+    for key in ['i', 'j', 'bin', 'expected_count']:
+        assert np.array_equal(counts[key], all_counts[key][above])
+
+
+def test_no_kept_counts_give_empty_integer_columns(tmp_path):
+    scorer = make_scorer()
+    counts = expected_counts(scorer, BIN_EDGES, threshold=np.inf)
+    assert all(len(values) == 0 for values in counts.values())
+    assert counts['i'].dtype == counts['j'].dtype == counts['bin'].dtype == np.int64
+    save_expected_counts(str(tmp_path / 'counts.csv'), counts, BIN_EDGES, scorer.num_of_nodes)
+    assert (tmp_path / 'counts.csv').read_text().strip() == 'node_i,node_j,bin,bin_start,bin_end,expected_count'
+
+
+def test_saved_counts_round_trip(tmp_path):
+    scorer = make_scorer()
+    counts = expected_counts(scorer, BIN_EDGES, threshold=1e-3)
+    save_expected_counts(str(tmp_path / 'counts.npz'), counts, BIN_EDGES, scorer.num_of_nodes)
+    save_expected_counts(str(tmp_path / 'counts.csv'), counts, BIN_EDGES, scorer.num_of_nodes)
+
+    saved = np.load(tmp_path / 'counts.npz')
+    assert np.array_equal(saved['node_i'], counts['i']) and np.array_equal(saved['bin'], counts['bin'])
+    assert np.array_equal(saved['expected_count'], counts['expected_count'])
+    assert np.array_equal(saved['bin_edges'], BIN_EDGES) and saved['num_nodes'] == 8
+
+    table = np.genfromtxt(tmp_path / 'counts.csv', delimiter=',', skip_header=1, ndmin=2)
+    assert np.array_equal(table[:,2].astype(np.int64), counts['bin'])
+    assert np.array_equal(table[:,3], BIN_EDGES[counts['bin']]) and np.array_equal(table[:,4], BIN_EDGES[counts['bin']+1])
+    assert np.allclose(table[:,5], counts['expected_count'], rtol=1e-9)
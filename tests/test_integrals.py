@@ -0,0 +1,176 @@
+import math
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from utils.integrals.analytical import pairwise_integral, vec_analytical_integral, pruned_integral_sum, tiled_integral_sum
+from data.events import EventSet
+from models.build import build_model
+
+
+def quadrature(t0:float, tn:float, a, b, m, n, beta:float, num_points:int=20001) -> torch.Tensor:
+    ## Trapezoidal rule in float64 on a fine grid
+    t = torch.linspace(t0, tn, num_points, dtype=torch.float64)
+    sq_dist = torch.square(a.double().unsqueeze(1) + m.double().unsqueeze(1)*t) + torch.square(b.double().unsqueeze(1) + n.double().unsqueeze(1)*t)
+    return torch.trapz(torch.exp(beta - sq_dist), t, dim=1)
+
+
+def pair_grid(dtype=torch.float32):
+    ## Near, far and very far pairs, with fast, slow and static relative velocities, crossing or not
+    distances = torch.tensor([0.05, 1., 3., 6., 9.])
+    speeds = torch.tensor([0., 1e-7, 1e-4, 1e-2, 0.3, 2.])
+    angles = torch.tensor([0., 2., math.pi])
+    d, s, angle = torch.meshgrid(distances, speeds, angles, indexing='ij')
+    d, s, angle = d.flatten(), s.flatten(), angle.flatten()
+    ## The velocity points back at the other node for angle pi, so the pair crosses its closest approach
+    a, b = d*0.8, d*0.6
+    m, n = s*(0.8*torch.cos(angle) - 0.6*torch.sin(angle)), s*(0.6*torch.cos(angle) + 0.8*torch.sin(angle))
+    return [x.to(dtype) for x in (a, b, m, n)]
+
+
+@pytest.mark.parametrize('t0, tn', [(0., 1.), (2., 7.5)])
+def test_closed_form_matches_quadrature_in_float32(t0, tn):
+    a, b, m, n = pair_grid()
+    beta = 1.5
+    integrals = pairwise_integral(t0, tn, a, b, m, n, torch.tensor(beta))
+    reference = quadrature(t0, tn, a, b, m, n, beta)
+
+    assert integrals.dtype == torch.float32
+    assert torch.all(torch.isfinite(integrals))
+    representable = reference > 1e-30
+    assert torch.allclose(integrals.double()[representable], reference[representable], rtol=1e-4, atol=0.)
+    assert torch.all(integrals.double()[~representable] <= 1e-30)
+
+
+def test_static_pairs_reduce_to_the_constant_intensity():
+    a, b = torch.tensor([0.5, 2., 7.]), torch.tensor([0.1, -1., 3.])
+    zeros = torch.zeros(3)
+    integrals = pairwise_integral(1., 4., a, b, zeros, zeros, torch.tensor(0.5))
+    assert torch.allclose(integrals, torch.exp(0.5 - a**2 - b**2)*3., rtol=1e-6, atol=0.)
+
+
+def test_gradients_stay_finite_in_float32():
+    a, b, m, n = [x.requires_grad_() for x in pair_grid()]
+    beta = torch.tensor(1.5, requires_grad=True)
+    torch.sum(pairwise_integral(0., 10., a, b, m, n, beta)).backward()
+    for x in [a, b, m, n, beta]:
+        assert torch.all(torch.isfinite(x.grad))
+
+
+def test_vectorized_integral_is_the_pairwise_integral_of_all_pairs():
+    torch.manual_seed(0)
+    z0, v0 = torch.rand(4, 2, 3)*4, torch.rand(4, 2, 3)
+    integrals = vec_analytical_integral(0., 2., z0=z0, v0=v0, beta=torch.tensor(1.))
+    i, j = 1, 3
+    dz, dv = z0[i] - z0[j], v0[i] - v0[j]
+    assert torch.allclose(integrals[i,j], pairwise_integral(0., 2., dz[0], dz[1], dv[0], dv[1], torch.tensor(1.)))
+    assert torch.allclose(integrals, integrals.transpose(0, 1))
+
+
+def test_torch_module_is_not_patched():
+    import main
+    import models.build
+    assert not hasattr(torch, 'eps')
+
+
+def spread_positions(num_nodes:int=12, num_steps:int=3):
+    ## Positions from near to far apart, so pruning skips some but not all pairs
+    torch.manual_seed(1)
+    z0 = torch.rand(num_nodes, 2, num_steps)*torch.linspace(0.5, 6., num_nodes).view(-1, 1, 1)
+    v0 = (torch.rand(num_nodes, 2, num_steps) - 0.5)*0.4
+    return z0, v0
+
+
+def dense_integral_sum(t0, tn, z0, v0, beta):
+    integrals = vec_analytical_integral(t0, tn, z0=z0, v0=v0, beta=beta)
+    return torch.sum(torch.sum(integrals.reshape(integrals.shape[0], integrals.shape[1], -1), dim=2).triu(diagonal=1))
+
+
+@pytest.mark.parametrize('threshold', [1e-6, 1e-3, 1e-1])
+def test_pruned_integral_is_bounded_by_the_neglected_mass(threshold):
+    z0, v0 = spread_positions()
+    beta = torch.tensor([[1.]])
+    dense = dense_integral_sum(0., 2., z0, v0, beta)
+    pruned, neglected = pruned_integral_sum(0., 2., z0, v0, beta, threshold)
+    assert neglected > 0
+    assert pruned <= dense
+    assert dense <= (pruned + neglected)*(1 + 1e-6)
+
+
+def test_pruning_below_every_bound_keeps_all_pairs():
+    z0, v0 = spread_positions()
+    beta = torch.tensor([[1.]])
+    pruned, neglected = pruned_integral_sum(0., 2., z0, v0, beta, threshold=1e-30)
+    assert neglected == 0
+    assert torch.allclose(pruned, dense_integral_sum(0., 2., z0, v0, beta), rtol=1e-6)
+
+
+def test_pruned_model_loss_is_within_the_neglected_mass():
+    data = torch.tensor([[0, 1, 0.5], [1, 2, 2.], [0, 3, 4.5], [2, 5, 6.], [4, 7, 9.5]], dtype=torch.float64)
+    losses = []
+    for prune_threshold in [None, 1e-2]:
+        torch.manual_seed(0)
+        model = build_model(vectorized=2, num_nodes=8, model_beta=1., device='cpu', max_time=10., num_steps=3,
+                            prune_threshold=prune_threshold)
+        with torch.no_grad():
+            model.z0.mul_(torch.linspace(1., 8., 8).view(-1, 1))
+            losses.append(model(data, t0=0., tn=10.).item())
+    dense_loss, pruned_loss = losses
+    assert model.neglected_mass > 0
+    ## Skipped integrals only lower the negative log likelihood, by at most the neglected mass
+    assert dense_loss - model.neglected_mass.item() - 1e-3 <= pruned_loss <= dense_loss + 1e-3
+
+
+def loss_and_gradients(model, data):
+    model.zero_grad()
+    loss = model(data, t0=0., tn=10.)
+    loss.backward()
+    return loss.detach(), [p.grad.clone() for p in model.parameters()]
+
+
+EVENTS = torch.tensor([[0, 1, 0.5], [1, 2, 2.], [0, 3, 4.5], [2, 5, 6.], [4, 6, 9.5], [3, 6, 9.5]], dtype=torch.float64)
+
+
+@pytest.mark.parametrize('block_size', [1, 3, 7, 16])
+def test_tiled_integral_matches_the_dense_integral(block_size):
+    results = []
+    ## The checkpointed blocks only support backward, not torch.autograd.grad
+    for integral_sum in [dense_integral_sum, lambda *args: tiled_integral_sum(*args, block_size=block_size)]:
+        z0, v0 = [x.requires_grad_() for x in spread_positions(num_nodes=7)]
+        beta = torch.tensor([[1.]], requires_grad=True)
+        integral = integral_sum(0., 2., z0, v0, beta)
+        integral.backward()
+        results.append((integral.detach(), [z0.grad, v0.grad, beta.grad]))
+    (dense, dense_grads), (tiled, tiled_grads) = results
+    assert torch.allclose(tiled, dense, rtol=1e-5)
+    for tiled_grad, dense_grad in zip(tiled_grads, dense_grads):
+        assert torch.allclose(tiled_grad, dense_grad, rtol=1e-4, atol=1e-6)
+
+
+@pytest.mark.parametrize('prepared', [False, True])
+def test_tiled_stepwise_model_matches_the_dense_model(prepared):
+    results = []
+    for block_size in [None, 3]:
+        torch.manual_seed(0)
+        model = build_model(vectorized=2, num_nodes=7, model_beta=1., device='cpu', max_time=10., num_steps=3, block_size=block_size)
+        ## Prepared for other steps, the event set takes the per-event path of the model
+        data = EventSet.from_tensor(EVENTS, num_nodes=7).prepare('cpu') if prepared else EVENTS
+        results.append(loss_and_gradients(model, data))
+    (dense_loss, dense_grads), (tiled_loss, tiled_grads) = results
+    assert torch.allclose(tiled_loss, dense_loss, rtol=1e-5)
+    for tiled_grad, dense_grad in zip(tiled_grads, dense_grads):
+        assert torch.allclose(tiled_grad, dense_grad, rtol=1e-4, atol=1e-5)
+
+
+def test_tiled_vectorized_model_matches_the_dense_model():
+    torch.manual_seed(0)
+    z0, v0 = (torch.rand(7, 2)*3).numpy(), (torch.rand(7, 2) - 0.5).numpy()
+    data = EventSet.from_tensor(EVENTS, num_nodes=7).prepare('cpu')
+    results = []
+    for block_size in [None, 3]:
+        model = build_model(vectorized=1, num_nodes=7, model_beta=1., device='cpu', z0=z0, v0=v0, block_size=block_size)
+        results.append(loss_and_gradients(model, data))
+    (dense_loss, dense_grads), (tiled_loss, tiled_grads) = results
+    assert torch.allclose(tiled_loss, dense_loss, rtol=1e-5)
+    for tiled_grad, dense_grad in zip(tiled_grads, dense_grads):
+        assert torch.allclose(tiled_grad, dense_grad, rtol=1e-4, atol=1e-5)
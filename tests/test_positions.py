@@ -0,0 +1,14 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from utils.nodes.positions import find_steps, find_steps_and_offsets
+
+
+def test_a_time_at_the_end_of_a_step_belongs_to_that_step():
+    start_times, end_times = torch.tensor([0., 2., 4.], dtype=torch.float64), torch.tensor([2., 4., 6.], dtype=torch.float64)
+    t = torch.tensor([-1., 0., 1., 2., 2.5, 4., 6., 7.], dtype=torch.float64)
+    step_index, step_offset = find_steps_and_offsets(t, start_times, end_times)
+    assert step_index.tolist() == [0, 0, 0, 0, 1, 1, 2, 2]
+    assert step_offset.tolist() == [0., 0., 1., 2., 0.5, 2., 2., 2.]
+    assert torch.equal(find_steps(t, start_times), step_index)
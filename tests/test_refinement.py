@@ -0,0 +1,75 @@
+import argparse
+import pytest
+
+torch = pytest.importorskip('torch')
+
+pytest.importorskip('ignite')
+
+from models.build import build_model
+from traintestgyms.ignitegym import TrainTestGym
+from traintestgyms.locallogger import LocalRunLogger
+
+
+EVENTS = torch.tensor([[0, 1, 0.5], [1, 2, 2.], [0, 3, 3.], [2, 3, 4.5], [0, 2, 6.], [1, 3, 8.], [0, 1, 9.5]], dtype=torch.float64)
+TIMES = torch.tensor([0., 1.2, 2.5, 3.7, 5., 6.1, 8.75, 10.])
+
+
+def make_model(num_steps=2, gamma=None):
+    torch.manual_seed(0)
+    return build_model(vectorized=2, num_nodes=4, model_beta=1., device='cpu', max_time=10., num_steps=num_steps,
+                        velocity_gamma_regularization=gamma)
+
+
+def make_gym(model, tmp_path):
+    return TrainTestGym(dataset=EVENTS, model=model, device='cpu', batch_size=4,
+                        optimizer=torch.optim.Adam(model.parameters(), lr=0.01), metrics={'avg_train_loss': [], 'beta_est': []},
+                        time_column_idx=2, wandb_handler=LocalRunLogger(str(tmp_path)), num_dyads=6, keep_rotation=False)
+
+
+def test_split_steps_keeps_the_trajectories_and_the_likelihood():
+    model = make_model(gamma=3.)
+    with torch.no_grad():
+        positions = model.steps(TIMES)
+        ## The model integrates every step over [0, step size], which covers every step once
+        integral = model.integral(0., model.step_size).item()
+        event_term = model(EVENTS, t0=0., tn=10.).item() - model.integral(0., 10.).item()
+        penalty = model.penalty().item()
+        model.split_steps()
+        assert model.num_of_steps == 4 and model.v0.shape == (4, 2, 4)
+        assert model.end_times[-1].item() == 10.
+        assert torch.allclose(model.steps(TIMES), positions, atol=1e-5)
+        assert model.integral(0., model.step_size).item() == pytest.approx(integral, rel=1e-5)
+        assert model(EVENTS, t0=0., tn=10.).item() - model.integral(0., 10.).item() == pytest.approx(event_term, abs=1e-3)
+        ## Both halves of a step have the same velocity, so the penalty of the velocity changes is kept
+        assert model.penalty().item() == pytest.approx(penalty, rel=1e-5)
+
+
+def test_refine_steps_continues_the_optimizer_state(tmp_path):
+    model = make_model()
+    gym = make_gym(model, tmp_path)
+    gym.train_test_model(epochs=1)
+    old_v0 = model.v0
+    old_state = {key: value.clone() for key, value in gym.optimizer.state[old_v0].items()}
+
+    gym.refine_steps()
+    assert model.num_of_steps == 4
+    assert any(parameter is model.v0 for parameter in gym.optimizer.param_groups[0]['params'])
+    assert old_v0 not in gym.optimizer.state
+    state = gym.optimizer.state[model.v0]
+    for key in ['exp_avg', 'exp_avg_sq']:
+        assert torch.equal(state[key], old_state[key].repeat_interleave(2, dim=2))
+    assert torch.equal(state['step'], old_state['step'])
+    assert all(batch.num_steps == 4 for batch in gym.train_loader)
+
+    gym.train_test_model(epochs=1)
+    assert model.v0.grad is not None and model.v0.grad.shape == (4, 2, 4)
+
+
+def test_coarse_to_fine_training_reaches_the_final_steps(tmp_path):
+    from main import train_coarse_to_fine
+    model = make_model()
+    gym = make_gym(model, tmp_path)
+    args = argparse.Namespace(num_epochs=5, patience=None)
+    train_coarse_to_fine(args, gym, model, num_steps=8)
+    assert model.num_of_steps == 8
+    assert all(batch.num_steps == 8 for batch in gym.train_loader)
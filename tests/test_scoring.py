@@ -0,0 +1,94 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from models.build import build_model
+from models.scoring import StepwiseScorer
+
+
+def make_model_and_scorer(num_nodes=30):
+    torch.manual_seed(0)
+    model = build_model(vectorized=2, num_nodes=num_nodes, model_beta=1.5, device='cpu', max_time=10., num_steps=4)
+    with torch.no_grad():
+        model.z0.mul_(4.)
+    scorer = StepwiseScorer(z0=model.z0, v0=model.v0, beta=model.beta, max_time=10.)
+    return model, scorer
+
+
+TIMES = torch.tensor([0., 1.3, 2.5, 4.9, 5., 7.5, 9.99, 10.])
+
+
+def test_positions_and_log_intensities_match_the_model():
+    model, scorer = make_model_and_scorer()
+    with torch.no_grad():
+        model_positions = model.steps(TIMES)
+        model_log_intensities = model.log_intensity_function(TIMES)
+    assert torch.allclose(scorer.positions(TIMES), model_positions.permute(2,0,1).double(), atol=1e-5)
+    i, j = torch.randint(0, 30, (len(TIMES),)), torch.randint(0, 30, (len(TIMES),))
+    expected = model_log_intensities[i, j, torch.arange(len(TIMES))].double()
+    assert torch.allclose(scorer.log_intensity(i, j, TIMES), expected, atol=1e-4)
+
+
+def test_expected_counts_match_quadrature():
+    _, scorer = make_model_and_scorer()
+    i, j = torch.tensor([0, 3, 7, 12, 5]), torch.tensor([1, 4, 20, 29, 5])
+    ## Intervals inside one step, across step boundaries, over the whole window and past its end
+    t0, tn = torch.tensor([0.5, 1., 0., 7., 9.]), torch.tensor([2., 8.5, 10., 7., 13.])
+    expected_counts = scorer.expected_count(i, j, t0, tn)
+    for q in range(len(i)):
+        t = torch.linspace(t0[q].item(), tn[q].item(), 40001, dtype=torch.float64)
+        intensities = torch.exp(scorer.log_intensity(i[q].repeat(len(t)), j[q].repeat(len(t)), t))
+        assert expected_counts[q].item() == pytest.approx(torch.trapz(intensities, t).item(), rel=1e-6, abs=1e-12)
+
+
+def test_expected_counts_of_all_pairs_sum_to_the_model_integral():
+    model, scorer = make_model_and_scorer()
+    i, j = torch.triu_indices(30, 30, offset=1)
+    expected_counts = scorer.expected_count(i, j, torch.zeros(len(i)), torch.full((len(i),), 10.))
+    ## The model integrates every step over [t0, tn] relative to its start, so one step size covers every step once
+    with torch.no_grad():
+        assert torch.sum(expected_counts).item() == pytest.approx(model.integral(0., model.step_size).item(), rel=1e-4)
+
+
+def brute_force_top_k(scorer, i, t, k):
+    positions = scorer.positions([t])[0]
+    sq_dists = torch.sum(torch.square(positions - positions[i]), dim=1)
+    sq_dists[i] = float('inf')
+    return torch.argsort(sq_dists)[:k]
+
+
+@pytest.mark.parametrize('spatial_index', [False, True])
+def test_top_k_partners_are_the_nearest_nodes(spatial_index):
+    _, scorer = make_model_and_scorer()
+    if spatial_index:
+        scorer.build_spatial_index(nodes_per_cell=2.)
+    nodes = torch.arange(0, 30, 4)
+    times = torch.linspace(0., 10., len(nodes))
+    partners, log_intensities = scorer.top_k_partners(nodes, times, k=5)
+    assert partners.shape == (len(nodes), 5)
+    for q, (node, t) in enumerate(zip(nodes.tolist(), times.tolist())):
+        assert partners[q].tolist() == brute_force_top_k(scorer, node, t, 5).tolist()
+        expected = scorer.log_intensity(torch.full((5,), node), partners[q], torch.full((5,), t))
+        assert torch.allclose(log_intensities[q], expected, atol=1e-9)
+
+
+def test_partners_within_are_the_nodes_above_the_log_intensity():
+    _, scorer = make_model_and_scorer()
+    nodes = torch.arange(30)
+    for node, t in [(0, 0.), (11, 3.3), (29, 10.)]:
+        partners, log_intensities = scorer.partners_within(node, t, min_log_intensity=-4.)
+        all_log_intensities = scorer.log_intensity(torch.full((30,), node), nodes, torch.full((30,), t))
+        expected = [int(n) for n in nodes if n != node and all_log_intensities[n] >= -4.]
+        assert sorted(partners.tolist()) == expected
+        assert torch.allclose(log_intensities, all_log_intensities[partners], atol=1e-9)
+
+
+def test_scorer_loads_the_saved_parameters(tmp_path):
+    model, scorer = make_model_and_scorer()
+    for name in ['z0', 'v0', 'beta']:
+        torch.save(getattr(model, name).detach(), tmp_path / f'final_{name}.pt')
+    with pytest.raises(Exception):
+        StepwiseScorer.from_params_dir(str(tmp_path))
+    torch.save(torch.tensor(10.), tmp_path / 'final_max_time.pt')
+    loaded = StepwiseScorer.from_params_dir(str(tmp_path))
+    assert torch.equal(loaded.positions(TIMES), scorer.positions(TIMES))
@@ -0,0 +1,78 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+torch = pytest.importorskip('torch')
+
+from utils.nodes.spatial_index import StepGrid, StepwiseSpatialIndex
+
+
+def brute_force(start_positions, velocities, point, offset, exclude):
+    sq_dists = np.sum(np.square(start_positions + velocities*offset - point), axis=1)
+    if exclude is not None:
+        sq_dists[exclude] = np.inf
+    order = np.argsort(sq_dists, kind='stable')
+    return order, sq_dists[order]
+
+
+def random_step(num_nodes=200, clustered=False, seed=0):
+    rng = np.random.default_rng(seed)
+    if clustered:
+        ## Most nodes in a few tight clusters and some far outliers, so many grid cells are empty
+        centers = rng.uniform(-20, 20, size=(4, 2))
+        start_positions = centers[rng.integers(0, 4, num_nodes)] + rng.normal(scale=0.3, size=(num_nodes, 2))
+        start_positions[:5] = rng.uniform(-40, 40, size=(5, 2))
+    else:
+        start_positions = rng.uniform(-5, 5, size=(num_nodes, 2))
+    return start_positions, rng.normal(scale=2., size=(num_nodes, 2))
+
+
+@pytest.mark.parametrize('clustered', [False, True])
+@pytest.mark.parametrize('cell_size', [0.3, 1., 50.])
+@pytest.mark.parametrize('offset', [0., 0.4, 3.])
+def test_knn_is_the_brute_force_knn(clustered, cell_size, offset):
+    start_positions, velocities = random_step(clustered=clustered)
+    grid = StepGrid(start_positions, velocities, cell_size)
+    positions = grid.positions(offset)
+    for node in [0, 17, 101, 199]:
+        for k in [1, 7, 199]:
+            nodes, sq_dists = grid.knn(positions[node], offset, k, exclude=node)
+            expected_nodes, expected_sq_dists = brute_force(start_positions, velocities, positions[node], offset, node)
+            assert nodes.tolist() == expected_nodes[:k].tolist()
+            assert np.allclose(sq_dists, expected_sq_dists[:k])
+
+
+@pytest.mark.parametrize('clustered', [False, True])
+@pytest.mark.parametrize('offset', [0., 0.4, 3.])
+def test_radius_is_the_brute_force_radius(clustered, offset):
+    start_positions, velocities = random_step(clustered=clustered, seed=1)
+    grid = StepGrid(start_positions, velocities, cell_size=0.7)
+    point = np.array([0.3, -0.2])
+    for radius in [0., 0.5, 2., 300.]:
+        nodes, sq_dists = grid.radius(point, offset, radius)
+        expected_nodes, expected_sq_dists = brute_force(start_positions, velocities, point, offset, None)
+        inside = expected_sq_dists <= radius**2
+        assert nodes.tolist() == expected_nodes[inside].tolist()
+        assert np.allclose(sq_dists, expected_sq_dists[inside])
+
+
+def test_knn_returns_every_other_node_when_k_exceeds_them():
+    start_positions, velocities = random_step(num_nodes=5)
+    grid = StepGrid(start_positions, velocities, cell_size=1.)
+    nodes, sq_dists = grid.knn(start_positions[2], 0., k=10, exclude=2)
+    assert sorted(nodes.tolist()) == [0, 1, 3, 4]
+    assert np.all(np.diff(sq_dists) >= 0)
+
+
+def test_stepwise_index_queries_the_grid_of_the_step():
+    rng = np.random.default_rng(2)
+    num_nodes, num_steps = 60, 3
+    v0 = rng.normal(size=(num_nodes, 2, num_steps))
+    start_times, end_times = np.array([0., 2., 4.]), np.array([2., 4., 6.])
+    steps_z0 = np.cumsum(np.concatenate([rng.uniform(-3, 3, size=(num_nodes, 2, 1)), v0[:,:,:-1]*2.], axis=2), axis=2)
+    index = StepwiseSpatialIndex(steps_z0, v0, start_times, end_times, nodes_per_cell=2.)
+    for t, step, offset in [(0., 0, 0.), (1.5, 0, 1.5), (2., 0, 2.), (3., 1, 1.), (6., 2, 2.)]:
+        assert np.allclose(index.positions(t), steps_z0[:,:,step] + v0[:,:,step]*offset)
+        for node in [0, 33]:
+            nodes, _ = index.knn(node, t, k=4)
+            expected_nodes, _ = brute_force(steps_z0[:,:,step], v0[:,:,step], index.positions(t)[node], offset, node)
+            assert nodes.tolist() == expected_nodes[:4].tolist()
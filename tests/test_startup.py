@@ -0,0 +1,35 @@
+import subprocess
+import sys
+import pytest
+
+from conftest import SRC_DIR
+
+pytest.importorskip('torch')
+
+## Packages which only the commands and options using them may import
+LAZY_PACKAGES = ['wandb', 'sklearn', 'scipy', 'matplotlib', 'pandas', 'plotly', 'ignite']
+## Cumulative import time of main on top of torch and numpy, in microseconds
+IMPORT_TIME_BUDGET_US = 1_000_000
+
+
+def run_python(code:str, *options) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *options, '-c', code], cwd=SRC_DIR, capture_output=True, text=True, check=True)
+
+
+def test_main_does_not_import_heavy_packages():
+    code = 'import sys, main; print(",".join(sorted(name for name in sys.modules if "." not in name)))'
+    loaded = set(run_python(code).stdout.strip().split(','))
+    assert not loaded & set(LAZY_PACKAGES), f'main imports {sorted(loaded & set(LAZY_PACKAGES))} at startup'
+
+
+def test_main_import_time_within_budget():
+    ## torch and numpy are imported first, so the cumulative time of main is what main adds on top of them
+    result = run_python('import torch, numpy; import main', '-X', 'importtime')
+    main_cumulative = None
+    for line in result.stderr.splitlines():
+        ## Lines read "import time: <self us> | <cumulative us> | <indented module name>"
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].rstrip() == ' main':
+            main_cumulative = int(fields[1])
+    assert main_cumulative is not None, 'main missing from the -X importtime output'
+    assert main_cumulative < IMPORT_TIME_BUDGET_US, f'Importing main takes {main_cumulative} us, the budget is {IMPORT_TIME_BUDGET_US} us'
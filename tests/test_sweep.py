@@ -0,0 +1,67 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('ignite')
+
+import sweep
+from traintestgyms.ignitegym import TrainTestGym
+from traintestgyms.locallogger import LocalRunLogger
+
+NUM_NODES = 5
+
+
+def make_info(output_dir:str, dataset:torch.Tensor) -> dict:
+    return {'num_nodes': NUM_NODES, 'num_dyads': NUM_NODES*(NUM_NODES-1)/2, 'model_beta': 1., 'z0': None, 'v0': None,
+            'vectorized': 2, 'device': 'cpu', 'max_time': dataset[-1,2].item(), 'num_epochs': 3, 'batch_size': 40,
+            'keep_rotation': False, 'tolerance': None, 'patience': None, 'min_delta': 0., 'output_dir': output_dir}
+
+
+def make_dataset() -> torch.Tensor:
+    generator = torch.Generator().manual_seed(0)
+    i = torch.randint(0, NUM_NODES-1, (100,), generator=generator)
+    j = i + 1 + torch.randint(0, NUM_NODES-1, (100,), generator=generator) % (NUM_NODES-1-i)
+    t = torch.sort(torch.rand(100, generator=generator, dtype=torch.float64)*10).values
+    return torch.stack([i.double(), j.double(), t], dim=1)
+
+
+def test_batches_are_prepared_once_per_step_count_in_shared_memory(tmp_path):
+    dataset = make_dataset()
+    batches = sweep.prepare_shared_batches(dataset, make_info(str(tmp_path), dataset), [2, 4])
+    for num_steps in [2, 4]:
+        assert len(batches[num_steps]) == 3
+        for batch in batches[num_steps]:
+            assert batch.num_steps == num_steps
+            assert batch.t.is_shared() and batch.src.is_shared() and batch.step_statistics.count.is_shared()
+
+
+def test_worker_trains_on_the_shared_batches(tmp_path):
+    dataset = make_dataset()
+    info = make_info(str(tmp_path), dataset)
+    batches = sweep.prepare_shared_batches(dataset, info, [2])
+    statistics = [batch.step_statistics for batch in batches[2]]
+    sweep._init_worker(batches, info, threads_per_worker=None)
+    row = sweep._train_config({'seed': 3, 'steps': 2, 'learning_rate': 0.05, 'velocity_gamma_regularization': None})
+    assert row['status'] == 'ok'
+    ## The shared batches are used as they are, not prepared again
+    assert all(batch.step_statistics is statistics for batch, statistics in zip(batches[2], statistics))
+
+    ## Same loss as a run which prepares the tensor dataset itself
+    torch.manual_seed(3)
+    model = sweep.sweep_model(info, 2)
+    metrics = {'avg_train_loss': [], 'beta_est': []}
+    gym = TrainTestGym(dataset=dataset, model=model, device='cpu', batch_size=info['batch_size'],
+                        optimizer=torch.optim.Adam(model.parameters(), lr=0.05), metrics=metrics, time_column_idx=2,
+                        wandb_handler=LocalRunLogger(str(tmp_path / 'tensor')), num_dyads=info['num_dyads'], keep_rotation=False)
+    gym.train_test_model(epochs=info['num_epochs'])
+    assert row['final_avg_train_loss'] == pytest.approx(metrics['avg_train_loss'][-1], rel=1e-6)
+
+
+def test_batches_prepared_for_other_steps_are_rejected(tmp_path):
+    dataset = make_dataset()
+    info = make_info(str(tmp_path), dataset)
+    batches = sweep.prepare_shared_batches(dataset, info, [2])
+    model = sweep.sweep_model(info, 4)
+    with pytest.raises(Exception, match='prepared for 2 steps'):
+        TrainTestGym(dataset=batches[2], model=model, device='cpu', batch_size=info['batch_size'],
+                        optimizer=torch.optim.Adam(model.parameters()), metrics={'avg_train_loss': [], 'beta_est': []},
+                        time_column_idx=2, wandb_handler=LocalRunLogger(str(tmp_path)), num_dyads=info['num_dyads'], keep_rotation=False)
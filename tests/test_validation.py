@@ -0,0 +1,69 @@
+import math
+import pytest
+
+torch = pytest.importorskip('torch')
+
+pytest.importorskip('ignite')
+
+from data.events import EventSet
+from models.build import build_model
+from models.betaprofile import thinned_nll
+from traintestgyms.ignitegym import TrainTestGym
+from traintestgyms.locallogger import LocalRunLogger
+
+
+def make_model_and_events(gamma=None):
+    torch.manual_seed(0)
+    model = build_model(vectorized=2, num_nodes=4, model_beta=1., device='cpu', max_time=10., num_steps=2,
+                        velocity_gamma_regularization=gamma)
+    data = torch.tensor([[0, 1, 0.5], [1, 2, 2.], [0, 3, 4.5], [2, 3, 6.], [0, 1, 9.5]], dtype=torch.float64)
+    events = EventSet.from_tensor(data, num_nodes=4).prepare('cpu', start_times=model.start_times, end_times=model.end_times)
+    return model, events
+
+
+@pytest.mark.parametrize('fraction', [0.1, 0.3])
+def test_thinned_nll_is_the_nll_at_the_thinned_beta(fraction):
+    model, events = make_model_and_events()
+    with torch.no_grad():
+        nll = thinned_nll(model, events, 0., 10., fraction)
+        model.beta.add_(math.log(fraction / (1 - fraction)))
+        expected = model(events, t0=0., tn=10.)
+    assert nll.item() == pytest.approx(expected.item(), rel=1e-5)
+
+
+def test_thinned_nll_weights_the_held_out_events():
+    ## Held out with probability 0.1 the integral is 1/9 of the one of the training events
+    model, events = make_model_and_events()
+    with torch.no_grad():
+        integral = model.integral(0., 10.).item()
+        event_nll = model(events, t0=0., tn=10.).item() - integral
+        nll = thinned_nll(model, events, 0., 10., 0.1).item()
+    assert nll == pytest.approx(event_nll - len(events)*math.log(1/9) + integral/9, rel=1e-5)
+
+
+def test_thinned_nll_leaves_out_the_regularization():
+    model, events = make_model_and_events(gamma=10.)
+    with torch.no_grad():
+        nll = thinned_nll(model, events, 0., 10., 0.1)
+        model.gamma = None
+        expected = thinned_nll(model, events, 0., 10., 0.1)
+    assert nll.item() == pytest.approx(expected.item(), rel=1e-6)
+
+
+def test_validation_nll_is_scored_over_the_training_window(tmp_path):
+    model, _ = make_model_and_events(gamma=10.)
+    train = torch.tensor([[0, 1, 1.], [1, 2, 2.5], [0, 3, 4.], [2, 3, 6.5], [1, 3, 8.]], dtype=torch.float64)
+    held_out = torch.tensor([[0, 2, 3.], [1, 2, 7.]], dtype=torch.float64)
+    num_dyads = 6
+    gym = TrainTestGym(dataset=train, model=model, device='cpu', batch_size=len(train),
+                        optimizer=torch.optim.Adam(model.parameters(), lr=0.01), metrics={'avg_train_loss': [], 'beta_est': []},
+                        time_column_idx=2, wandb_handler=LocalRunLogger(str(tmp_path)), num_dyads=num_dyads, keep_rotation=False,
+                        patience=5, validation_data=held_out, validation_fraction=0.1)
+    gym.train_test_model(epochs=1)
+
+    ## The first epoch integrates from 0 to the last training event, the restored best state is the one it was scored with
+    model.gamma = None
+    with torch.no_grad():
+        events = EventSet.from_tensor(held_out, num_nodes=4).prepare('cpu', start_times=model.start_times, end_times=model.end_times)
+        expected = thinned_nll(model, events, 0., 8., 0.1).item() / num_dyads
+    assert gym.best['loss'] == pytest.approx(expected, rel=1e-5)
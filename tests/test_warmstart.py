@@ -0,0 +1,100 @@
+import math
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from utils.nodes.warmstart import window_counts, log_count_squared_distances, classical_mds, spectral_embedding, \
+                                    procrustes_align, warm_start_positions
+
+
+START_TIMES, END_TIMES = torch.tensor([0., 5.]), torch.tensor([5., 10.])
+
+
+def sq_distances_of(positions:torch.Tensor) -> torch.Tensor:
+    return torch.sum(torch.square(positions.unsqueeze(0) - positions.unsqueeze(1)), dim=2)
+
+
+def community_events(num_nodes=12, seed=0):
+    ## Two communities which interact often within and rarely across
+    generator = torch.Generator().manual_seed(seed)
+    i, j = torch.triu_indices(num_nodes, num_nodes, offset=1)
+    same = (i < num_nodes // 2) == (j < num_nodes // 2)
+    rate = torch.where(same, torch.tensor(6.), torch.tensor(0.2))
+    counts = torch.poisson(rate.repeat(2), generator=generator).long()
+    src, dst = i.repeat(2).repeat_interleave(counts), j.repeat(2).repeat_interleave(counts)
+    window = torch.arange(2).repeat_interleave(len(i)).repeat_interleave(counts)
+    t = window*5. + torch.rand(len(src), generator=generator, dtype=torch.float64)*5.
+    return src, dst, t
+
+
+def test_window_counts_count_every_event_once_per_direction():
+    src, dst = torch.tensor([0, 1, 0, 2]), torch.tensor([1, 2, 1, 3])
+    t = torch.tensor([0., 4.9, 5., 7.])
+    counts = window_counts(src, dst, t, 4, START_TIMES)
+    assert counts.shape == (2, 4, 4)
+    assert torch.equal(counts, counts.transpose(1, 2))
+    ## The end of the first step belongs to the first step
+    assert counts[0,0,1] == 2 and counts[0,1,2] == 1 and counts[1,2,3] == 1
+    assert torch.sum(counts) == 2*len(t)
+
+
+def test_log_count_distances_are_zero_for_the_most_active_pair():
+    counts = window_counts(*community_events(), 12, START_TIMES)
+    sq_distances = log_count_squared_distances(counts)
+    assert torch.all(sq_distances >= 0)
+    assert torch.all(sq_distances.diagonal(dim1=-2, dim2=-1) == 0)
+    most_active = torch.argmax(counts)
+    assert sq_distances.flatten()[most_active] == 0
+    assert sq_distances[0,0,11] > sq_distances[0,0,1]
+
+
+def test_classical_mds_recovers_the_distances_of_planar_positions():
+    torch.manual_seed(0)
+    positions = torch.rand(10, 2, dtype=torch.float64)*4
+    embedded = classical_mds(sq_distances_of(positions))
+    assert embedded.shape == (10, 2)
+    assert torch.allclose(embedded.mean(dim=0), torch.zeros(2, dtype=torch.float64), atol=1e-9)
+    assert torch.allclose(sq_distances_of(embedded), sq_distances_of(positions), atol=1e-8)
+
+
+@pytest.mark.parametrize('reflect', [False, True])
+def test_procrustes_undoes_rotations_and_reflections(reflect):
+    torch.manual_seed(0)
+    reference = torch.rand(10, 2, dtype=torch.float64)
+    reference = reference - reference.mean(dim=0)
+    angle = 1.1
+    transform = torch.tensor([[math.cos(angle), -math.sin(angle)], [math.sin(angle), math.cos(angle)]], dtype=torch.float64)
+    if reflect:
+        transform = transform @ torch.tensor([[1., 0.], [0., -1.]], dtype=torch.float64)
+    assert torch.allclose(procrustes_align(reference @ transform, reference), reference, atol=1e-9)
+
+
+def test_spectral_embedding_separates_the_communities():
+    counts = window_counts(*community_events(), 12, START_TIMES)[0]
+    sq_distances = log_count_squared_distances(counts.unsqueeze(0))[0]
+    positions = spectral_embedding(counts, sq_distances)
+    assert positions.shape == (12, 2)
+    assert torch.allclose(positions.mean(dim=0), torch.zeros(2, dtype=torch.float64), atol=1e-9)
+    embedded = sq_distances_of(positions)
+    within, across = embedded[:6,:6].sum() / 30, embedded[:6,6:].mean()
+    assert across > within
+
+
+@pytest.mark.parametrize('method', ['mds', 'spectral'])
+def test_warm_start_moves_the_nodes_through_the_windows(method):
+    src, dst, t = community_events()
+    start_times, end_times = torch.tensor([0., 2.5, 5., 7.5]), torch.tensor([2.5, 5., 7.5, 10.])
+    z0, v0 = warm_start_positions(src, dst, t, 12, start_times, end_times, method=method)
+    assert z0.shape == (12, 2) and v0.shape == (12, 2, 4)
+    assert torch.all(torch.isfinite(z0)) and torch.all(torch.isfinite(v0))
+    ## The last step keeps the velocity of the step before it
+    assert torch.equal(v0[:,:,-1], v0[:,:,-2])
+    ## Nodes of a community start closer to each other than to the other community
+    embedded = sq_distances_of(z0)
+    assert embedded[:6,6:].mean() > embedded[:6,:6].sum() / 30
+
+
+def test_warm_start_rejects_unknown_methods():
+    src, dst, t = community_events()
+    with pytest.raises(Exception):
+        warm_start_positions(src, dst, t, 12, START_TIMES, END_TIMES, method='random')